@@ -0,0 +1,330 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from io import StringIO
+from math import floor
+
+# must be set before pygame creates a display
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import numpy as np  # noqa: E402
+import pygame as pg  # noqa: E402
+
+import message  # noqa: E402
+from editor import EditorFrame  # noqa: E402
+from instruction import from_json_value, to_json_value  # noqa: E402
+from model import InstructionBuilderModel  # noqa: E402
+from plan_io import read_plan, write_plan  # noqa: E402
+from store import InstructionStore, POINT_COUNT, OP_BLADE_ON, \
+    OP_BLADE_OFF, OP_LINE, OP_CURVE  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+VISUALIZER_DIR = os.path.join(HERE, "debug-visualizer")
+
+sys.path.append(VISUALIZER_DIR)
+import binary_trace  # noqa: E402
+from scene import Scene, draw_messages  # noqa: E402
+from sim_trace import SimTrace  # noqa: E402
+
+EDITOR_SIZE = (1100, 800)
+VISUALIZER_SIZE = (1280, 960)
+# states the visualizer moves on per frame, about real time at 60 fps
+FRAME_SKIP = 16
+# share of a synthetic plan that toggles the blade, and of the rest that
+# are curves
+BLADE_SHARE = 0.05
+CURVE_SHARE = 0.3
+
+
+def fold(points, size):
+    # reflects points into [0, size] on both axes, keeping a path connected
+    return size - np.abs(np.mod(points, 2.0 * size) - size)
+
+
+def synthetic_plan(n, seed=0, size=100.0):
+    # n instructions wandering around a size meters square: connected
+    # Lines and CubicBeziers with the blade turned on and off between
+    # them, ending on a Line. Returns an InstructionStore.
+    rng = np.random.default_rng(seed)
+    kind = rng.random(n)
+    ops = np.where(kind < CURVE_SHARE, OP_CURVE, OP_LINE).astype(np.int8)
+    toggles = np.nonzero(kind > 1.0 - BLADE_SHARE)[0]
+    ops[toggles] = np.where(np.arange(len(toggles)) % 2 == 0,
+                            OP_BLADE_ON, OP_BLADE_OFF)
+    if n > 0:
+        ops[-1] = OP_LINE
+
+    moving = np.nonzero(ops >= OP_LINE)[0]
+    heading = np.cumsum(rng.normal(0.0, 0.6, len(moving)))
+    length = rng.uniform(0.5, 3.0, len(moving))
+    steps = np.column_stack([np.cos(heading), np.sin(heading)]) \
+        * length[:, None]
+    walk = size / 2 + np.concatenate([[[0.0, 0.0]],
+                                      np.cumsum(steps, axis=0)])
+    start, end = walk[:-1], walk[1:]
+    chord = end - start
+    bend = chord[:, ::-1] * [-1.0, 1.0] \
+        * rng.uniform(-0.5, 0.5, (len(moving), 1))
+
+    counts = POINT_COUNT[ops]
+    offsets = np.cumsum(counts) - counts
+    points = np.zeros((int(counts.sum()), 2))
+    first = offsets[moving]
+    curves = ops[moving] == OP_CURVE
+    last = first + np.where(curves, 3, 1)
+    points[first] = start
+    points[last] = end
+    points[first[curves] + 1] = start[curves] + chord[curves] / 3 \
+        + bend[curves]
+    points[first[curves] + 2] = start[curves] + 2 * chord[curves] / 3 \
+        - bend[curves]
+
+    store = InstructionStore()
+    store.append_arrays(ops, fold(points, size))
+    return store
+
+
+def write_synthetic_trace(path, steps, seed=0):
+    # A SimOutput trace of steps states, in the layout the simulator
+    # writes: the robot circling and drifting, the blade on and off every
+    # few seconds, and debug messages and renderables in every state.
+    rng = np.random.default_rng(seed)
+    t = np.arange(steps) * 0.001
+    x = 3.0 * np.cos(t * 0.5) + t * 0.1
+    y = 3.0 * np.sin(t * 0.5) + rng.normal(0.0, 0.001, steps)
+    theta = t * 0.5 + np.pi / 2
+    blade = (np.arange(steps) // 3000) % 2 == 0
+    x, y, theta, blade = x.tolist(), y.tolist(), theta.tolist(), \
+        blade.tolist()
+    with open(path, "w") as f:
+        f.write('{"states":[')
+        for i in range(steps):
+            debug = {"messages": [f"Steps since last idle: {i}",
+                                  f"Robot Position: ({x[i]:.3f}, "
+                                  f"{y[i]:.3f})",
+                                  f"Left Motor Power: {0.5:+5.2f}"],
+                     "renderables": [
+                         f"Line(({x[i] + 0.5!r}, {y[i]!r}), "
+                         f"({x[i]!r}, {y[i]!r}), 4, (255, 0, 0))",
+                         "Circle((1.0, -2.5), 0.1, (0, 0, 255))"]}
+            state = {"robot_x": x[i], "robot_y": y[i],
+                     "robot_theta": theta[i], "blade_on": blade[i],
+                     "debug": debug}
+            if i > 0:
+                f.write(",")
+            f.write(json.dumps(state, separators=(",", ":")))
+        f.write('],"delta_time":{"secs":0,"nanos":1000000},'
+                '"wheel_distance":0.7,"wheel_radius":0.2,'
+                '"max_motor_speed":31.41592653589793,"blade_radius":0.25}')
+
+
+def measure(run, repeat, warmup=1):
+    # run() repeat times after warmup untimed ones, in milliseconds
+    for _ in range(warmup):
+        run()
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        times.append((time.perf_counter() - started) * 1000)
+    return {"median_ms": statistics.median(times), "min_ms": min(times),
+            "runs": repeat}
+
+
+class Benchmarks:
+    # Everything the benchmarks work on, made once. Each benchmark method
+    # returns the function to time; they are run in the order below.
+    NAMES = ("editor_redraw", "editor_drag", "visualizer_frame",
+             "json_round_trip", "export", "import", "trace_load_json",
+             "trace_load_binary")
+
+    def __init__(self, args, directory):
+        self.args = args
+        self.store = synthetic_plan(args.instructions, args.seed)
+        self.model = InstructionBuilderModel()
+        self.model.instructions.append_arrays(self.store.ops_view(),
+                                              self.store.points_view())
+        self.model.reindex()
+        self.params = self.model.sim_params()
+
+        self.json_path = os.path.join(directory, "trace.sim")
+        self.binary_path = os.path.join(directory, "trace.bin")
+        write_synthetic_trace(self.json_path, args.trace_steps, args.seed)
+        binary_trace.convert(self.json_path, self.binary_path)
+
+    def editor_redraw(self):
+        # everything drawn again, as after an edit before the last
+        # instruction or moving the camera
+        editor = EditorFrame(EDITOR_SIZE, self.model)
+
+        def run():
+            self.model.revision += 1
+            editor.update()
+        return run
+
+    def editor_drag(self):
+        # dragging the end of the last instruction: the committed layers
+        # are kept
+        editor = EditorFrame(EDITOR_SIZE, self.model)
+        end = tuple(self.model.end_point())
+        frame = [0]
+
+        def run():
+            frame[0] += 1
+            offset = 0.01 * (frame[0] % 50)
+            self.model.receive(message.UpdatePoint(
+                1, (end[0] + offset, end[1] - offset)))
+            editor.update()
+        return run
+
+    def visualizer_frame(self):
+        # playing the trace back, following the robot
+        screen = pg.Surface(VISUALIZER_SIZE)
+        font = pg.font.Font(pg.font.get_default_font(),
+                            floor(VISUALIZER_SIZE[1] / 40))
+        trace = binary_trace.BinaryTrace(self.binary_path)
+        scale = VISUALIZER_SIZE[1] / 10
+        scene = Scene(trace, scale,
+                      pg.image.load(os.path.join(VISUALIZER_DIR,
+                                                 "robotDS.png")),
+                      pg.image.load(os.path.join(VISUALIZER_DIR,
+                                                 "grass.png")))
+        camera = pg.Rect(0, 0, *VISUALIZER_SIZE)
+        index = [0]
+
+        def run():
+            i = index[0] = (index[0] + FRAME_SKIP) % len(trace)
+            camera.center = (trace.robot_x[i] * scale,
+                             -trace.robot_y[i] * scale)
+            lines = [f"Time: {i * trace.delta_time:.3f}",
+                     f"Frame {i}/{len(trace)}"]
+            draw_messages(screen, font,
+                          lines + scene.draw(screen, camera, i))
+        return run
+
+    def json_round_trip(self):
+        instructions = list(self.store)
+
+        def run():
+            for instruction in instructions:
+                from_json_value(to_json_value(instruction))
+        return run
+
+    def export(self):
+        # what export_instructions writes, to memory
+        def run():
+            write_plan(StringIO(), self.params, self.store)
+        return run
+
+    def import_(self):
+        f = StringIO()
+        write_plan(f, self.params, self.store)
+        text = f.getvalue()
+
+        def run():
+            _, ops, points = read_plan(StringIO(text))
+            InstructionStore().append_arrays(ops, points)
+        return run
+
+    def trace_load_json(self):
+        def run():
+            SimTrace(self.json_path).load()
+        return run
+
+    def trace_load_binary(self):
+        # opening it, and touching every pose and debug info like a full
+        # playback would
+        def run():
+            trace = binary_trace.BinaryTrace(self.binary_path)
+            sum(trace.robot_x)
+            trace.debug(len(trace) - 1)
+        return run
+
+    def run(self, name):
+        make = getattr(self, "import_" if name == "import" else name)
+        repeat = self.args.repeat
+        if name.startswith("trace_load"):
+            repeat = max(1, repeat // 4)
+        return measure(make(), repeat)
+
+
+def git_commit():
+    # (commit, whether the tree has changes), or (None, None) outside git
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=HERE,
+                                capture_output=True, text=True, check=True)
+        status = subprocess.run(["git", "status", "--porcelain"], cwd=HERE,
+                                capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit.stdout.strip(), status.stdout.strip() != ""
+
+
+def compare(results, path):
+    # each benchmark's median against the one in the results at path
+    with open(path, "r") as f:
+        old = json.load(f)
+    print(f"against {old.get('commit') or path}:")
+    for name, result in results.items():
+        before = old["results"].get(name)
+        if before is None:
+            continue
+        ratio = result["median_ms"] / before["median_ms"]
+        print(f"  {name}: {before['median_ms']:.3f} -> "
+              f"{result['median_ms']:.3f} ms ({ratio:.2f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time the editor, the visualizer, plan serialization "
+                    "and trace loading on synthetic data, headless")
+    parser.add_argument("--instructions", type=int, default=10000,
+                        help="instructions in the synthetic plan")
+    parser.add_argument("--trace-steps", type=int, default=20000,
+                        help="states in the synthetic trace")
+    parser.add_argument("--repeat", type=int, default=20,
+                        help="timed runs of each benchmark, a quarter of "
+                             "that for trace loading")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="+", choices=Benchmarks.NAMES,
+                        help="benchmarks to run, all by default")
+    parser.add_argument("--output",
+                        help="results JSON, benchmark-<commit>.json by "
+                             "default")
+    parser.add_argument("--compare", metavar="RESULTS",
+                        help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    pg.init()
+    pg.display.set_mode((1, 1))
+    commit, dirty = git_commit()
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        benchmarks = Benchmarks(args, directory)
+        for name in args.only or Benchmarks.NAMES:
+            results[name] = benchmarks.run(name)
+            print(f"{name}: {results[name]['median_ms']:.3f} ms median, "
+                  f"{results[name]['min_ms']:.3f} ms min")
+    pg.quit()
+
+    output = args.output or f"benchmark-{(commit or 'unknown')[:10]}.json"
+    with open(output, "w") as f:
+        json.dump({"commit": commit, "dirty": dirty,
+                   "date": datetime.now(timezone.utc).isoformat(),
+                   "python": platform.python_version(),
+                   "pygame": pg.version.ver, "numpy": np.__version__,
+                   "platform": platform.platform(),
+                   "parameters": {"instructions": args.instructions,
+                                  "trace_steps": args.trace_steps,
+                                  "repeat": args.repeat, "seed": args.seed},
+                   "results": results}, f, indent=2)
+    print(f"wrote {output}")
+    if args.compare:
+        compare(results, args.compare)
@@ -0,0 +1,188 @@
+import argparse
+import gzip
+import json
+import lzma
+import mmap
+import shutil
+import struct
+import tempfile
+from array import array
+
+import numpy as np
+
+from debug import Debug
+from sim_trace import Duration, TraceReader
+
+# Layout, little endian:
+#   header      HEADER, padded to SECTION_ALIGN
+#   poses       robot_x[n] f64, robot_y[n] f64, robot_theta[n] f64,
+#               blade_on[n] u8 (padded to 8), optionally compressed
+#   debug index (n + 1) u64 offsets into the debug data
+#   debug data  compact JSON of each state's debug info, back to back
+MAGIC = b"ISPTRACE"
+VERSION = 1
+HEADER = struct.Struct("<8sIIIQQIddddQQQQQ")
+SECTION_ALIGN = 64
+
+CODECS = {"none": 0, "gzip": 1, "lzma": 2}
+FLAG_DELTA = 1
+
+
+def align(n, to=8):
+    return (n + to - 1) // to * to
+
+
+def xor_delta(column: bytes) -> bytes:
+    # each f64 is replaced by the xor of its bits with the previous one,
+    # which leaves mostly zero bytes for slowly changing values
+    x = np.frombuffer(column, "<u8")
+    delta = x.copy()
+    delta[1:] ^= x[:-1]
+    return delta.tobytes()
+
+
+def xor_undelta(column) -> memoryview:
+    # prefix xor over 64 bit lanes, as bytes for memoryview.cast
+    x = np.bitwise_xor.accumulate(np.frombuffer(column, "<u8"))
+    return memoryview(x.view(np.uint8))
+
+
+def is_binary_trace(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def convert(json_path, out_path, codec="none", delta=False):
+    robot_x = array('d')
+    robot_y = array('d')
+    robot_theta = array('d')
+    blade_on = array('B')
+    debug_offsets = array('Q', [0])
+
+    with open(json_path, "rb") as f, \
+            tempfile.TemporaryFile() as debug_data:
+        reader = TraceReader(f)
+        for _, _, state in reader.states():
+            robot_x.append(state['robot_x'])
+            robot_y.append(state['robot_y'])
+            robot_theta.append(state['robot_theta'])
+            blade_on.append(state['blade_on'])
+            debug = json.dumps(state['debug'], separators=(",", ":"))
+            debug_offsets.append(debug_offsets[-1]
+                                 + debug_data.write(debug.encode()))
+        header = reader.header
+        count = len(robot_x)
+
+        columns = [c.tobytes() for c in (robot_x, robot_y, robot_theta)]
+        if delta:
+            columns = [xor_delta(c) for c in columns]
+        blade = blade_on.tobytes()
+        poses = b"".join(columns) + blade + bytes(align(count) - count)
+        if codec == "gzip":
+            poses = gzip.compress(poses)
+        elif codec == "lzma":
+            poses = lzma.compress(poses)
+
+        pose_offset = align(HEADER.size, SECTION_ALIGN)
+        index_offset = align(pose_offset + len(poses), SECTION_ALIGN)
+        debug_offset = index_offset + debug_offsets.itemsize * (count + 1)
+
+        delta_time = header["delta_time"]
+        with open(out_path, "wb") as out:
+            out.write(HEADER.pack(MAGIC, VERSION, CODECS[codec],
+                                  FLAG_DELTA if delta else 0,
+                                  count,
+                                  delta_time["secs"], delta_time["nanos"],
+                                  header["wheel_distance"],
+                                  header["wheel_radius"],
+                                  header["max_motor_speed"],
+                                  header["blade_radius"],
+                                  pose_offset, len(poses),
+                                  index_offset, debug_offset,
+                                  debug_offsets[-1]))
+            out.write(bytes(pose_offset - HEADER.size))
+            out.write(poses)
+            out.write(bytes(index_offset - pose_offset - len(poses)))
+            out.write(debug_offsets.tobytes())
+            debug_data.seek(0)
+            shutil.copyfileobj(debug_data, out)
+
+
+class BinaryTrace:
+    # Same interface as SimTrace. Uncompressed traces are read straight
+    # out of the memory map, so only the pages that get used are loaded.
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.map)
+
+        (magic, version, codec, flags, count, secs, nanos,
+         self.wheel_distance, self.wheel_radius, self.max_motor_speed,
+         self.blade_radius, pose_offset, pose_size, index_offset,
+         debug_offset, debug_size) = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a binary simulation trace")
+        if version != VERSION:
+            raise ValueError(f"{path}: unsupported trace version {version}")
+        self.delta_time = Duration({"secs": secs, "nanos": nanos}).seconds()
+
+        poses = view[pose_offset:pose_offset + pose_size]
+        if codec == CODECS["gzip"]:
+            poses = memoryview(gzip.decompress(poses))
+        elif codec == CODECS["lzma"]:
+            poses = memoryview(lzma.decompress(poses))
+        elif codec != CODECS["none"]:
+            raise ValueError(f"{path}: unknown pose codec {codec}")
+
+        columns = [poses[i * 8 * count:(i + 1) * 8 * count]
+                   for i in range(3)]
+        if flags & FLAG_DELTA:
+            columns = [xor_undelta(c) for c in columns]
+        self.robot_x, self.robot_y, self.robot_theta = \
+            [c.cast('d') for c in columns]
+        self.blade_on = poses[24 * count:25 * count].cast('B')
+
+        self.debug_offsets = \
+            view[index_offset:debug_offset].cast('Q')
+        self.debug_data = view[debug_offset:debug_offset + debug_size]
+        self.debug_cache = {}
+
+        self.loaded = count
+        self.done = True
+        self.error = None
+
+    def load_in_background(self):
+        pass
+
+    def wait(self):
+        pass
+
+    def __len__(self):
+        return self.loaded
+
+    def debug(self, i) -> Debug:
+        debug = self.debug_cache.get(i)
+        if debug is not None:
+            return debug
+
+        start = self.debug_offsets[i]
+        end = self.debug_offsets[i + 1]
+        debug = Debug(json.loads(self.debug_data[start:end].tobytes()))
+
+        if len(self.debug_cache) >= 64:
+            self.debug_cache.pop(next(iter(self.debug_cache)))
+        self.debug_cache[i] = debug
+        return debug
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert a JSON out.sim trace to the binary format")
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--compress", choices=list(CODECS), default="none")
+    parser.add_argument("--delta", action="store_true",
+                        help="xor delta encode the pose columns")
+    args = parser.parse_args()
+    convert(args.input, args.output, args.compress, args.delta)
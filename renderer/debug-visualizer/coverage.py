@@ -0,0 +1,176 @@
+import argparse
+import json
+
+import numpy as np
+
+from sim_trace import open_trace
+
+
+class CoverageReport:
+    def __init__(self, passes, origin, resolution, inside=None):
+        self.passes = passes          # passes[i, j] for cell column i, row j
+        self.origin = origin          # world position of cell (0, 0) corner
+        self.resolution = resolution  # cell side length in meters
+        self.inside = inside          # mask of cells inside the boundary
+
+        cell_area = resolution * resolution
+        covered = passes > 0
+        self.covered_area = covered.sum() * cell_area
+        self.overlap_area = (passes > 1).sum() * cell_area
+        self.overlap_ratio = (self.overlap_area / self.covered_area
+                              if self.covered_area > 0 else 0.0)
+        self.mean_passes = (passes[covered].mean()
+                            if self.covered_area > 0 else 0.0)
+
+        if inside is None:
+            self.boundary_area = None
+            self.missed_area = None
+        else:
+            self.boundary_area = inside.sum() * cell_area
+            self.missed_area = (inside & ~covered).sum() * cell_area
+
+    def lines(self):
+        lines = [f"Covered area: {self.covered_area:.3f} m^2",
+                 f"Overlap area: {self.overlap_area:.3f} m^2",
+                 f"Overlap ratio: {self.overlap_ratio:.3f}",
+                 f"Mean passes: {self.mean_passes:.3f}"]
+        if self.inside is not None:
+            lines += [f"Boundary area: {self.boundary_area:.3f} m^2",
+                      f"Missed area: {self.missed_area:.3f} m^2"]
+        return lines
+
+
+def disc_offsets(radius):
+    # cell offsets whose centers lie within radius (in cells) of a center
+    n = int(np.ceil(radius))
+    di, dj = np.meshgrid(np.arange(-n, n + 1), np.arange(-n, n + 1),
+                         indexing="ij")
+    inside = di * di + dj * dj <= radius * radius
+    return di[inside], dj[inside]
+
+
+def polygon_mask(polygon, origin, resolution, shape):
+    # even-odd fill of the cells whose centers are inside the polygon
+    polygon = np.asarray(polygon, dtype=np.float64)
+    crossings = np.zeros((shape[1], shape[0] + 1), dtype=np.int32)
+    row_y = origin[1] + (np.arange(shape[1]) + 0.5) * resolution
+
+    for (x0, y0), (x1, y1) in zip(polygon, np.roll(polygon, -1, axis=0)):
+        if y0 == y1:
+            continue
+        rows = np.nonzero((np.minimum(y0, y1) <= row_y)
+                          & (row_y < np.maximum(y0, y1)))[0]
+        x = x0 + (row_y[rows] - y0) * (x1 - x0) / (y1 - y0)
+        # first cell whose center is right of the crossing
+        cols = np.ceil((x - origin[0]) / resolution - 0.5).astype(np.int64)
+        np.add.at(crossings, (rows, np.clip(cols, 0, shape[0])), 1)
+
+    inside = np.cumsum(crossings, axis=1)[:, :shape[0]] % 2 == 1
+    return inside.T
+
+
+def coverage(trace, blade_radius=None, resolution=0.05,
+             boundary=None, keepouts=()) -> CoverageReport:
+    # Stamps the blade disc of every blade-on state on a grid. A cell gets
+    # one pass each time the disc starts covering it. Positions are snapped
+    # to cell centers, so the resolution bounds the error at disc edges.
+    if blade_radius is None:
+        blade_radius = trace.blade_radius
+
+    n = len(trace)
+    xs = np.frombuffer(trace.robot_x, dtype=np.float64, count=n)
+    ys = np.frombuffer(trace.robot_y, dtype=np.float64, count=n)
+    blade_on = np.frombuffer(trace.blade_on, dtype=np.int8, count=n) != 0
+
+    index = np.nonzero(blade_on)[0]
+    xs, ys = xs[index], ys[index]
+
+    points = [np.stack([xs, ys], axis=1)]
+    if boundary is not None:
+        points.append(np.asarray(boundary, dtype=np.float64))
+    points = np.concatenate(points)
+    if len(points) == 0:
+        return CoverageReport(np.zeros((0, 0), dtype=np.uint16),
+                              (0.0, 0.0), resolution)
+
+    margin = blade_radius + 2 * resolution
+    origin = (points[:, 0].min() - margin, points[:, 1].min() - margin)
+    shape = (int(np.ceil((points[:, 0].max() + margin - origin[0])
+                         / resolution)),
+             int(np.ceil((points[:, 1].max() + margin - origin[1])
+                         / resolution)))
+
+    ci = np.floor((xs - origin[0]) / resolution).astype(np.int64)
+    cj = np.floor((ys - origin[1]) / resolution).astype(np.int64)
+
+    # a state follows the previous sample if the blade stayed on between
+    follows = np.zeros(len(index), dtype=bool)
+    follows[1:] = index[1:] == index[:-1] + 1
+    # drop states that stay in the cell of the previous state
+    moved = ~follows
+    moved[1:] |= (ci[1:] != ci[:-1]) | (cj[1:] != cj[:-1])
+    ci, cj, follows = ci[moved], cj[moved], follows[moved]
+
+    # step from the previous kept sample, in cells
+    step_i = np.zeros_like(ci)
+    step_j = np.zeros_like(cj)
+    step_i[1:] = ci[1:] - ci[:-1]
+    step_j[1:] = cj[1:] - cj[:-1]
+
+    radius = blade_radius / resolution
+    passes = np.zeros(shape[0] * shape[1], dtype=np.int64)
+    for di, dj in zip(*disc_offsets(radius)):
+        # the previous sample covered this cell if the cell lies inside
+        # its disc too, otherwise a new pass over the cell starts here
+        pi, pj = step_i + di, step_j + dj
+        starts = ~(follows & (pi * pi + pj * pj <= radius * radius))
+        cells = (ci[starts] + di) * shape[1] + (cj[starts] + dj)
+        passes += np.bincount(cells, minlength=len(passes))
+    passes = passes.reshape(shape).astype(np.uint16)
+
+    inside = None
+    if boundary is not None:
+        inside = polygon_mask(boundary, origin, resolution, shape)
+        for keepout in keepouts:
+            inside &= ~polygon_mask(keepout, origin, resolution, shape)
+
+    return CoverageReport(passes, origin, resolution, inside)
+
+
+def load_boundary(path):
+    # either a list of points or {"boundary": [...], "keepouts": [[...]]}
+    with open(path, "r") as f:
+        obj = json.load(f)
+    if isinstance(obj, dict):
+        return obj["boundary"], obj.get("keepouts", [])
+    return obj, []
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Report how much of the lawn a trace has cut")
+    parser.add_argument("trace", help="out.sim or binary trace")
+    parser.add_argument("--resolution", type=float, default=0.05,
+                        help="grid cell size in meters")
+    parser.add_argument("--blade-radius", type=float, default=None,
+                        help="defaults to the trace's blade radius")
+    parser.add_argument("--boundary", default=None,
+                        help="JSON polygon to measure missed area in")
+    parser.add_argument("--save", default=None,
+                        help="write the pass count grid to a .npy file")
+    args = parser.parse_args()
+
+    trace = open_trace(args.trace)
+    trace.load_in_background()
+    trace.wait()
+
+    boundary, keepouts = (None, [])
+    if args.boundary is not None:
+        boundary, keepouts = load_boundary(args.boundary)
+
+    report = coverage(trace, args.blade_radius, args.resolution,
+                      boundary, keepouts)
+    for line in report.lines():
+        print(line)
+    if args.save is not None:
+        np.save(args.save, report.passes)
@@ -0,0 +1,117 @@
+import pygame as pg
+
+# number of states between two saved patches of the cut layer
+CHECKPOINT_INTERVAL = 500
+
+# palette index 0 is the transparent colorkey, index 1 the cut color
+TRANSPARENT = (255, 0, 255)
+
+
+class CutLayer:
+    # Blade cut circles stamped on an 8 bit colorkeyed surface that covers
+    # the area the trace has cut so far, growing as the robot moves out of
+    # it. Before an interval of states is stamped, the pixels it will touch
+    # are saved, so seeking backwards restores patches instead of redrawing
+    # from state 0. Rects are in world pixels, (x, -y) * scale.
+
+    def __init__(self, trace, radius, scale, color=(48, 49, 31)):
+        self.trace = trace
+        self.radius = radius
+        self.scale = scale
+        self.color = color
+
+        self.surface = None
+        self.rect = pg.Rect(0, 0, 0, 0)   # world pixels covered by surface
+
+        self.drawn = 0      # states [0, drawn) are stamped on the surface
+        self.patches = []   # patches[k] is the (rect, pixels) of interval k
+
+    def worldcoords(self, x, y):
+        return (x * self.scale - self.rect.x, -y * self.scale - self.rect.y)
+
+    def advance_to(self, index):
+        if index < self.drawn:
+            self.rewind(index)
+
+        xs, ys, blade_on = \
+            self.trace.robot_x, self.trace.robot_y, self.trace.blade_on
+        while self.drawn < index:
+            k = self.drawn // CHECKPOINT_INTERVAL
+            if k == len(self.patches):
+                if not self.interval_loaded(k):
+                    # the patch must cover every state of the interval
+                    break
+                self.patches.append(self.save_patch(k))
+
+            stop = min(index, (k + 1) * CHECKPOINT_INTERVAL)
+            for i in range(self.drawn, stop):
+                if blade_on[i]:
+                    pg.draw.circle(self.surface,
+                                   self.color,
+                                   self.worldcoords(xs[i], ys[i]),
+                                   self.radius)
+            self.drawn = stop
+
+    def rewind(self, index):
+        # restore the patches of every interval past the one holding index,
+        # newest first, then redraw the start of that interval
+        k = index // CHECKPOINT_INTERVAL
+        for j in range((self.drawn - 1) // CHECKPOINT_INTERVAL, k - 1, -1):
+            rect, pixels = self.patches[j]
+            if pixels is not None:
+                self.surface.blit(pixels, rect.move(-self.rect.x,
+                                                    -self.rect.y))
+        self.drawn = k * CHECKPOINT_INTERVAL
+
+    def interval_loaded(self, k):
+        return (self.trace.done
+                or len(self.trace) >= (k + 1) * CHECKPOINT_INTERVAL)
+
+    def interval_rect(self, k):
+        start = k * CHECKPOINT_INTERVAL
+        stop = min(len(self.trace), start + CHECKPOINT_INTERVAL)
+
+        xs = []
+        ys = []
+        for i in range(start, stop):
+            if self.trace.blade_on[i]:
+                xs.append(self.trace.robot_x[i] * self.scale)
+                ys.append(-self.trace.robot_y[i] * self.scale)
+        if len(xs) == 0:
+            return None
+
+        r = self.radius + 1
+        return pg.Rect(min(xs) - r, min(ys) - r,
+                       max(xs) - min(xs) + 2 * r + 1,
+                       max(ys) - min(ys) + 2 * r + 1)
+
+    def grow(self, rect):
+        # leave slack around the new area so growing stays rare
+        slack = max(512, self.rect.width // 4, self.rect.height // 4)
+        new_rect = rect.inflate(2 * slack, 2 * slack)
+        if self.surface is not None:
+            new_rect.union_ip(self.rect)
+
+        surface = pg.Surface(new_rect.size, depth=8)
+        surface.set_palette([TRANSPARENT, self.color] + [(0, 0, 0)] * 254)
+        surface.fill(TRANSPARENT)
+        surface.set_colorkey(TRANSPARENT)
+        if self.surface is not None:
+            self.surface.set_colorkey(None)
+            surface.blit(self.surface, (self.rect.x - new_rect.x,
+                                        self.rect.y - new_rect.y))
+
+        self.surface = surface
+        self.rect = new_rect
+
+    def save_patch(self, k):
+        rect = self.interval_rect(k)
+        if rect is None:
+            return (None, None)
+        if self.surface is None or not self.rect.contains(rect):
+            self.grow(rect)
+
+        pixels = self.surface.subsurface(
+                rect.move(-self.rect.x, -self.rect.y)).copy()
+        pixels.set_colorkey(None)
+        return (rect, pixels)
@@ -1,10 +1,16 @@
+import re
+from functools import lru_cache
+
+
 class Debug:
     def __init__(self, obj: dict):
         self.messages: list[str] = [str(s) for s in obj['messages']]
-        self.renderables = [eval(s) for s in obj['renderables']]
+        self.renderables = [parse_renderable(s) for s in obj['renderables']]
 
 
 class Line:
+    __slots__ = ("p1", "p2", "width", "color")
+
     def __init__(self, p1, p2, width, color):
         self.p1 = p1
         self.p2 = p2
@@ -13,7 +19,44 @@ class Line:
 
 
 class Circle:
+    __slots__ = ("center", "radius", "color")
+
     def __init__(self, center, radius, color):
         self.center = center
         self.radius = radius
         self.color = color
+
+
+# the formats written by simulation/src/debug/mod.rs
+NUMBER = r'\s*([-+]?(?:inf|NaN|\d+(?:\.\d*)?(?:[eE][-+]?\d+)?))\s*'
+POINT = rf'\s*\({NUMBER},{NUMBER}\)\s*'
+COLOR = r'\s*\(\s*(\d+)\s*,\s*(\d+)\s*,\s*(\d+)\s*\)\s*'
+LINE = re.compile(rf'\s*Line\({POINT},{POINT},{NUMBER},{COLOR}\)\s*')
+CIRCLE = re.compile(rf'\s*Circle\({POINT},{NUMBER},{COLOR}\)\s*')
+
+
+def number(s):
+    try:
+        return int(s)
+    except ValueError:
+        return float(s)
+
+
+@lru_cache(maxsize=1 << 14)
+def parse_renderable(s: str):
+    m = LINE.fullmatch(s)
+    if m is not None:
+        x1, y1, x2, y2, width, r, g, b = m.groups()
+        return Line((float(x1), float(y1)),
+                    (float(x2), float(y2)),
+                    number(width),
+                    (int(r), int(g), int(b)))
+
+    m = CIRCLE.fullmatch(s)
+    if m is not None:
+        x, y, radius, r, g, b = m.groups()
+        return Circle((float(x), float(y)),
+                      number(radius),
+                      (int(r), int(g), int(b)))
+
+    raise ValueError(f"unknown debug renderable: {s!r}")
@@ -1,44 +1,15 @@
 import pygame as pg
-import json
-from math import pi as PI, floor, ceil
-from debug import Debug, Circle, Line
+import sys
+from math import floor
+from scene import Scene, draw_messages, profiler
+from sim_trace import open_trace
 
 
-class Duration:
-    def __init__(self, obj: dict):
-        self.secs = obj['secs']
-        self.nanos = obj['nanos']
-
-    def seconds(self):
-        return self.secs + self.nanos / (10 ** 9)
-
-
-class SimState:
-    def __init__(self, obj: dict):
-        self.robot_x = obj['robot_x']
-        self.robot_y = obj['robot_y']
-        self.robot_theta = obj['robot_theta']
-        self.blade_on = obj['blade_on']
-        self.debug = Debug(obj['debug'])
-
-
-class SimOutput:
-    def __init__(self, obj: dict):
-        self.states: list[SimState] = [SimState(s) for s in obj['states']]
-        self.delta_time: Duration = Duration(obj['delta_time']).seconds()
-        self.wheel_distance: float = obj["wheel_distance"]
-        self.wheel_radius: float = obj["wheel_radius"]
-        self.max_motor_speed: float = obj["max_motor_speed"]
-        self.blade_radius: float = obj["blade_radius"]
-
-
-path = "../../simulation/out.sim"
-with open(path, 'r') as file:
-    json_str = file.read()
-sim_output = SimOutput(json.loads(json_str))
-sim_dt = sim_output.delta_time
-states = sim_output.states
-blade_radius = sim_output.blade_radius
+path = sys.argv[1] if len(sys.argv) > 1 else "../../simulation/out.sim"
+trace = open_trace(path)
+trace.load_in_background()
+sim_dt = trace.delta_time
+blade_radius = trace.blade_radius
 
 print(blade_radius)
 
@@ -48,39 +19,22 @@ ASPECT_RATIO = SCREEN_WIDTH / SCREEN_HEIGHT
 
 WORLD_SCALE = SCREEN_HEIGHT / 10  # pixels per meter
 
-WORLD_WIDTH = SCREEN_WIDTH * 5
-WORLD_HEIGHT = WORLD_WIDTH
-
 
 pg.init()
 screen = pg.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
 
 font = pg.font.Font(pg.font.get_default_font(), floor(SCREEN_HEIGHT / 40))
 robot_sprite = pg.image.load("robotDS.png")
-robot_sprite_size = (sim_output.wheel_distance * WORLD_SCALE,
-                     sim_output.wheel_distance * WORLD_SCALE
-                     * robot_sprite.get_height() / robot_sprite.get_width())
-robot_sprite = pg.transform.smoothscale(robot_sprite, robot_sprite_size)
-
-grass_size = 2
-grass_texture_path = "grass.png"
-grass_texture = pg.image.load(grass_texture_path)
-grass_texture = pg.transform.smoothscale(
-        grass_texture, (WORLD_SCALE * grass_size, WORLD_SCALE * grass_size))
-
-grass_surface = pg.Surface((WORLD_WIDTH, WORLD_HEIGHT))
-for y in range(ceil(WORLD_HEIGHT / grass_texture.get_height())):
-    for x in range(ceil(WORLD_WIDTH / grass_texture.get_width())):
-        grass_surface.blit(grass_texture,
-                           (x * grass_texture.get_width(),
-                            y * grass_texture.get_height()))
+grass_texture = pg.image.load("grass.png")
 
+scene = Scene(trace, WORLD_SCALE, robot_sprite, grass_texture)
 
+# world pixels, (x, -y) * WORLD_SCALE
 camera = pg.Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
-camera_surface = pg.Surface(camera.size)
+camera.center = (0, 0)
 
-world_surface = pg.Surface((WORLD_WIDTH, WORLD_HEIGHT))
-camera.center = (WORLD_WIDTH / 2, WORLD_HEIGHT / 2)
+# F3 shows how long drawing takes, see profiling.py
+profiler.open_csv_from_environment()
 
 clock = pg.time.Clock()
 world_timer = 0.0
@@ -88,23 +42,12 @@ frame_by_frame = True
 frame_skip = 1
 
 
-def worldcoords(x, y=None):
-    if isinstance(x, tuple) and y is None:
-        return worldcoords(x[0], x[1])
-    return (x * WORLD_SCALE + WORLD_WIDTH / 2,
-            -y * WORLD_SCALE + WORLD_HEIGHT / 2)
-
-
 quit = False
 
 if __name__ != "__main__":
     quit = True
 
 while not quit:
-    screen.fill((0, 0, 0))
-    camera_surface.fill((0, 0, 0))
-    world_surface.blit(grass_surface, (0, 0))
-
     pressed = pg.key.get_pressed()
 
     delta_time = clock.get_time() / 1000.0
@@ -118,6 +61,8 @@ while not quit:
         if event.type == pg.QUIT:
             quit = True
         if event.type == pg.KEYDOWN:
+            if event.key == pg.K_F3:
+                profiler.toggle_overlay()
             if event.key == pg.K_SPACE:
                 frame_by_frame = not frame_by_frame
             if event.key == pg.K_r:
@@ -133,46 +78,14 @@ while not quit:
 
     state_index = floor(world_timer / sim_dt)
 
-    debug_messages = []
-
-    if state_index < len(states):
-
-        for i in range(state_index):
-            state = states[i]
-            x, y = state.robot_x, state.robot_y
-            if state.blade_on:
-                pg.draw.circle(world_surface,
-                               (48, 49, 31),
-                               worldcoords(x, y),
-                               blade_radius * WORLD_SCALE)
-
-        state: SimState = states[state_index]
-        radians = state.robot_theta
-        degrees = radians * 180 / PI
-        robot = pg.transform.rotate(robot_sprite, degrees)
-
-        blit_x, blit_y = worldcoords(state.robot_x, state.robot_y)
-        world_surface.blit(robot,
-                           (blit_x - robot.get_width() / 2,
-                            blit_y - robot.get_height() / 2))
-        debug = state.debug
-        for r in debug.renderables:
-            if isinstance(r, Circle):
-                circle: Circle = r
-                pg.draw.circle(world_surface,
-                               circle.color,
-                               worldcoords(circle.center),
-                               circle.radius * WORLD_SCALE)
-            if isinstance(r, Line):
-                line: Line = r
-                pg.draw.line(world_surface, line.color,
-                             worldcoords(line.p1),
-                             worldcoords(line.p2),
-                             line.width)
-        debug_messages += debug.messages
-    else:
-        frame_by_frame = True
-        world_timer -= sim_dt
+    loaded = len(trace)
+    if state_index >= loaded:
+        # stop at the last state, or while still loading wait there for the
+        # loader to catch up
+        if trace.done:
+            frame_by_frame = True
+        world_timer = max(loaded - 1, 0) * sim_dt
+        state_index = floor(world_timer / sim_dt)
 
     if pressed[pg.K_a]:
         camera.x -= camera.width * 0.5 * delta_time
@@ -199,31 +112,28 @@ while not quit:
         camera.height = camera.width / ASPECT_RATIO
         camera.center = old_center
 
-    if camera.width != camera_surface.get_width():
-        camera_surface = pg.Surface(camera.size)
-
-    camera_surface.blit(world_surface, (-camera.x, -camera.y))
-    c = pg.transform.scale(camera_surface, screen.get_size())
-
-    screen.blit(c, (0, 0))
+    debug_messages = scene.draw(screen, camera, state_index)
 
     fs = f"frame skip {frame_skip}" if frame_by_frame else "realtime"
+    if not trace.done:
+        fs += ", loading"
     debug_messages = \
-        [f"Frame {state_index}/{len(states)} ({fs})"] + debug_messages
+        [f"Frame {state_index}/{loaded} ({fs})"] + debug_messages
 
     dec = 4
     t = str(world_timer) + "0" * dec
     debug_messages = [f"Time: {t[:t.find('.')+dec]}"] + debug_messages
 
-    padding = 5
-    y = padding
-    for line in debug_messages:
-        r = font.render(line, True, (0, 0, 0), (255, 255, 255))
-        screen.blit(r, (padding, y))
-        y += r.get_height() + padding
+    with profiler.scope("text"):
+        draw_messages(screen, font, debug_messages)
+    if profiler.overlay:
+        profiler.draw_overlay(screen, font, (SCREEN_WIDTH * 2 // 3, 5))
 
-    pg.display.update()
+    with profiler.scope("display"):
+        pg.display.update()
+    profiler.end_frame()
 
     clock.tick(60)
 
+profiler.close_csv()
 pg.quit()
@@ -0,0 +1,127 @@
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from math import floor
+
+# must be set before pygame creates a display
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame as pg  # noqa: E402
+from scene import Scene, draw_messages  # noqa: E402
+from sim_trace import open_trace  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def trace_bounds(trace, margin):
+    return (min(trace.robot_x) - margin, min(trace.robot_y) - margin,
+            max(trace.robot_x) + margin, max(trace.robot_y) + margin)
+
+
+def make_camera(size, scale, center, width):
+    # center and width in meters, the camera rect is in world pixels
+    w, h = size
+    camera = pg.Rect(0, 0, width * scale, width * scale * h / w)
+    camera.center = (center[0] * scale, -center[1] * scale)
+    return camera
+
+
+def render_chunk(args, chunk):
+    # renders [(frame number, state index), ...] in increasing state order
+    pg.init()
+    pg.display.set_mode((1, 1))
+    screen = pg.Surface(args.size)
+    font = pg.font.Font(pg.font.get_default_font(), floor(args.size[1] / 40))
+
+    trace = open_trace(args.trace)
+    trace.load_in_background()
+    trace.wait()
+
+    robot_sprite = pg.image.load(os.path.join(HERE, "robotDS.png"))
+    grass_texture = pg.image.load(os.path.join(HERE, "grass.png"))
+    scene = Scene(trace, args.scale, robot_sprite, grass_texture)
+
+    for frame, index in chunk:
+        if args.follow:
+            center = (trace.robot_x[index], trace.robot_y[index])
+        else:
+            center = args.center
+        camera = make_camera(args.size, args.scale, center, args.width)
+
+        messages = scene.draw(screen, camera, index)
+        if args.messages:
+            lines = [f"Time: {index * trace.delta_time:.3f}",
+                     f"Frame {index}/{len(trace)}"] + messages
+            draw_messages(screen, font, lines)
+
+        pg.image.save(screen, os.path.join(args.output,
+                                           f"frame_{frame:06d}.png"))
+    pg.quit()
+    return len(chunk)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render a simulation trace to numbered PNG frames")
+    parser.add_argument("trace", help="out.sim or binary trace")
+    parser.add_argument("output", help="directory for the frames")
+    parser.add_argument("--start", type=float, default=0.0,
+                        help="start time in seconds")
+    parser.add_argument("--end", type=float, default=None,
+                        help="end time in seconds, defaults to the end")
+    parser.add_argument("--stride", type=int, default=33,
+                        help="states between two frames")
+    parser.add_argument("--size", type=int, nargs=2, default=(1280, 960),
+                        metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--scale", type=float, default=96,
+                        help="pixels per meter of the cut layer")
+    parser.add_argument("--center", type=float, nargs=2, default=None,
+                        metavar=("X", "Y"), help="camera center in meters")
+    parser.add_argument("--width", type=float, default=None,
+                        help="camera width in meters")
+    parser.add_argument("--follow", action="store_true",
+                        help="keep the robot in the middle of the frame")
+    parser.add_argument("--messages", action="store_true",
+                        help="draw the time and debug messages")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    args.size = tuple(args.size)
+
+    trace = open_trace(args.trace)
+    trace.load_in_background()
+    trace.wait()
+    if len(trace) == 0:
+        sys.exit(f"{args.trace} has no states")
+
+    if args.center is None or args.width is None:
+        # frame the whole trace unless told otherwise
+        x0, y0, x1, y1 = trace_bounds(trace, 2 * trace.wheel_distance)
+        aspect = args.size[0] / args.size[1]
+        if args.center is None:
+            args.center = ((x0 + x1) / 2, (y0 + y1) / 2)
+        if args.width is None:
+            args.width = max(x1 - x0, (y1 - y0) * aspect)
+
+    first = max(0, round(args.start / trace.delta_time))
+    last = len(trace) if args.end is None \
+        else min(len(trace), round(args.end / trace.delta_time) + 1)
+    frames = list(enumerate(range(first, last, max(1, args.stride))))
+    if len(frames) == 0:
+        sys.exit("no frames in the given time range")
+
+    os.makedirs(args.output, exist_ok=True)
+
+    # contiguous chunks, so each worker only stamps the cut layer forward
+    workers = max(1, min(args.workers, len(frames)))
+    size = -(-len(frames) // workers)
+    chunks = [frames[i:i + size] for i in range(0, len(frames), size)]
+    with ProcessPoolExecutor(workers) as pool:
+        done = 0
+        for count in pool.map(render_chunk, [args] * len(chunks), chunks):
+            done += count
+            print(f"{done}/{len(frames)} frames", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
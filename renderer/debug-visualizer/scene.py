@@ -0,0 +1,168 @@
+import os
+import sys
+import pygame as pg
+from collections import OrderedDict
+from math import pi as PI, ceil, floor
+from debug import Circle, Line
+from cut_layer import CutLayer
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             ".."))
+from profiling import profiler  # noqa: E402
+from textcache import text_cache  # noqa: E402
+
+# side length in meters of one grass texture tile
+GRASS_SIZE = 2
+# grass tiles are repeated up to this many pixels so zooming out far does
+# not turn into thousands of tiny blits
+MIN_TILE_PIXELS = 256
+
+
+class Scene:
+    # Draws a frame of a trace straight onto the screen, touching only what
+    # the camera rect covers. The camera is in world pixels, (x, -y) * scale.
+    def __init__(self, trace, scale, robot_sprite, grass_texture,
+                 max_cached_zooms=8):
+        self.trace = trace
+        self.scale = scale
+        self.robot_sprite = robot_sprite
+        self.grass_texture = grass_texture
+        self.max_cached_zooms = max_cached_zooms
+
+        self.cut_layer = CutLayer(trace, trace.blade_radius * scale, scale)
+
+        self.robot_size = (trace.wheel_distance * scale,
+                           trace.wheel_distance * scale
+                           * robot_sprite.get_height()
+                           / robot_sprite.get_width())
+
+        # pixel size -> scaled surface, least recently used first
+        self.grass_tiles = OrderedDict()
+        self.robot_sprites = OrderedDict()
+
+        self.camera = pg.Rect(0, 0, 1, 1)
+        self.zoom = 1.0
+
+    def screencoords(self, x, y=None):
+        if isinstance(x, tuple) and y is None:
+            return self.screencoords(x[0], x[1])
+        return ((x * self.scale - self.camera.x) * self.zoom,
+                (-y * self.scale - self.camera.y) * self.zoom)
+
+    def cached(self, cache, size, make):
+        surface = cache.get(size)
+        if surface is None:
+            surface = make()
+            cache[size] = surface
+            if len(cache) > self.max_cached_zooms:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(size)
+        return surface
+
+    def grass_tile(self, tile_size):
+        def make():
+            tile = pg.transform.smoothscale(self.grass_texture,
+                                            (tile_size, tile_size))
+            repeat = ceil(MIN_TILE_PIXELS / tile_size)
+            surface = pg.Surface((tile_size * repeat, tile_size * repeat))
+            for y in range(repeat):
+                for x in range(repeat):
+                    surface.blit(tile, (x * tile_size, y * tile_size))
+            return surface
+        return self.cached(self.grass_tiles, tile_size, make)
+
+    def draw_grass(self, screen):
+        tile_size = max(1, round(GRASS_SIZE * self.scale * self.zoom))
+        tile = self.grass_tile(tile_size)
+        step = tile.get_width()
+
+        # keep the pattern anchored to the world origin
+        ox, oy = self.screencoords(0, 0)
+        start_x = floor(ox) % step - step
+        start_y = floor(oy) % step - step
+        width, height = screen.get_size()
+        for y in range(start_y, height, step):
+            for x in range(start_x, width, step):
+                screen.blit(tile, (x, y))
+
+    def draw_cut(self, screen):
+        layer = self.cut_layer
+        if layer.surface is None:
+            return
+        visible = self.camera.clip(layer.rect)
+        if visible.width == 0 or visible.height == 0:
+            return
+
+        source = layer.surface.subsurface(
+                visible.move(-layer.rect.x, -layer.rect.y))
+        size = (ceil(visible.width * self.zoom),
+                ceil(visible.height * self.zoom))
+        scaled = pg.transform.scale(source, size)
+        scaled.set_colorkey(layer.surface.get_colorkey())
+        screen.blit(scaled,
+                    ((visible.x - self.camera.x) * self.zoom,
+                     (visible.y - self.camera.y) * self.zoom))
+
+    def draw_robot(self, screen, index):
+        size = (max(1, round(self.robot_size[0] * self.zoom)),
+                max(1, round(self.robot_size[1] * self.zoom)))
+        sprite = self.cached(
+                self.robot_sprites, size,
+                lambda: pg.transform.smoothscale(self.robot_sprite, size))
+
+        degrees = self.trace.robot_theta[index] * 180 / PI
+        robot = pg.transform.rotate(sprite, degrees)
+        blit_x, blit_y = self.screencoords(self.trace.robot_x[index],
+                                           self.trace.robot_y[index])
+        screen.blit(robot,
+                    (blit_x - robot.get_width() / 2,
+                     blit_y - robot.get_height() / 2))
+
+    def draw_debug(self, screen, debug):
+        for r in debug.renderables:
+            if isinstance(r, Circle):
+                circle: Circle = r
+                pg.draw.circle(screen,
+                               circle.color,
+                               self.screencoords(circle.center),
+                               circle.radius * self.scale * self.zoom)
+            if isinstance(r, Line):
+                line: Line = r
+                pg.draw.line(screen, line.color,
+                             self.screencoords(line.p1),
+                             self.screencoords(line.p2),
+                             max(1, round(line.width * self.zoom)))
+
+    def draw(self, screen, camera, index):
+        # returns the debug messages of the state, if it has been loaded
+        self.camera = camera
+        self.zoom = screen.get_width() / camera.width
+
+        loaded = len(self.trace)
+        with profiler.scope("trail"):
+            self.cut_layer.advance_to(max(0, min(index, loaded - 1)))
+
+        with profiler.scope("grass"):
+            self.draw_grass(screen)
+        with profiler.scope("camera scale"):
+            self.draw_cut(screen)
+
+        if index < loaded:
+            with profiler.scope("robot"):
+                self.draw_robot(screen, index)
+            with profiler.scope("debug renderables"):
+                debug = self.trace.debug(index)
+                self.draw_debug(screen, debug)
+            return debug.messages
+        return []
+
+
+def draw_messages(screen, font, lines, padding=5):
+    # the numbers in the lines change every frame, the rest of the text
+    # hardly ever
+    y = padding
+    for line in lines:
+        r = text_cache.blit(screen, font, line, (padding, y), (0, 0, 0),
+                            (255, 255, 255), runs=True)
+        y += r.height + padding
@@ -0,0 +1,293 @@
+import json
+import os
+import re
+import threading
+from array import array
+
+from debug import Debug
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+# what may follow a value; a set, so that "" (end of buffer) isn't in it
+DELIMITERS = frozenset(' \t\n\r,:]}')
+HEADER_FIELDS = ["delta_time", "wheel_distance", "wheel_radius",
+                 "max_motor_speed", "blade_radius"]
+
+# everything up to the next string or bracket, and a whole string
+PLAIN = re.compile(r'[^"{}\[\]]*')
+STRING = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"')
+# the pose fields of a state as the simulator writes it, and the start of
+# the next such state. The debug payload sits between the two.
+NUMBER = r'([-+.\deE]+)'   # float() tells if it is one
+POSE = re.compile(r'\{"robot_x":' + NUMBER + r',"robot_y":' + NUMBER
+                  + r',"robot_theta":' + NUMBER
+                  + r',"blade_on":(true|false),"debug":')
+NEXT_POSE = ',{"robot_x":'
+
+
+class Duration:
+    def __init__(self, obj: dict):
+        self.secs = obj['secs']
+        self.nanos = obj['nanos']
+
+    def seconds(self):
+        return self.secs + self.nanos / (10 ** 9)
+
+
+class TraceReader:
+    # Incremental reader for the JSON SimOutput layout. The file is decoded
+    # as latin-1 so that string offsets are also byte offsets into the file.
+    def __init__(self, file, chunk_size=1 << 20):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.base = 0   # file offset of buf[0]
+        self.pos = 0
+        self.eof = False
+        self.header = {}
+
+    def fill(self):
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return
+        self.base += self.pos
+        self.buf = self.buf[self.pos:] + chunk.decode("latin-1")
+        self.pos = 0
+
+    def peek(self):
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof:
+                return ""
+            self.fill()
+
+    def expect(self, chars):
+        c = self.peek()
+        if c == "" or c not in chars:
+            raise ValueError(f"expected one of {chars!r} "
+                             f"at byte {self.base + self.pos}, found {c!r}")
+        self.pos += 1
+        return c
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # a number cut off at the end of the buffer still decodes,
+                # as does one cut off after "1" or "1."
+                if self.eof or self.buf[end:end + 1] in DELIMITERS:
+                    start = self.base + self.pos
+                    self.pos = end
+                    return (start, self.base + end, value)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    def skip(self):
+        # steps over one value without building it, only counting brackets
+        if self.peek() not in "{[":
+            self.value()
+            return
+        depth = 0
+        while True:
+            self.pos = PLAIN.match(self.buf, self.pos).end()
+            c = self.buf[self.pos] if self.pos < len(self.buf) else ""
+            if c == '"':
+                string = STRING.match(self.buf, self.pos)
+                if string is not None:
+                    self.pos = string.end()
+                    continue
+            elif c:
+                self.pos += 1
+                depth += 1 if c in "{[" else -1
+                if depth == 0:
+                    return
+                continue
+            # cut off at the end of the buffer
+            if self.eof:
+                raise ValueError(f"unterminated value "
+                                 f"at byte {self.base + self.pos}")
+            self.fill()
+
+    def poses(self):
+        # yields (start, end, state) for the states up to the "]" that ends
+        # them, each with its debug payload scanned past rather than decoded
+        while True:
+            # A quote in a string is escaped and the debug payload has no
+            # robot_x field, so the payload ends where the next state
+            # starts, if that is in the buffer.
+            match = POSE.match(self.buf, self.pos)
+            if match is not None:
+                end = self.buf.find(NEXT_POSE, match.end())
+                if end != -1 and self.buf.startswith("}}", end - 2):
+                    yield (self.base + self.pos, self.base + end,
+                           {"robot_x": float(match[1]),
+                            "robot_y": float(match[2]),
+                            "robot_theta": float(match[3]),
+                            "blade_on": match[4] == "true"})
+                    self.pos = end + 1
+                    continue
+            yield self.state()
+            if self.expect(",]") == "]":
+                return
+
+    def state(self):
+        # one state for poses(): the last one in the buffer, or one laid out
+        # some other way, a field at a time
+        self.peek()
+        start = self.base + self.pos
+        self.expect("{")
+        state = {}
+        if self.peek() == "}":
+            self.pos += 1
+        else:
+            while True:
+                _, _, key = self.value()
+                self.expect(":")
+                if key == "debug":
+                    self.skip()
+                else:
+                    state[key] = self.value()[2]
+                if self.expect(",}") == "}":
+                    break
+        return (start, self.base + self.pos, state)
+
+    def states(self, debug=True):
+        # yields (start, end, state) for every state and fills self.header
+        # with the other top-level fields. Without debug the states leave
+        # out their "debug" field, which is then never decoded.
+        self.expect("{")
+        if self.peek() == "}":
+            return
+        while True:
+            _, _, key = self.value()
+            self.expect(":")
+            if key == "states":
+                self.expect("[")
+                if self.peek() == "]":
+                    self.pos += 1
+                elif not debug:
+                    yield from self.poses()
+                else:
+                    while True:
+                        yield self.value()
+                        if self.expect(",]") == "]":
+                            break
+            else:
+                self.header[key] = self.value()[2]
+            if self.expect(",}") == "}":
+                return
+
+
+def read_header(path):
+    # serde writes the states first, so the header fields sit at the tail
+    with open(path, "rb") as f:
+        size = f.seek(0, os.SEEK_END)
+        f.seek(max(0, size - 4096))
+        tail = f.read().decode("latin-1")
+
+    start = tail.rfind('"delta_time"')
+    if start == -1:
+        return None
+    try:
+        header = json.loads("{" + tail[start:])
+    except json.JSONDecodeError:
+        return None
+    if not all(field in header for field in HEADER_FIELDS):
+        return None
+    return header
+
+
+class SimTrace:
+    def __init__(self, path):
+        self.path = path
+        self.robot_x = array('d')
+        self.robot_y = array('d')
+        self.robot_theta = array('d')
+        self.blade_on = array('b')
+        self.starts = array('q')   # byte span of each state in the file
+        self.ends = array('q')
+
+        self.loaded = 0
+        self.done = False
+        self.error = None
+        self.thread = None
+
+        self.debug_file = None
+        self.debug_cache = {}
+
+        header = read_header(path)
+        if header is None:
+            # unusual field order, the header is only known after parsing
+            self.load()
+        else:
+            self.set_header(header)
+
+    def set_header(self, header):
+        self.delta_time = Duration(header["delta_time"]).seconds()
+        self.wheel_distance = header["wheel_distance"]
+        self.wheel_radius = header["wheel_radius"]
+        self.max_motor_speed = header["max_motor_speed"]
+        self.blade_radius = header["blade_radius"]
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as f:
+                reader = TraceReader(f)
+                for start, end, state in reader.states(debug=False):
+                    self.robot_x.append(state['robot_x'])
+                    self.robot_y.append(state['robot_y'])
+                    self.robot_theta.append(state['robot_theta'])
+                    self.blade_on.append(state['blade_on'])
+                    self.starts.append(start)
+                    self.ends.append(end)
+                    # published last, readers never see a partial state
+                    self.loaded += 1
+                if not hasattr(self, "delta_time"):
+                    self.set_header(reader.header)
+        except Exception as e:
+            self.error = e
+            raise
+        finally:
+            self.done = True
+
+    def load_in_background(self):
+        if self.done:
+            return
+        self.thread = threading.Thread(target=self.load, daemon=True)
+        self.thread.start()
+
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+
+    def __len__(self):
+        return self.loaded
+
+    def debug(self, i) -> Debug:
+        debug = self.debug_cache.get(i)
+        if debug is not None:
+            return debug
+
+        if self.debug_file is None:
+            self.debug_file = open(self.path, "rb")
+        self.debug_file.seek(self.starts[i])
+        raw = self.debug_file.read(self.ends[i] - self.starts[i])
+        debug = Debug(json.loads(raw)['debug'])
+
+        if len(self.debug_cache) >= 64:
+            self.debug_cache.pop(next(iter(self.debug_cache)))
+        self.debug_cache[i] = debug
+        return debug
+
+
+def open_trace(path):
+    import binary_trace
+    if binary_trace.is_binary_trace(path):
+        return binary_trace.BinaryTrace(path)
+    return SimTrace(path)
@@ -3,7 +3,18 @@ import message
 from elements import ClickableSurface
 from model import InstructionBuilderModel, blade_radius
 from instruction import Line, CubicBezier, BladeOff, BladeOn
-from math import ceil
+from itertools import count
+from math import ceil, floor
+from profiling import profiler
+from store import POINT_COUNT
+from textcache import text_cache
+import numpy as np
+
+# curves are drawn as polylines at most this many pixels off them
+curve_tolerance = 0.5
+
+# tells one drag of a point from the next, see message.UpdatePoint
+drag_ids = count(1)
 
 
 def distance_squared(p0, p1):
@@ -11,12 +22,38 @@ def distance_squared(p0, p1):
     return (dx * dx + dy * dy)
 
 
+def instruction_boxes(store, which=None):
+    # Bounding boxes of the points of every instruction, or of those in
+    # which, as rows of x0, y0, x1, y1 in world coordinates. Curves stay
+    # inside theirs, blade changes get empty ones.
+    ops = store.ops_view()
+    offsets = store.offsets_view()
+    points = store.points_view()
+    if which is None:
+        which = np.arange(len(ops))
+    boxes = np.tile([np.inf, np.inf, -np.inf, -np.inf], (len(which), 1))
+    counts = POINT_COUNT[ops[which]]
+    for n in (2, 4):
+        rows = np.nonzero(counts == n)[0]
+        if len(rows) > 0:
+            p = points[offsets[which[rows]][:, None] + np.arange(n)]
+            boxes[rows, :2] = p.min(axis=1)
+            boxes[rows, 2:] = p.max(axis=1)
+    return boxes
+
+
 class EditorFrame(ClickableSurface):
     def __init__(self, size: tuple[int, int], model: InstructionBuilderModel):
         self.surface = None
-        self.cut_surface = None
-        self.nodes_surface = None
-        self.text_surface = None
+        self.committed_cut = None
+        self.committed_nodes = None
+        self.committed_key = None
+        self.committed_blade_on = False
+        self.committed_boxes = None  # see instruction_boxes
+        self.committed_moved = 0     # model.moved drawn into the layers
+        self.simulation_overlay = None
+        self.simulation_key = None
+        self.view_key = None    # model state the surface was drawn for
         self.model = model
 
         self.font = pg.font.Font(pg.font.get_default_font(), 32)
@@ -27,6 +64,8 @@ class EditorFrame(ClickableSurface):
         self.line_color_blade_off = (138, 41, 20, 255)   # #8B2914
         self.line_color_selected = (184, 167, 38, 255)   # #B8BB26
         self.cut_color = (58, 72, 24, 255)               # #3A4818
+        self.trajectory_color = (131, 165, 152, 255)     # #83A598
+        self.simulated_cut_color = (142, 192, 124, 96)   # #8EC07C
         self.world_width = self.world_height = 0
         self.world_scale = 0
 
@@ -34,214 +73,343 @@ class EditorFrame(ClickableSurface):
         self.point_radius = 0
         self.point_radius_selected = 0
 
-        self.dragging = -1
+        self.dragging = -1      # -1: nothing, 0: background, else a point
+        self.drag = None        # id of the moves of the point dragged
+        self.hover = None
         self.camera_pos = (0, 0)  # WORLD COORDINATES
         self.anchor = (0, 0)      # WORLD COORDINATES
 
         self.resize(size)
 
-    def update(self) -> pg.Surface:
-        self.surface.fill(self.bg)
-        self.text_surface.fill((0, 0, 0, 0))
-        self.cut_surface.fill((0, 0, 0, 0))
-        self.nodes_surface.fill((0, 0, 0, 0))
+    def cut_spacing(self):
+        # widest spacing between blade stamps that keeps the scalloped edge
+        # of the swath within half a pixel of the true edge
+        r = blade_radius * self.world_scale
+        e = min(0.5, r)
+        return 2 * (r * r - (r - e) * (r - e)) ** 0.5 / self.world_scale
+
+    def draw_cut(self, surface, instruction):
+        if not isinstance(instruction, (Line, CubicBezier)):
+            return
+
+        # stamp at even arc length steps along the path
+        length = instruction.length()
+        steps = max(1, ceil(length / self.cut_spacing()))
+        points = instruction.points_at_distances(
+                np.linspace(0.0, length, steps + 1))
+        cut_radius = blade_radius * self.world_scale
+        for p in self.screen_points(points):
+            pg.draw.circle(surface, self.cut_color, p, cut_radius)
+
+    def draw_curve(self, surface, curve, color):
+        points = curve.flatten(curve_tolerance / self.world_scale)
+        sps = self.screen_points(points)
+        pg.draw.lines(surface, color, False, sps, width=self.line_width)
+
+    def draw_committed(self):
+        # everything but the selected (last) instruction, which is drawn
+        # every frame
+        self.committed_cut.fill((0, 0, 0, 0))
+        self.committed_nodes.fill((0, 0, 0, 0))
 
         instructions = self.model.instructions
         length = len(instructions)
 
-        bezier_steps = 50
-
         blade_on = False
         for i in range(length - 1):
             instruction = instructions[i]
-            if blade_on:
-                line_color = self.line_color_blade_on
-            else:
-                line_color = self.line_color_blade_off
-
-            if isinstance(instruction, Line):
-                if blade_on:
-                    line_length = distance_squared(instruction.start,
-                                                   instruction.end) ** 0.5
-                    cut_steps = ceil(2 * line_length / blade_radius)
-                    cut_steps = 100
-                    cut_radius = blade_radius * self.world_scale
-                    for i in range(cut_steps + 1):
-                        t = i / cut_steps
-                        pg.draw.circle(self.cut_surface,
-                                       self.cut_color,
-                                       self.screencoords(instruction.point_on(t)),
-                                       cut_radius)
-
-                pg.draw.line(self.nodes_surface,
-                             line_color,
-                             self.screencoords(instruction.end),
-                             self.screencoords(instruction.start),
-                             self.line_width)
-                for p in [instruction.start, instruction.end]:
-                    pg.draw.circle(self.nodes_surface,
-                                   line_color,
-                                   self.screencoords(p),
-                                   self.point_radius)
-            if isinstance(instruction, CubicBezier):
-                if blade_on:
-                    line_length = distance_squared(instruction.p0,
-                                                   instruction.p3) ** 0.5
-                    cut_steps = ceil(2 * line_length / blade_radius)
-                    cut_steps = 100
-                    cut_radius = blade_radius * self.world_scale
-                    for i in range(cut_steps + 1):
-                        t = i / cut_steps
-                        pg.draw.circle(self.cut_surface,
-                                       self.cut_color,
-                                       self.screencoords(instruction.point_on(t)),
-                                       cut_radius)
-
-                ts = [i / bezier_steps for i in range(bezier_steps + 1)]
-                ps = [instruction.point_on(t) for t in ts]
-                sps = [self.screencoords(p) for p in ps]
-                for i in range(bezier_steps):
-                    pg.draw.line(self.nodes_surface,
-                                 line_color,
-                                 sps[i], sps[i + 1],
-                                 width=self.line_width)
-                pg.draw.circle(self.nodes_surface,
-                               line_color,
-                               self.screencoords(instruction.p3),
-                               self.point_radius)
+            self.draw_committed_instruction(instruction, blade_on,
+                                            self.committed_cut,
+                                            self.committed_nodes)
             if isinstance(instruction, BladeOn):
                 blade_on = True
             if isinstance(instruction, BladeOff):
                 blade_on = False
 
-        if length > 0:
-            selected = instructions[length - 1]
-            if isinstance(selected, Line):
-                if blade_on:
-                    line_length = distance_squared(selected.start,
-                                                   selected.end) ** 0.5
-                    cut_steps = ceil(2 * line_length / blade_radius)
-                    cut_steps = 100
-                    cut_radius = blade_radius * self.world_scale
-                    for i in range(cut_steps + 1):
-                        t = i / cut_steps
-                        pg.draw.circle(self.cut_surface,
-                                       self.cut_color,
-                                       self.screencoords(selected.point_on(t)),
-                                       cut_radius)
-                pg.draw.line(self.nodes_surface,
-                             self.line_color_selected,
-                             self.screencoords(selected.end),
-                             self.screencoords(selected.start),
-                             self.line_width)
-                pg.draw.circle(self.nodes_surface,
-                               self.line_color_selected,
-                               self.screencoords(selected.start),
+        self.committed_blade_on = blade_on
+        self.committed_boxes = instruction_boxes(instructions)
+        self.committed_moved = len(self.model.moved)
+
+    def redraw_committed(self, moved):
+        # Redraws the committed layers over where the moved instructions
+        # were and are now, with every instruction reaching into that
+        # area drawn again in order. Same pixels as draw_committed,
+        # without drawing the whole plan on every move. They are drawn
+        # onto the scratch layers and only the area copied over, pygame
+        # would draw lines crossing a clip rect slightly differently.
+        instructions = self.model.instructions
+        length = len(instructions)
+        moved = np.unique([i for i in moved if i < length - 1])
+        if len(moved) == 0:
+            return
+        before = self.committed_boxes[moved]
+        self.committed_boxes[moved] = instruction_boxes(instructions,
+                                                        moved)
+        after = self.committed_boxes[moved]
+        area = np.concatenate([np.minimum(before, after)[:, :2].min(axis=0),
+                               np.maximum(before, after)[:, 2:].max(axis=0)])
+
+        # whatever a stamp, line or point drawn there can cover
+        pad = max(self.line_width, self.point_radius,
+                  blade_radius * self.world_scale) + 2
+        left, top = self.screencoords(area[0], area[3])
+        right, bottom = self.screencoords(area[2], area[1])
+        clip = pg.Rect(floor(left - pad), floor(top - pad),
+                       ceil(right - left + 2 * pad) + 1,
+                       ceil(bottom - top + 2 * pad) + 1)
+        clip = clip.clip(self.committed_nodes.get_rect())
+        if clip.width == 0 or clip.height == 0:
+            return
+
+        # drawing reaches pad past a box, and the clip pad past the area
+        reach = (2 * pad + 2) / self.world_scale
+        boxes = self.committed_boxes[:length - 1]
+        hits = np.nonzero((boxes[:, 0] <= area[2] + reach)
+                          & (boxes[:, 2] >= area[0] - reach)
+                          & (boxes[:, 1] <= area[3] + reach)
+                          & (boxes[:, 3] >= area[1] - reach))[0]
+        blade = instructions.blade_view()
+        self.scratch_cut.fill((0, 0, 0, 0), clip)
+        self.scratch_nodes.fill((0, 0, 0, 0), clip)
+        for i in hits.tolist():
+            self.draw_committed_instruction(
+                instructions[i], i > 0 and bool(blade[i - 1]),
+                self.scratch_cut, self.scratch_nodes)
+        for layer, scratch in ((self.committed_cut, self.scratch_cut),
+                               (self.committed_nodes, self.scratch_nodes)):
+            # adding onto nothing copies alpha and all
+            layer.fill((0, 0, 0, 0), clip)
+            layer.blit(scratch, clip, clip, special_flags=pg.BLEND_RGBA_ADD)
+
+    def draw_committed_instruction(self, instruction, blade_on, cut, nodes):
+        if blade_on:
+            line_color = self.line_color_blade_on
+            self.draw_cut(cut, instruction)
+        else:
+            line_color = self.line_color_blade_off
+
+        if isinstance(instruction, Line):
+            pg.draw.line(nodes,
+                         line_color,
+                         self.screencoords(instruction.end),
+                         self.screencoords(instruction.start),
+                         self.line_width)
+            for p in [instruction.start, instruction.end]:
+                pg.draw.circle(nodes,
+                               line_color,
+                               self.screencoords(p),
                                self.point_radius)
-                pg.draw.circle(self.nodes_surface,
-                               self.line_color_selected,
-                               self.screencoords(selected.end),
-                               self.point_radius_selected)
+        if isinstance(instruction, CubicBezier):
+            self.draw_curve(nodes, instruction, line_color)
+            pg.draw.circle(nodes,
+                           line_color,
+                           self.screencoords(instruction.p3),
+                           self.point_radius)
+
+    def draw_simulation(self, simulation):
+        # the cut area and path of a finished simulator run
+        self.simulation_overlay.fill((0, 0, 0, 0))
+        points, blade_on = simulation.positions()
+
+        # one blade stamp per cut_spacing of travel, and at the start of
+        # every stretch with the blade on
+        index = np.nonzero(blade_on)[0]
+        cut = points[index]
+        if len(cut) > 0:
+            steps = np.hypot(*np.diff(cut, axis=0).T)
+            bins = np.floor(np.concatenate([[0.0], np.cumsum(steps)])
+                            / self.cut_spacing())
+            keep = np.ones(len(cut), dtype=bool)
+            keep[1:] = (bins[1:] != bins[:-1]) | (index[1:] != index[:-1] + 1)
+            cut_radius = simulation.header["blade_radius"] * self.world_scale
+            for p in self.screen_points(cut[keep]):
+                pg.draw.circle(self.simulation_overlay,
+                               self.simulated_cut_color, p, cut_radius)
+
+        if len(points) > 1:
+            pg.draw.lines(self.simulation_overlay, self.trajectory_color,
+                          False, self.screen_points(points),
+                          max(1, round(self.line_width / 2)))
+
+    def simulation_status(self, simulation):
+        if simulation.error is not None:
+            return f"Simulation failed: {simulation.error}"
+        if not simulation.done:
+            return f"Simulating... {simulation.loaded} states"
+        seconds = simulation.loaded * simulation.delta_time()
+        return f"Simulated {round(seconds, 1)} s"
+
+    def model_state(self):
+        # what update draws from the model, including a simulation that is
+        # still running in the background
+        simulation = self.model.simulation
+        if simulation is None:
+            return (self.model.version, None)
+        return (self.model.version, simulation, simulation.loaded,
+                simulation.done)
+
+    def check(self):
+        if self.model_state() != self.view_key:
+            self.invalidate()
 
-                d = distance_squared(selected.start, selected.end) ** 0.5
-                text = self.font.render(f"Dist: {round(d, 3)}", True, self.fg)
-                self.text_surface.blit(text, (0, 30))
-            if isinstance(selected, CubicBezier):
-                if blade_on:
-                    line_length = distance_squared(selected.p0,
-                                                   selected.p3) ** 0.5
-                    cut_steps = ceil(2 * line_length / blade_radius)
-                    cut_steps = 100
-                    cut_radius = blade_radius * self.world_scale
-                    for i in range(cut_steps + 1):
-                        t = i / cut_steps
-                        pg.draw.circle(self.cut_surface,
-                                       self.cut_color,
-                                       self.screencoords(selected.point_on(t)),
-                                       cut_radius)
-
-                ts = [i / bezier_steps for i in range(bezier_steps + 1)]
-                ps = [selected.point_on(t) for t in ts]
-                sps = [self.screencoords(p) for p in ps]
-                for i in range(bezier_steps):
-                    pg.draw.line(self.nodes_surface,
-                                 self.line_color_selected,
-                                 sps[i], sps[i + 1],
-                                 width=self.line_width)
-                pg.draw.line(self.nodes_surface,
-                             self.line_color_selected,
-                             self.screencoords(selected.p0),
-                             self.screencoords(selected.p1),
-                             width=round(self.line_width/2))
-                pg.draw.line(self.nodes_surface,
-                             self.line_color_selected,
-                             self.screencoords(selected.p2),
-                             self.screencoords(selected.p3),
-                             width=round(self.line_width/2))
-                for p in [selected.p1, selected.p2, selected.p3]:
-                    pg.draw.circle(self.nodes_surface,
-                                   self.line_color_selected,
-                                   self.screencoords(p),
-                                   self.point_radius_selected)
-                d = distance_squared(selected.p0, selected.p3) ** 0.5
-                text = self.font.render(f"Dist: {round(d, 3)}", True, self.fg)
-                self.text_surface.blit(text, (0, 30))
-
-            if isinstance(selected, BladeOn):
-                blade_on = True
-                pg.draw.circle(self.nodes_surface,
-                               self.line_color_selected,
-                               self.screencoords(self.model.end_point()),
-                               self.point_radius_selected)
-            if isinstance(selected, BladeOff):
-                blade_on = False
-                pg.draw.circle(self.nodes_surface,
+    def update(self) -> pg.Surface:
+        self.view_key = self.model_state()
+        instructions = self.model.instructions
+        length = len(instructions)
+        selected = instructions[length - 1] if length > 0 else None
+
+        key = (self.model.revision, length, self.camera_pos,
+               self.surface.get_size())
+        if key != self.committed_key:
+            with profiler.scope("editor: committed layers"):
+                self.draw_committed()
+            self.committed_key = key
+        elif len(self.model.moved) > self.committed_moved:
+            with profiler.scope("editor: committed layers"):
+                self.redraw_committed(
+                    self.model.moved[self.committed_moved:])
+            self.committed_moved = len(self.model.moved)
+        blade_on = self.committed_blade_on
+
+        simulation = self.model.simulation
+        if simulation is not None and simulation.finished():
+            key = (simulation, self.camera_pos, self.surface.get_size())
+            if key != self.simulation_key:
+                with profiler.scope("editor: simulation layer"):
+                    self.draw_simulation(simulation)
+                self.simulation_key = key
+
+        with profiler.scope("editor: layer blits"):
+            self.surface.fill(self.bg)
+            self.surface.blit(self.committed_cut, (0, 0))
+        if blade_on:
+            with profiler.scope("editor: cut stamps"):
+                self.draw_cut(self.surface, selected)
+        with profiler.scope("editor: layer blits"):
+            if simulation is not None and simulation.finished():
+                self.surface.blit(self.simulation_overlay, (0, 0))
+            self.surface.blit(self.committed_nodes, (0, 0))
+
+        with profiler.scope("editor: selected"):
+            blade_on = self.draw_selected(selected, blade_on)
+
+        with profiler.scope("editor: text"):
+            if selected is not None:
+                readout = None
+                if isinstance(selected, Line):
+                    d = distance_squared(selected.start, selected.end) ** 0.5
+                    readout = f"Dist: {round(d, 3)}"
+                if isinstance(selected, CubicBezier):
+                    d = distance_squared(selected.p0, selected.p3) ** 0.5
+                    readout = f"Dist: {round(d, 3)}"
+                x = 0
+                if readout is not None:
+                    # the whole plan's estimate after the selected one's
+                    r = text_cache.blit(self.surface, self.font, readout,
+                                        (0, 30), self.fg, runs=True)
+                    x = r.right + self.font.size("  ")[0]
+                text_cache.blit(self.surface, self.font,
+                                f"Est: {self.model.estimate()}", (x, 30),
+                                self.fg, runs=True)
+            else:
+                text_cache.blit(self.surface, self.font, "Origin",
+                                self.screencoords(0.15, -0.15), self.fg)
+
+            text_cache.blit(self.surface, self.font,
+                            "Blade ON" if blade_on else "Blade OFF", (0, 0),
+                            self.fg)
+
+            if simulation is not None:
+                text_cache.blit(self.surface, self.font,
+                                self.simulation_status(simulation),
+                                (0, self.surface.get_height()
+                                 - self.font.get_height()), self.fg,
+                                runs=True)
+        return self.surface
+
+    def draw_selected(self, selected, blade_on):
+        # the last instruction and the point under the mouse, returns the
+        # blade state after it
+        if isinstance(selected, Line):
+            pg.draw.line(self.surface,
+                         self.line_color_selected,
+                         self.screencoords(selected.end),
+                         self.screencoords(selected.start),
+                         self.line_width)
+            pg.draw.circle(self.surface,
+                           self.line_color_selected,
+                           self.screencoords(selected.start),
+                           self.point_radius)
+            pg.draw.circle(self.surface,
+                           self.line_color_selected,
+                           self.screencoords(selected.end),
+                           self.point_radius_selected)
+        if isinstance(selected, CubicBezier):
+            self.draw_curve(self.surface, selected,
+                            self.line_color_selected)
+            pg.draw.line(self.surface,
+                         self.line_color_selected,
+                         self.screencoords(selected.p0),
+                         self.screencoords(selected.p1),
+                         width=round(self.line_width/2))
+            pg.draw.line(self.surface,
+                         self.line_color_selected,
+                         self.screencoords(selected.p2),
+                         self.screencoords(selected.p3),
+                         width=round(self.line_width/2))
+            for p in [selected.p1, selected.p2, selected.p3]:
+                pg.draw.circle(self.surface,
                                self.line_color_selected,
-                               self.screencoords(self.model.end_point()),
+                               self.screencoords(p),
                                self.point_radius_selected)
-        else:
-            pg.draw.circle(self.nodes_surface,
+        if isinstance(selected, (BladeOn, BladeOff)):
+            blade_on = isinstance(selected, BladeOn)
+            pg.draw.circle(self.surface,
+                           self.line_color_selected,
+                           self.screencoords(self.model.end_point()),
+                           self.point_radius_selected)
+        if selected is None:
+            pg.draw.circle(self.surface,
                            self.line_color_selected,
                            self.screencoords(0, 0),
                            self.point_radius_selected)
-            text = self.font.render("Origin", True, self.fg)
-            self.text_surface.blit(text, self.screencoords(0.15, -0.15))
 
-        text = self.font.render("Blade ON" if blade_on else "Blade OFF",
-                                True, self.fg)
-        self.text_surface.blit(text, (0, 0))
+        hover = self.dragging if self.dragging not in (-1, 0) else self.hover
+        if hover is not None and hover in self.model.points.points:
+            pg.draw.circle(self.surface,
+                           self.fg,
+                           self.screencoords(self.model.points.points[hover]),
+                           self.point_radius_selected,
+                           width=max(1, round(self.line_width / 2)))
+        return blade_on
 
-        self.surface.blit(self.cut_surface, (0, 0))
-        self.surface.blit(self.nodes_surface, (0, 0))
-        self.surface.blit(self.text_surface, (0, 0))
-        return self.surface
+    def point_at(self, pos):
+        # (instruction index, point index) under the screen position
+        return self.model.points.nearest(self.worldcoords(pos),
+                                         self.point_radius / self.world_scale)
 
     def on_click(self, pos: tuple[int, int], button: int):
-        instructions = self.model.instructions
-        length = len(instructions)
-
-        if length > 0:
-            selected = instructions[length - 1]
-            if isinstance(selected, Line):
-                dist = distance_squared(pos, self.screencoords(selected.end))
-                if dist < self.point_radius ** 2:
-                    self.dragging = 1
-            elif isinstance(selected, CubicBezier):
-                ps = [selected.p1, selected.p2, selected.p3]
-                for i in range(3):
-                    dist = distance_squared(pos, self.screencoords(ps[i]))
-                    if dist < self.point_radius ** 2:
-                        self.dragging = i + 1
+        hit = self.point_at(pos)
+        if hit is not None:
+            self.dragging = hit
+            self.drag = next(drag_ids)
 
         if self.dragging == -1:
             self.anchor = self.worldcoords(pos)
             self.dragging = 0  # dragging background
+        self.invalidate()
 
     def on_raise(self, pos: tuple[int, int], button: int):
         self.dragging = -1
+        self.invalidate()
 
     def on_move(self, pos: tuple[int, int]):
-        if self.dragging == 0:
+        if self.dragging == -1:
+            hover = self.point_at(pos)
+            if hover != self.hover:
+                self.hover = hover
+                self.invalidate()
+        elif self.dragging == 0:
             # move self.camera_pos such that:
             # self.anchor == self.worldcoords(pos)
             x, y = pos
@@ -250,9 +418,12 @@ class EditorFrame(ClickableSurface):
             new_cam_x = ax - ((x - self.world_width / 2) / self.world_scale)
             new_cam_y = ay - ((y - self.world_height / 2) / -self.world_scale)
             self.camera_pos = (new_cam_x, new_cam_y)
-        elif self.dragging > 0:
-            msg = message.UpdatePoint(self.dragging,
-                                      self.worldcoords(pos))
+            self.invalidate()
+        else:
+            instruction, index = self.dragging
+            msg = message.UpdatePoint(index,
+                                      self.worldcoords(pos),
+                                      instruction, self.drag)
             self.model.receive(msg)
 
     def resize(self, new_size: tuple[int, int]):
@@ -263,10 +434,15 @@ class EditorFrame(ClickableSurface):
         self.point_radius = round(self.world_scale * (1/15))
         self.point_radius_selected = round(self.world_scale * (1/8))
 
-        self.cut_surface = pg.Surface(new_size, flags=pg.SRCALPHA)
-        self.nodes_surface = pg.Surface(new_size, flags=pg.SRCALPHA)
-        self.text_surface = pg.Surface(new_size, flags=pg.SRCALPHA)
+        self.committed_cut = pg.Surface(new_size, flags=pg.SRCALPHA)
+        self.committed_nodes = pg.Surface(new_size, flags=pg.SRCALPHA)
+        # see redraw_committed
+        self.scratch_cut = pg.Surface(new_size, flags=pg.SRCALPHA)
+        self.scratch_nodes = pg.Surface(new_size, flags=pg.SRCALPHA)
+        self.simulation_overlay = pg.Surface(new_size, flags=pg.SRCALPHA)
+        self.simulation_key = None
         self.surface = pg.Surface(new_size)
+        self.invalidate()
 
     def get_size(self) -> tuple[int, int]:
         return self.surface.get_size()
@@ -279,6 +455,14 @@ class EditorFrame(ClickableSurface):
         return ((x - cam_x) * self.world_scale + self.world_width / 2,
                 -(y - cam_y) * self.world_scale + self.world_height / 2)
 
+    def screen_points(self, points):
+        # screencoords over an (n, 2) array, as a list of tuples
+        cam_x, cam_y = self.camera_pos
+        xs = (points[:, 0] - cam_x) * self.world_scale + self.world_width / 2
+        ys = -(points[:, 1] - cam_y) * self.world_scale \
+            + self.world_height / 2
+        return list(zip(xs.tolist(), ys.tolist()))
+
     def worldcoords(self, x, y=None):
         if isinstance(x, tuple) and y is None:
             return self.worldcoords(x[0], x[1])
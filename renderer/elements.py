@@ -1,10 +1,27 @@
 import pygame as pg
+from profiling import profiler
 
 
 class ClickableSurface:
+    # dirty: needs redrawing, cleared once it has been blitted
+    # parent: the surface it is blitted on, dirtied along with it
+    dirty = True
+    parent = None
+
     def __init__(self, size: tuple[int, int]):
         raise NotImplementedError()
 
+    def invalidate(self):
+        surface = self
+        while surface is not None and not surface.dirty:
+            surface.dirty = True
+            surface = surface.parent
+
+    def check(self):
+        # called every frame, for surfaces showing state that changes
+        # without an event reaching them
+        pass
+
     def update(self) -> pg.Surface:
         raise NotImplementedError()
 
@@ -36,7 +53,16 @@ class Child:
         self.x, self.y = pos
 
     def blit_on(self, target_surface: pg.Surface):
-        target_surface.blit(self.surface.update(), (self.x, self.y))
+        surface = self.surface.update()
+        with profiler.scope("root: child blits"):
+            target_surface.blit(surface, (self.x, self.y))
+        self.surface.dirty = False
+
+    def is_dirty(self) -> bool:
+        return self.surface.dirty
+
+    def get_rect(self) -> pg.Rect:
+        return pg.Rect(self.get_pos(), self.get_size())
 
     def get_pos(self) -> tuple[int, int]:
         return (self.x, self.y)
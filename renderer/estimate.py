@@ -0,0 +1,244 @@
+import argparse
+import time
+from math import sqrt
+
+import numpy as np
+
+from fastsim import BEZIER_STEPS, DIRECTION_THRESHOLD, DISTANCE_THRESHOLD, \
+    duration_seconds
+from instruction import bernstein
+from plan_io import read_plan
+from store import InstructionStore, OP_LINE, OP_CURVE
+
+# RobotSimulation::step turns in place at min(error, 1) ^ TURN_EXPONENT /
+# TURN_DIVISOR of full motor speed, and drives at the square root of the
+# distance to the target over DRIVE_DISTANCE, up to full speed
+TURN_EXPONENT = 0.7
+TURN_DIVISOR = 1.5
+DRIVE_DISTANCE = 2.0
+# On a curve tight enough that the next target is more than
+# DIRECTION_THRESHOLD off the robot's heading, part of the turning is done
+# in place: 1 - DIRECTION_THRESHOLD / that angle to this power, at the rate
+# for this share of that angle. Fitted against the simulator on arcs,
+# corners, U-turns, ds2025.json and benchmark.synthetic_plan.
+TIGHT_TURN_EXPONENT = 3.5
+TIGHT_TURN_ERROR = 0.3
+
+# util::cubic_bezier at n / BEZIER_STEPS, n < BEZIER_STEPS
+CURVE_TABLE = bernstein(np.arange(BEZIER_STEPS) / BEZIER_STEPS)
+
+
+class Estimate:
+    def __init__(self, time, blade_distance, transit_distance):
+        self.time = time                          # seconds
+        self.blade_distance = blade_distance      # meters driven cutting
+        self.transit_distance = transit_distance  # and not
+
+    def __str__(self):
+        return (f"{round(self.time, 1)} s, "
+                f"{round(self.blade_distance, 1)} m cut, "
+                f"{round(self.transit_distance, 1)} m transit")
+
+
+class Estimator:
+    # How long the simulator would take over a plan, from how its robot
+    # chases targets: it turns in place towards the next one until within
+    # DIRECTION_THRESHOLD, drives at it, slowing down over the last
+    # DRIVE_DISTANCE meters, and moves on once within DISTANCE_THRESHOLD,
+    # which is where it starts the next target from. Each target is
+    # worked out on its own from the plan's geometry, in closed form.
+    #
+    # Totals are kept for every prefix of the plan, so after an edit only
+    # the instructions from the first changed one are estimated again,
+    # which while dragging is usually just the last.
+    def __init__(self, params):
+        r = params['wheel_radius']
+        speed = params['max_motor_speed']
+        self.dt = duration_seconds(params['delta_time'])
+        self.drive_speed = r * speed     # m/s at full speed
+        # rad/s per unit of turning power
+        self.turn_speed = 2.0 * r * speed / (TURN_DIVISOR
+                                             * params['wheel_distance'])
+
+        # the plan the prefixes are for
+        self.ops = np.zeros(0, dtype=np.int8)
+        self.points = np.zeros((0, 2))
+        # after every instruction: totals, the end of its targets in path
+        # and the robot's heading
+        self.time = np.zeros(0)
+        self.blade_distance = np.zeros(0)
+        self.transit_distance = np.zeros(0)
+        self.stops = np.zeros(0, dtype=np.int64)
+        self.heading = np.zeros(0)
+        # the robot's start and every target after it, and how far along
+        # them each one is
+        self.path = np.zeros((1, 2))
+        self.along = np.zeros(1)
+
+    def estimate(self, store) -> Estimate:
+        first = self.first_change(store)
+        if first < len(store) or len(self.ops) != len(store):
+            self.update(store, first)
+        if len(store) == 0:
+            return Estimate(self.dt, 0.0, 0.0)
+        # the step that finds nothing left to do
+        return Estimate(self.time[-1] + self.dt, self.blade_distance[-1],
+                        self.transit_distance[-1])
+
+    def first_change(self, store):
+        # index of the first instruction differing from the estimated plan
+        ops = store.ops_view()
+        n = min(len(ops), len(self.ops))
+        differs = np.nonzero(ops[:n] != self.ops[:n])[0]
+        if len(differs) > 0:
+            n = int(differs[0])
+        points = store.points_view()
+        k = min(len(points), len(self.points),
+                int(store.offsets_view()[n]) if n < len(ops)
+                else len(points))
+        differs = np.nonzero((points[:k] != self.points[:k]).any(axis=1))[0]
+        if len(differs) > 0:
+            owner = np.searchsorted(store.offsets_view(), differs[0],
+                                    "right") - 1
+            n = min(n, int(owner))
+        return n
+
+    def update(self, store, first):
+        ops = store.ops_view()[first:]
+        offsets = store.offsets_view()[first:]
+        points = store.points_view()
+        blade = store.blade_view()[first:]
+
+        # the targets of every instruction, in order
+        counts = np.select([ops == OP_LINE, ops == OP_CURVE],
+                           [2, BEZIER_STEPS], 0)
+        stops = np.cumsum(counts)
+        targets = np.zeros((int(stops[-1]) if len(ops) > 0 else 0, 2))
+        lines = np.nonzero(ops == OP_LINE)[0]
+        starts = stops[lines] - 2
+        targets[starts] = points[offsets[lines]]
+        targets[starts + 1] = points[offsets[lines] + 1]
+        curves = np.nonzero(ops == OP_CURVE)[0]
+        if len(curves) > 0:
+            control = points[offsets[curves][:, None] + np.arange(4)]
+            targets[(stops[curves] - BEZIER_STEPS)[:, None]
+                    + np.arange(BEZIER_STEPS)] = CURVE_TABLE @ control
+        cutting = np.repeat(blade, counts)
+
+        kept = int(self.stops[first - 1]) if first > 0 else 1
+        heading = self.heading[first - 1] if first > 0 else 0.0
+        along, headings, seconds, driven = self.targets(
+            targets, self.path[:kept], self.along[:kept], heading)
+
+        # per instruction: its targets, and one step for a blade change or
+        # for finding the targets are done
+        steps = np.concatenate([[0.0], np.cumsum(seconds)])[stops] \
+            + np.arange(1, len(ops) + 1) * self.dt
+        cut = np.concatenate([[0.0], np.cumsum(driven * cutting)])[stops]
+        transit = np.concatenate([[0.0],
+                                  np.cumsum(driven * ~cutting)])[stops]
+        if first > 0:
+            steps += self.time[first - 1]
+            cut += self.blade_distance[first - 1]
+            transit += self.transit_distance[first - 1]
+
+        self.time = np.concatenate([self.time[:first], steps])
+        self.blade_distance = np.concatenate([self.blade_distance[:first],
+                                              cut])
+        self.transit_distance = np.concatenate(
+            [self.transit_distance[:first], transit])
+        # the heading carries over instructions without targets, stops
+        # indexing it past the one before the first
+        self.stops = np.concatenate([self.stops[:first], kept + stops])
+        self.heading = np.concatenate([self.heading[:first],
+                                       headings[stops]])
+        self.path = np.concatenate([self.path[:kept], targets])
+        self.along = np.concatenate([self.along[:kept], along])
+        self.ops = store.ops_view().copy()
+        self.points = store.points_view().copy()
+
+    def targets(self, targets, path, along, heading):
+        # For targets in order, after the path so far (the robot's start
+        # and the targets since) and how far along it each point is, with
+        # the robot facing heading: (how far along the path the targets
+        # are, the headings, the one before in front, and the seconds to
+        # and meters driven to each target)
+        legs = np.diff(np.vstack([path[-1:], targets]), axis=0)
+        ahead = along[-1] + np.cumsum(np.hypot(legs[:, 0], legs[:, 1]))
+
+        # the robot moved on DISTANCE_THRESHOLD short of the last target,
+        # about that far back along the path
+        tail = max(int(np.searchsorted(
+            along, along[-1] - DISTANCE_THRESHOLD, "right")) - 1, 0)
+        known = np.concatenate([along[tail:], ahead])
+        points = np.vstack([path[tail:], targets])
+        back = np.concatenate([along[-1:], ahead])[:-1] - DISTANCE_THRESHOLD
+        to_target = targets - np.column_stack(
+            [np.interp(back, known, points[:, 0]),
+             np.interp(back, known, points[:, 1])])
+        distances = np.hypot(to_target[:, 0], to_target[:, 1])
+        headings = np.concatenate([[heading], np.arctan2(to_target[:, 1],
+                                                         to_target[:, 0])])
+        # a target where the last one was is DISTANCE_THRESHOLD away give or
+        # take rounding, and the robot is already within that
+        far = np.concatenate([[True], distances
+                              > DISTANCE_THRESHOLD * (1.0 + 1e-9)])
+        headings = headings[np.maximum.accumulate(
+            np.where(far, np.arange(len(targets) + 1), 0))]
+        turns = np.abs((np.diff(headings) + np.pi) % (2 * np.pi) - np.pi)
+        driven = np.maximum(distances - DISTANCE_THRESHOLD, 0.0)
+
+        # how far off the next target is on a curve this tight: half the
+        # turning over the distance to it
+        curving = np.divide(turns, driven, out=np.zeros_like(turns),
+                            where=(driven > 0)
+                            & (turns <= DIRECTION_THRESHOLD))
+        off = curving * (DISTANCE_THRESHOLD + driven) / 2.0
+        in_place = np.clip(1.0 - DIRECTION_THRESHOLD
+                           / np.maximum(off, DIRECTION_THRESHOLD), 0.0, 1.0)
+        in_place_rate = self.turn_speed * np.clip(
+            TIGHT_TURN_ERROR * off, DIRECTION_THRESHOLD, 1.0) ** TURN_EXPONENT
+
+        seconds = np.maximum(
+            self.turn_time(turns) + self.drive_time(distances)
+            + in_place ** TIGHT_TURN_EXPONENT * turns / in_place_rate,
+            self.dt)
+        return ahead, headings, seconds, driven
+
+    def turn_time(self, angles):
+        # turning in place from angles off down to DIRECTION_THRESHOLD,
+        # slower once less than a radian off
+        a = 1.0 - TURN_EXPONENT
+        rate = self.turn_speed
+        near = DIRECTION_THRESHOLD ** a
+        return np.where(
+            angles <= DIRECTION_THRESHOLD, 0.0,
+            np.maximum(angles - 1.0, 0.0) / rate
+            + (np.minimum(angles, 1.0) ** a - near) / (a * rate))
+
+    def drive_time(self, distances):
+        # driving from distances away down to DISTANCE_THRESHOLD, at full
+        # speed until DRIVE_DISTANCE away
+        v = self.drive_speed
+        slow = np.minimum(distances, DRIVE_DISTANCE)
+        return np.where(
+            distances <= DISTANCE_THRESHOLD, 0.0,
+            np.maximum(distances - DRIVE_DISTANCE, 0.0) / v
+            + 2.0 * sqrt(DRIVE_DISTANCE) / v
+            * (np.sqrt(slow) - sqrt(DISTANCE_THRESHOLD)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Estimate how long the simulator takes over a plan")
+    parser.add_argument("plan", help="exported plan JSON")
+    args = parser.parse_args()
+
+    with open(args.plan, "r") as f:
+        params, ops, points = read_plan(f)
+    store = InstructionStore()
+    store.append_arrays(ops, points)
+    started = time.perf_counter()
+    estimate = Estimator(params).estimate(store)
+    seconds = time.perf_counter() - started
+    print(f"{estimate} (estimated in {seconds * 1000:.1f} ms)")
@@ -0,0 +1,337 @@
+import argparse
+import itertools
+from itertools import repeat
+from math import atan2, ceil, pow, pi as PI
+
+import numpy as np
+
+from plan_io import read_plan
+from store import InstructionStore, OP_BLADE_ON, OP_BLADE_OFF, OP_LINE, \
+    OP_CURVE
+
+# constants of RobotSimulation in simulation/src/simulation.rs
+BEZIER_STEPS = 100
+DIRECTION_THRESHOLD = 5.0 * (PI / 180.0)
+DISTANCE_THRESHOLD = 0.1
+CORRECTION_FACTOR = 4.0
+
+# what an instruction does once it is popped
+SET_BLADE_ON = 0
+SET_BLADE_OFF = 1
+GOTO_POINTS = 2
+
+IDLE = 0
+GOTO = 1
+
+
+def duration_seconds(duration):
+    # Duration::as_secs_f64
+    return float(duration["secs"]) + float(duration["nanos"]) / 1e9
+
+
+def seconds_duration(seconds):
+    secs = int(seconds)
+    return {"secs": secs, "nanos": round((seconds - secs) * 1e9)}
+
+
+class Plan:
+    # A plan flattened the way RobotSimulation sees it: every instruction
+    # either sets the blade or becomes a run of target points.
+    def __init__(self, store):
+        ops = store.ops_view()
+        # Lines go to their start and end, curves to 100 samples
+        targets = np.where(ops == OP_LINE, 2,
+                           np.where(ops == OP_CURVE, BEZIER_STEPS, 0))
+        self.kind = np.select([ops == OP_BLADE_ON, ops == OP_BLADE_OFF],
+                              [SET_BLADE_ON, SET_BLADE_OFF], GOTO_POINTS)
+        self.stop = np.cumsum(targets)
+        self.start = self.stop - targets
+
+        self.x = np.zeros(self.stop[-1] if len(ops) > 0 else 0)
+        self.y = np.zeros_like(self.x)
+        offsets = store.offsets_view()
+        points = store.points_view()
+
+        lines = np.nonzero(ops == OP_LINE)[0]
+        for k in range(2):
+            self.x[self.start[lines] + k] = points[offsets[lines] + k, 0]
+            self.y[self.start[lines] + k] = points[offsets[lines] + k, 1]
+
+        curves = np.nonzero(ops == OP_CURVE)[0]
+        if len(curves) > 0:
+            # util::cubic_bezier, in the same order of operations
+            t = np.arange(BEZIER_STEPS) / BEZIER_STEPS
+            o = 1.0 - t
+            index = self.start[curves][:, None] + np.arange(BEZIER_STEPS)
+            p = [points[offsets[curves] + k][:, None, :] for k in range(4)]
+            for axis, out in ((0, self.x), (1, self.y)):
+                out[index] = (o * o * o * p[0][..., axis]
+                              + 3.0 * o * o * t * p[1][..., axis]
+                              + 3.0 * o * t * t * p[2][..., axis]
+                              + t * t * t * p[3][..., axis])
+
+    def __len__(self):
+        return len(self.kind)
+
+
+class LaneParams:
+    # one entry per lane, from sim_dict style parameter dicts
+    def __init__(self, params):
+        self.params = list(params)
+        self.wheel_distance = np.array(
+                [p["wheel_distance"] for p in self.params], dtype=np.float64)
+        self.wheel_radius = np.array(
+                [p["wheel_radius"] for p in self.params], dtype=np.float64)
+        self.max_motor_speed = np.array(
+                [p["max_motor_speed"] for p in self.params], dtype=np.float64)
+        self.delta_time = np.array(
+                [duration_seconds(p["delta_time"]) for p in self.params])
+
+        # steps to run for, or -1 to run until the instructions run out
+        limits = []
+        for p, dt in zip(self.params, self.delta_time):
+            length = p.get("sim_length", "Indefinite")
+            if length == "Indefinite":
+                limits.append(-1)
+            elif "Timed" in length:
+                limits.append(ceil(duration_seconds(length["Timed"]) / dt))
+            else:
+                limits.append(length["Steps"])
+        # the simulation loop always runs at least one step
+        self.limit = np.array([-1 if s < 0 else max(s, 1) for s in limits],
+                              dtype=np.int64)
+
+    def __len__(self):
+        return len(self.params)
+
+
+class LaneResults:
+    def __init__(self, params):
+        n = len(params)
+        self.params = params.params
+        self.steps = np.zeros(n, dtype=np.int64)
+        self.finished = np.zeros(n, dtype=bool)
+        self.x = np.zeros(n)
+        self.y = np.zeros(n)
+        self.theta = np.zeros(n)
+        self.blade_on = np.zeros(n, dtype=bool)
+        self.distance = np.zeros(n)         # meters travelled
+        self.blade_distance = np.zeros(n)   # of those with the blade on
+        self.time = np.zeros(n)             # seconds simulated
+        self.path = None   # (steps + 1, lanes, 4) x, y, theta, blade_on
+
+    def rows(self):
+        for i, p in enumerate(self.params):
+            yield p, {"finished": bool(self.finished[i]),
+                      "steps": int(self.steps[i]),
+                      "time": float(self.time[i]),
+                      "distance": float(self.distance[i]),
+                      "blade_distance": float(self.blade_distance[i]),
+                      "x": float(self.x[i]),
+                      "y": float(self.y[i]),
+                      "theta": float(self.theta[i])}
+
+
+def simulate(store, params, max_steps=10_000_000, record=False,
+             exact=False):
+    # Runs the plan in store once for every parameter dict in params, as
+    # lanes of one array simulation. Reproduces run_simulation and
+    # RobotSimulation::step of simulation/src step by step. numpy's atan2
+    # and pow can be an ulp off libm's, which the simulator uses; exact
+    # calls libm for those, bit for bit but slower.
+    plan = Plan(store)
+    params = LaneParams(params)
+    results = LaneResults(params)
+    n = len(params)
+
+    # state of the lanes still running, compacted as lanes finish
+    lane = np.arange(n)
+    x = np.zeros(n)
+    y = np.zeros(n)
+    theta = np.zeros(n)
+    blade = np.zeros(n, dtype=bool)
+    left = np.zeros(n)
+    right = np.zeros(n)
+    mode = np.full(n, IDLE, dtype=np.int8)
+    inst = np.zeros(n, dtype=np.int64)
+    target = np.zeros(n, dtype=np.int64)
+    stop = np.zeros(n, dtype=np.int64)
+    distance = np.zeros(n)
+    blade_distance = np.zeros(n)
+    steps = np.zeros(n, dtype=np.int64)
+    r = params.wheel_radius
+    s = params.wheel_distance
+    speed = params.max_motor_speed
+    dt = params.delta_time
+    limit = params.limit
+
+    path = None
+    if record:
+        path = [np.zeros((n, 4))]
+
+    for _ in range(max_steps):
+        if len(lane) == 0:
+            break
+
+        # Idle: stop, then start on the next instruction
+        ended = np.zeros(len(lane), dtype=bool)
+        idle = np.nonzero(mode == IDLE)[0]
+        if len(idle) > 0:
+            left[idle] = 0.0
+            right[idle] = 0.0
+            more = inst[idle] < len(plan)
+            ended[idle[~more]] = True
+            idle = idle[more]
+            k = inst[idle]
+            inst[idle] += 1
+            kind = plan.kind[k]
+            blade[idle[kind == SET_BLADE_ON]] = True
+            blade[idle[kind == SET_BLADE_OFF]] = False
+            goto = kind == GOTO_POINTS
+            mode[idle[goto]] = GOTO
+            target[idle[goto]] = plan.start[k[goto]]
+            stop[idle[goto]] = plan.stop[k[goto]]
+
+        # GotoPoints: back to Idle once empty, motors as they were
+        going = np.nonzero(mode == GOTO)[0]
+        empty = target[going] >= stop[going]
+        mode[going[empty]] = IDLE
+        going = going[~empty]
+        if len(going) > 0:
+            k = target[going]
+            dx = plan.x[k] - x[going]
+            dy = plan.y[k] - y[going]
+            to_target = np.sqrt(dx * dx + dy * dy)
+            if exact:
+                angle = np.array(list(map(atan2, dy.tolist(), dx.tolist())))
+            else:
+                angle = np.arctan2(dy, dx)
+            # signed_angle_difference, rem_euclid by hand
+            error = np.fmod(angle - theta[going] + PI, 2.0 * PI)
+            error = np.where(error < 0.0, error + 2.0 * PI, error) - PI
+
+            turn = np.abs(error) > DIRECTION_THRESHOLD
+            base = np.minimum(np.abs(error), 1.0)
+            if exact:
+                turn_power = np.ones(len(going))
+                turn_power[turn] = list(map(pow, base[turn].tolist(),
+                                            repeat(0.7)))
+            else:
+                turn_power = np.power(base, 0.7)
+            turn_power = np.copysign(1.0, error) * turn_power / 1.5
+            power = np.sqrt(np.minimum(to_target, 2.0) / 2.0)
+            right[going] = np.where(turn, turn_power,
+                                    error * CORRECTION_FACTOR + power)
+            left[going] = np.where(turn, -turn_power,
+                                   -error * CORRECTION_FACTOR + power)
+            target[going[to_target < DISTANCE_THRESHOLD]] += 1
+
+        np.clip(left, -1.0, 1.0, out=left)
+        np.clip(right, -1.0, 1.0, out=right)
+
+        # differential drive update, theta from before the step
+        phi_l = left * speed
+        phi_r = right * speed
+        dx = (r * np.cos(theta) / 2.0) * (phi_l + phi_r) * dt
+        dy = (r * np.sin(theta) / 2.0) * (phi_l + phi_r) * dt
+        x += dx
+        y += dy
+        theta += (r / s) * (phi_r - phi_l) * dt
+        moved = np.sqrt(dx * dx + dy * dy)
+        distance += moved
+        blade_distance += np.where(blade, moved, 0.0)
+        steps += 1
+
+        if record:
+            frame = path[-1].copy()
+            frame[lane] = np.stack([x, y, theta, blade], axis=1)
+            path.append(frame)
+
+        done = np.where(limit < 0, ended, steps >= limit)
+        if done.any():
+            out = lane[done]
+            results.finished[out] = True
+            results.steps[out] = steps[done]
+            results.x[out] = x[done]
+            results.y[out] = y[done]
+            results.theta[out] = theta[done]
+            results.blade_on[out] = blade[done]
+            results.distance[out] = distance[done]
+            results.blade_distance[out] = blade_distance[done]
+
+            keep = ~done
+            lane = lane[keep]
+            x, y, theta, blade = x[keep], y[keep], theta[keep], blade[keep]
+            left, right = left[keep], right[keep]
+            mode, inst = mode[keep], inst[keep]
+            target, stop = target[keep], stop[keep]
+            distance = distance[keep]
+            blade_distance = blade_distance[keep]
+            steps = steps[keep]
+            r, s, speed, dt = r[keep], s[keep], speed[keep], dt[keep]
+            limit = limit[keep]
+
+    # lanes cut off by max_steps
+    results.steps[lane] = steps
+    results.x[lane] = x
+    results.y[lane] = y
+    results.theta[lane] = theta
+    results.blade_on[lane] = blade
+    results.distance[lane] = distance
+    results.blade_distance[lane] = blade_distance
+
+    results.time = results.steps * params.delta_time
+    if record:
+        results.path = np.stack(path)
+    return results
+
+
+def param_grid(base, **axes):
+    # Every combination of the values given for some parameters, on top of
+    # base. delta_time values are in seconds.
+    names = list(axes)
+    grid = []
+    for values in itertools.product(*(axes[name] for name in names)):
+        params = dict(base)
+        for name, value in zip(names, values):
+            if name == "delta_time":
+                value = seconds_duration(value)
+            params[name] = value
+        grid.append(params)
+    return grid
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Simulate a plan for every combination of parameters")
+    parser.add_argument("plan", help="exported plan JSON")
+    parser.add_argument("--wheel-distance", type=float, nargs="+")
+    parser.add_argument("--wheel-radius", type=float, nargs="+")
+    parser.add_argument("--max-motor-speed", type=float, nargs="+")
+    parser.add_argument("--delta-time", type=float, nargs="+",
+                        help="seconds")
+    parser.add_argument("--max-steps", type=int, default=10_000_000)
+    args = parser.parse_args()
+
+    with open(args.plan, "r") as f:
+        base, ops, points = read_plan(f)
+    store = InstructionStore()
+    store.append_arrays(ops, points)
+
+    axes = {name: values for name, values in
+            (("wheel_distance", args.wheel_distance),
+             ("wheel_radius", args.wheel_radius),
+             ("max_motor_speed", args.max_motor_speed),
+             ("delta_time", args.delta_time))
+            if values is not None}
+    results = simulate(store, param_grid(base, **axes), args.max_steps)
+
+    columns = list(axes) + ["finished", "time", "distance",
+                            "blade_distance"]
+    print("\t".join(columns))
+    for params, row in results.rows():
+        values = [duration_seconds(params[name]) if name == "delta_time"
+                  else params[name] for name in axes]
+        values += [row["finished"], round(row["time"], 3),
+                   round(row["distance"], 3), round(row["blade_distance"], 3)]
+        print("\t".join(str(v) for v in values))
@@ -0,0 +1,296 @@
+import argparse
+import json
+from bisect import bisect
+from math import cos, radians
+
+import numpy as np
+
+from instruction import bernstein
+from store import OP_LINE, OP_CURVE
+
+# Newton steps tried on the parameters of a curve that is close, and how
+# close it has to be, as a multiple of the tolerance
+REPARAMETERIZE_STEPS = 4
+REPARAMETERIZE_ERROR = 8.0
+# length of path either side of a point its direction is measured over,
+# in tolerances
+CORNER_SCALE = 4.0
+
+
+def unit(v):
+    norm = np.hypot(v[0], v[1])
+    return v / norm if norm > 0 else v
+
+
+def remove_duplicates(points):
+    if len(points) == 0:
+        return points
+    keep = np.ones(len(points), dtype=bool)
+    keep[1:] = (np.diff(points, axis=0) != 0).any(axis=1)
+    return points[keep]
+
+
+def windows(points, scale):
+    # for every point, the points about scale meters of path behind and
+    # ahead of it, at least its neighbours
+    steps = np.hypot(*np.diff(points, axis=0).T)
+    s = np.concatenate([[0.0], np.cumsum(steps)])
+    i = np.arange(len(points))
+    last = len(points) - 1
+    back = np.searchsorted(s, s - scale, side="right") - 1
+    back = np.minimum(np.maximum(back, 0), np.maximum(i - 1, 0))
+    forward = np.searchsorted(s, s + scale)
+    forward = np.minimum(np.maximum(forward, i + 1), last)
+    return s, back, forward
+
+
+def corners(points, corner_angle, scale):
+    # indices of the points where the polyline turns by more than
+    # corner_angle degrees, with the first and last point. The turn is
+    # measured over scale meters either side, so that noise smaller than
+    # that makes no corners, and only the sharpest point of a turn counts.
+    s, back, forward = windows(points, scale)
+    v1 = points - points[back]
+    v2 = points[forward] - points
+    norms = np.hypot(v1[:, 0], v1[:, 1]) * np.hypot(v2[:, 0], v2[:, 1])
+    cosine = np.divide((v1 * v2).sum(axis=1), norms,
+                       out=np.ones(len(points)), where=norms > 0)
+    turning = cosine < cos(radians(corner_angle))
+    turning[[0, -1]] = False
+
+    # sharpest first, skipping points within scale of a corner already
+    # taken, which are the same turn
+    result = [0, len(points) - 1]
+    taken = [-np.inf, np.inf]
+    candidates = np.nonzero(turning)[0]
+    for i in candidates[np.argsort(cosine[candidates])].tolist():
+        k = bisect(taken, s[i])
+        if s[i] - taken[k - 1] > scale and taken[k] - s[i] > scale:
+            taken.insert(k, s[i])
+            result.append(i)
+    return np.array(sorted(result))
+
+
+def chord_error(points):
+    # farthest distance of the points from the chord between the ends
+    chord = points[-1] - points[0]
+    v = points - points[0]
+    length = (chord * chord).sum()
+    if length > 0:
+        t = np.clip(v @ chord / length, 0.0, 1.0)
+        v = v - t[:, None] * chord
+    return float(np.hypot(v[:, 0], v[:, 1]).max())
+
+
+def chord_parameters(points):
+    steps = np.hypot(*np.diff(points, axis=0).T)
+    u = np.concatenate([[0.0], np.cumsum(steps)])
+    return u / u[-1]
+
+
+def least_squares_curve(points, u, t1, t2):
+    # Control points of the cubic through the ends of points, leaving
+    # along t1 and arriving against t2, closest to points at parameters u
+    b = bernstein(u)
+    p0, p3 = points[0], points[-1]
+    a1 = b[:, 1:2] * t1
+    a2 = b[:, 2:3] * t2
+    c00 = (a1 * a1).sum()
+    c01 = (a1 * a2).sum()
+    c11 = (a2 * a2).sum()
+    rest = points - (b[:, 0:1] + b[:, 1:2]) * p0 \
+        - (b[:, 2:3] + b[:, 3:4]) * p3
+    x0 = (a1 * rest).sum()
+    x1 = (a2 * rest).sum()
+
+    det = c00 * c11 - c01 * c01
+    length = np.hypot(*(p3 - p0))
+    alpha1 = alpha2 = 0.0
+    if det != 0:
+        alpha1 = (x0 * c11 - x1 * c01) / det
+        alpha2 = (c00 * x1 - c01 * x0) / det
+    if alpha1 < 1e-6 * length or alpha2 < 1e-6 * length:
+        # degenerate fit, fall back on the usual thirds of the chord
+        alpha1 = alpha2 = length / 3.0
+    return np.array([p0, p0 + alpha1 * t1, p3 + alpha2 * t2, p3])
+
+
+def reparameterize(points, u, control):
+    # one Newton step on each parameter towards the closest point of the
+    # curve to its point
+    b = bernstein(u)
+    q = b @ control
+    d1 = 3.0 * np.diff(control, axis=0)
+    d2 = 2.0 * np.diff(d1, axis=0)
+    o = 1.0 - u
+    q1 = (o * o)[:, None] * d1[0] + (2 * o * u)[:, None] * d1[1] \
+        + (u * u)[:, None] * d1[2]
+    q2 = o[:, None] * d2[0] + u[:, None] * d2[1]
+    diff = q - points
+    numerator = (diff * q1).sum(axis=1)
+    denominator = (q1 * q1).sum(axis=1) + (diff * q2).sum(axis=1)
+    step = np.divide(numerator, denominator,
+                     out=np.zeros_like(numerator), where=denominator != 0)
+    return np.clip(u - step, 0.0, 1.0)
+
+
+def curve_error(points, u, control):
+    # (largest distance, index of the point it is at) between points and
+    # the curve at parameters u
+    d = bernstein(u) @ control - points
+    d = np.hypot(d[:, 0], d[:, 1])
+    i = int(np.argmax(d[1:-1])) + 1 if len(points) > 2 else 0
+    return float(d.max()), i
+
+
+def fit(piece, t1, t2, tolerance):
+    # (op, points, None) for a Line where the points are that straight,
+    # else for the least squares cubic leaving along t1 and arriving
+    # against t2 if it is close enough, else (None, None, its worst point)
+    if len(piece) == 2 or chord_error(piece) <= tolerance:
+        return OP_LINE, [piece[0], piece[-1]], None
+
+    u = chord_parameters(piece)
+    control = least_squares_curve(piece, u, t1, t2)
+    error, split = curve_error(piece, u, control)
+    if tolerance < error < REPARAMETERIZE_ERROR * tolerance:
+        for _ in range(REPARAMETERIZE_STEPS):
+            u = reparameterize(piece, u, control)
+            control = least_squares_curve(piece, u, t1, t2)
+            error, split = curve_error(piece, u, control)
+            if error <= tolerance:
+                break
+    if error <= tolerance:
+        return OP_CURVE, list(control), None
+    return None, None, split
+
+
+def fit_piece(points, tolerance, scale, ops, out):
+    # Schneider's algorithm on a piece of polyline without corners: a
+    # Line or the least squares cubic, split at its worst point until every
+    # piece is close enough. Tangents are taken over scale meters, not
+    # between neighbours.
+    _, back, forward = windows(points, scale)
+    t1 = unit(points[forward[0]] - points[0])
+    t2 = unit(points[back[-1]] - points[-1])
+    pieces = []   # (first, last, t1, t2, op, points), in order
+    stack = [(0, len(points) - 1, t1, t2)]
+    while stack:
+        first, last, t1, t2 = stack.pop()
+        op, control, split = fit(points[first:last + 1], t1, t2, tolerance)
+        if op is not None:
+            pieces.append((first, last, t1, t2, op, control))
+            continue
+
+        # split at the worst point, both halves meeting at its tangent
+        split += first
+        center = unit(points[back[split]] - points[forward[split]])
+        stack.append((split, last, -center, t2))
+        stack.append((first, split, t1, center))
+
+    # Worst points are rarely where the fewest pieces would meet, a circle
+    # splits into 12 where 4 would do. Neighbours are joined while one
+    # piece over both is close enough, else the first is stretched as far
+    # into the second as stays close enough.
+    joined = [pieces[0]]
+    for piece in pieces[1:]:
+        first, middle, t1, _, _, _ = joined[-1]
+        _, last, _, t2, _, _ = piece
+        op, control, _ = fit(points[first:last + 1], t1, t2, tolerance)
+        if op is not None:
+            joined[-1] = (first, last, t1, t2, op, control)
+            continue
+        low, high = middle, last   # the first fits to low, not to high
+        while high - low > 1:
+            split = (low + high) // 2
+            center = unit(points[back[split]] - points[forward[split]])
+            if fit(points[first:split + 1], t1, center,
+                   tolerance)[0] is None:
+                high = split
+            else:
+                low = split
+        center = unit(points[back[low]] - points[forward[low]])
+        head = fit(points[first:low + 1], t1, center, tolerance)
+        tail = fit(points[low:last + 1], -center, t2, tolerance)
+        if low == middle or tail[0] is None:
+            joined.append(piece)
+        else:
+            joined[-1] = (first, low, t1, center) + head[:2]
+            joined.append((low, last, -center, t2) + tail[:2])
+    for _, _, _, _, op, control in joined:
+        ops.append(op)
+        out += control
+
+
+def fit_polyline(points, tolerance=0.05, corner_angle=60.0, start=None):
+    # Fits the polyline with as few Lines and CubicBeziers as keep every
+    # point within tolerance meters of them, never smoothing over a turn
+    # sharper than corner_angle degrees. With start, a Line from there to
+    # the first point goes first. Returns (ops, points) for
+    # InstructionStore.append_arrays.
+    points = remove_duplicates(np.asarray(points, dtype=np.float64)
+                               .reshape(-1, 2))
+    ops = []
+    out = []
+    if start is not None and len(points) > 0 \
+            and tuple(points[0].tolist()) != tuple(start):
+        ops.append(OP_LINE)
+        out += [np.array(start, dtype=np.float64), points[0]]
+    if len(points) > 1:
+        scale = CORNER_SCALE * tolerance
+        ends = corners(points, corner_angle, scale)
+        for first, last in zip(ends[:-1], ends[1:]):
+            fit_piece(points[first:last + 1], tolerance, scale, ops, out)
+    return (np.array(ops, dtype=np.int8),
+            np.array(out, dtype=np.float64).reshape(-1, 2))
+
+
+def load_polylines(path):
+    # a JSON list of [x, y] points or of such lists, or lines of x,y
+    with open(path, "r") as f:
+        text = f.read()
+    try:
+        obj = json.loads(text)
+    except json.JSONDecodeError:
+        rows = [line.split("#")[0].replace(",", " ").split()
+                for line in text.splitlines()]
+        return [[(float(x), float(y)) for x, y in
+                 (row[:2] for row in rows if len(row) >= 2)]]
+    if len(obj) > 0 and isinstance(obj[0][0], (int, float)):
+        return [obj]
+    return obj
+
+
+if __name__ == "__main__":
+    # model imports this module
+    from model import InstructionBuilderModel
+    from plan_io import write_plan
+    import message
+
+    parser = argparse.ArgumentParser(
+        description="Fit surveyed polylines with Lines and CubicBeziers "
+                    "and write them as a plan")
+    parser.add_argument("polylines", help="JSON points or x,y lines")
+    parser.add_argument("output", help="where to write the plan")
+    parser.add_argument("--tolerance", type=float, default=0.05,
+                        help="meters")
+    parser.add_argument("--corner-angle", type=float, default=60.0,
+                        help="degrees")
+    parser.add_argument("--cut", action="store_true",
+                        help="blade on along the polylines")
+    args = parser.parse_args()
+
+    model = InstructionBuilderModel()
+    count = 0
+    for polyline in load_polylines(args.polylines):
+        count += len(polyline)
+        if args.cut:
+            model.receive(message.AppendPolyline(polyline[:1]))
+            model.receive(message.BladeOn())
+        model.receive(message.AppendPolyline(polyline, args.tolerance,
+                                             args.corner_angle))
+        if args.cut:
+            model.receive(message.BladeOff())
+    print(f"{count} points -> {len(model.instructions)} instructions")
+    with open(args.output, "w") as f:
+        write_plan(f, model.sim_params(), model.instructions)
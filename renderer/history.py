@@ -0,0 +1,93 @@
+import message
+
+# edits that are not replayed from the log, a checkpoint is always taken
+# right after them instead
+NOT_REPLAYABLE = (message.Import, message.OptimizeOrder)
+
+
+class History:
+    # Undo/redo over the edits applied to an instruction store. Every edit
+    # goes into the log, and every `interval` edits the store is
+    # checkpointed with a copy-on-write snapshot. Moving to another point
+    # of the log restores the nearest checkpoint before it and replays at
+    # most `interval` edits, however large the plan is.
+    def __init__(self, store, interval=32, max_checkpoints=64):
+        self.store = store
+        self.interval = interval
+        self.max_checkpoints = max_checkpoints
+
+        self.log = []       # applied edits, None once out of reach
+        self.cursor = 0     # number of log entries currently applied
+        self.first = 0      # oldest position undo can go back to
+        self.checkpoints = {0: store.snapshot()}  # log position -> snapshot
+
+    def can_undo(self):
+        return self.cursor > self.first
+
+    def can_redo(self):
+        return self.cursor < len(self.log)
+
+    def record(self, m):
+        # m has already been applied to the store
+        if self.cursor < len(self.log):
+            # a new edit after undoing drops everything that was undone
+            del self.log[self.cursor:]
+            for position in [p for p in self.checkpoints if p > self.cursor]:
+                self.store.release(self.checkpoints.pop(position))
+
+        if self.coalesces(m):
+            # dragging a point is one edit, however many moves it took. A
+            # checkpoint at the cursor held the state before this move.
+            self.log[-1] = m
+            if self.cursor in self.checkpoints:
+                self.store.release(self.checkpoints[self.cursor])
+                self.checkpoints[self.cursor] = self.store.snapshot()
+            return
+
+        self.log.append(m)
+        self.cursor += 1
+        since = self.cursor - max(self.checkpoints)
+        if isinstance(m, NOT_REPLAYABLE) or since >= self.interval:
+            self.checkpoint()
+
+    def coalesces(self, m):
+        if len(self.log) == 0:
+            return False
+        last = self.log[-1]
+        return (isinstance(m, message.UpdatePoint)
+                and isinstance(last, message.UpdatePoint)
+                and m.drag is not None and m.drag == last.drag
+                and m.instruction == last.instruction
+                and m.index == last.index)
+
+    def checkpoint(self):
+        self.checkpoints[self.cursor] = self.store.snapshot()
+        if len(self.checkpoints) > self.max_checkpoints:
+            oldest = min(self.checkpoints)
+            self.store.release(self.checkpoints.pop(oldest))
+            self.first = min(self.checkpoints)
+            for position in range(oldest, self.first):
+                self.log[position] = None
+
+    def go_to(self, target, apply):
+        # apply(m) re-applies a logged edit. Returns the indices of the
+        # instructions a restored checkpoint may have changed.
+        changed = set()
+        base = max(p for p in self.checkpoints if p <= target)
+        if not (self.cursor <= target and base <= self.cursor):
+            changed = self.store.restore(self.checkpoints[base])
+            self.cursor = base
+        for position in range(self.cursor, target):
+            apply(self.log[position])
+        self.cursor = target
+        return changed
+
+    def undo(self, apply):
+        if not self.can_undo():
+            return set()
+        return self.go_to(self.cursor - 1, apply)
+
+    def redo(self, apply):
+        if not self.can_redo():
+            return set()
+        return self.go_to(self.cursor + 1, apply)
@@ -3,15 +3,22 @@ from elements import click_children, raise_children, \
                      move_children, Child, ClickableSurface
 from model import InstructionBuilderModel
 from editor import EditorFrame
+from profiling import profiler
 import message
 
+# frames per second while something is changing
+FRAME_CAP = 60
+# milliseconds to sleep waiting for input while nothing is, checking on
+# a running simulation in between
+IDLE_TIMEOUT = 100
+
 
 class Root(ClickableSurface):
     def __init__(self, size, model):
         self.surface = None
         self.bg = (40, 40, 40)       # #282828
 
-        trb_size = (300, 75)
+        trb_size = (300, 60)
         button_fg = (235, 219, 178)  # #EBDBB2
         button_bg = (80, 73, 69)     # #504945
         font = pg.font.Font(pg.font.get_default_font(), 32)
@@ -28,12 +35,16 @@ class Root(ClickableSurface):
                 button_child(trb_size, "Curve", message.AddCurve()),
                 button_child(trb_size, "Blade off", message.BladeOff()),
                 button_child(trb_size, "Blade on", message.BladeOn()),
+                button_child(trb_size, "Simulate", message.BeginSimulation()),
+                button_child(trb_size, "Optimize order", message.OptimizeOrder()),
                 ]
 
-        brb_size = (300, 75)
+        brb_size = (300, 60)
         self.bottom_right_buttons: list[Child] = [
                 button_child(brb_size, "Export", message.Export()),
-                button_child(brb_size, "Import", message.Import())
+                button_child(brb_size, "Import", message.Import()),
+                button_child(brb_size, "Redo", message.Redo()),
+                button_child(brb_size, "Undo", message.Undo())
                 ]
 
         self.editor_frame = Child(EditorFrame((0, 0), model), (0, 0))
@@ -42,7 +53,11 @@ class Root(ClickableSurface):
         self.children += self.top_right_buttons
         self.children += self.bottom_right_buttons
         self.children += [self.editor_frame]
+        for child in self.children:
+            child.surface.parent = self
 
+        # screen areas the last update changed
+        self.damage = []
         self.resize(size)
 
     def on_click(self, pos, button):
@@ -57,6 +72,9 @@ class Root(ClickableSurface):
     def resize(self, new_size):
         new_width, new_height = new_size
         self.surface = pg.Surface((new_width, new_height))
+        # a new surface has nothing on it yet
+        self.redraw_all = True
+        self.dirty = True
 
         border_padding = 40
         button_padding = 10
@@ -94,11 +112,26 @@ class Root(ClickableSurface):
     def get_size(self):
         return self.surface.get_size()
 
-    def update(self):
-        self.surface.fill(self.bg)
+    def check(self):
         for child in self.children:
-            child.blit_on(self.surface)
+            child.surface.check()
 
+    def update(self):
+        if self.redraw_all:
+            with profiler.scope("root: fill"):
+                self.surface.fill(self.bg)
+            for child in self.children:
+                child.blit_on(self.surface)
+            self.damage = [self.surface.get_rect()]
+            self.redraw_all = False
+        else:
+            # children never overlap, so each one only covers itself
+            self.damage = []
+            for child in self.children:
+                if child.is_dirty():
+                    child.blit_on(self.surface)
+                    self.damage.append(child.get_rect())
+        self.dirty = False
         return self.surface
 
 
@@ -134,6 +167,7 @@ class EventEmitterButton(ClickableSurface):
         blit_x = (sw - tw) / 2
         blit_y = (sh - th) / 2
         self.surface.blit(self.text_surface, (blit_x, blit_y))
+        self.invalidate()
 
     def get_size(self):
         return self.surface.get_size()
@@ -149,22 +183,58 @@ if __name__ == "__main__":
     screen = pg.display.set_mode((1600, 900))
 
     screen_size = (screen.get_width(), screen.get_height())
-    root = Root(screen_size, InstructionBuilderModel())
+    model = InstructionBuilderModel()
+    root = Root(screen_size, model)
+
+    # F3 shows how long drawing takes, see profiling.py
+    profiler.open_csv_from_environment()
+    overlay_font = pg.font.Font(pg.font.get_default_font(), 18)
+    overlay_rect = pg.Rect(0, 0, 0, 0)
 
+    clock = pg.time.Clock()
     done = False
     while not done:
-        mouse_pos = pg.mouse.get_pos()
-        for ev in pg.event.get():
+        root.check()
+        if root.dirty:
+            surface = root.update()
+            with profiler.scope("display"):
+                damage = list(root.damage)
+                for rect in damage:
+                    screen.blit(surface, rect, rect)
+                if profiler.overlay:
+                    # put back what the last one covered
+                    screen.blit(surface, overlay_rect, overlay_rect)
+                    damage.append(overlay_rect)
+                    overlay_rect = profiler.draw_overlay(
+                        screen, overlay_font, (50, 110))
+                    damage.append(overlay_rect)
+                pg.display.update(damage)
+            profiler.end_frame()
+            clock.tick(FRAME_CAP)
+
+        # sleep until there is input, or it is time to check again
+        events = [pg.event.wait(IDLE_TIMEOUT)] + pg.event.get()
+        for ev in events:
             if ev.type == pg.QUIT:
                 done = True
             if ev.type == pg.WINDOWRESIZED:
                 root.resize((ev.x, ev.y))
             if ev.type == pg.MOUSEBUTTONUP:
-                root.on_raise(mouse_pos, ev.button)
+                root.on_raise(ev.pos, ev.button)
             if ev.type == pg.MOUSEBUTTONDOWN:
-                root.on_click(mouse_pos, ev.button)
+                root.on_click(ev.pos, ev.button)
             if ev.type == pg.MOUSEMOTION:
-                root.on_move(mouse_pos)
-
-        screen.blit(root.update(), (0, 0))
-        pg.display.update()
+                root.on_move(ev.pos)
+            if ev.type == pg.KEYDOWN and ev.key == pg.K_F3:
+                profiler.toggle_overlay()
+                root.redraw_all = True
+                root.invalidate()
+            if ev.type == pg.KEYDOWN and ev.mod & pg.KMOD_CTRL:
+                if ev.key == pg.K_z and ev.mod & pg.KMOD_SHIFT:
+                    model.receive(message.Redo())
+                elif ev.key == pg.K_z:
+                    model.receive(message.Undo())
+                elif ev.key == pg.K_y:
+                    model.receive(message.Redo())
+
+    profiler.close_csv()
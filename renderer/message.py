@@ -21,9 +21,32 @@ class BladeOff:
 
 
 class UpdatePoint:
-    def __init__(self, index, pos):
+    # instruction defaults to the last one. Moves with the same drag, not
+    # None, are undone together as one edit.
+    def __init__(self, index, pos, instruction=None, drag=None):
         self.index = index
         self.pos = pos
+        self.instruction = instruction
+        self.drag = drag
+
+
+class AppendPolyline:
+    # points fitted with as few lines and curves as keep them within
+    # tolerance meters, see fitting.py
+    def __init__(self, points, tolerance=0.05, corner_angle=60.0):
+        self.points = points
+        self.tolerance = tolerance
+        self.corner_angle = corner_angle
+
+
+class PlanCoverage:
+    # back and forth passes mowing the boundary polygon around the keep
+    # out polygons, see planner.py
+    def __init__(self, boundary, keep_outs=(), overlap=0.1, heading=0.0):
+        self.boundary = boundary
+        self.keep_outs = keep_outs
+        self.overlap = overlap
+        self.heading = heading
 
 
 class BeginSimulation:
@@ -37,3 +60,15 @@ class Export:
 
 class Import:
     pass
+
+
+class OptimizeOrder:
+    pass
+
+
+class Undo:
+    pass
+
+
+class Redo:
+    pass
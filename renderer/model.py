@@ -1,9 +1,17 @@
 import message
-from instruction import Line, CubicBezier, BladeOn, BladeOff, \
-    to_json_value, from_json_value
+from instruction import Line, CubicBezier, BladeOn, BladeOff
+from estimate import Estimator
+from fitting import fit_polyline
+from history import History
+from optimize import optimize_order
+from planner import plan_coverage
+from plan_io import PlanFormatError, check_finite, read_plan, write_plan
+from simulate import SimulationRun
+from spatial import PointGrid
+from store import InstructionStore, OP_LINE, OP_CURVE
 
-from json import dump, load
 from math import tau
+from sys import stderr
 
 from tkinter.filedialog import askopenfilename, asksaveasfilename
 
@@ -12,9 +20,50 @@ blade_radius = 0.25
 
 class InstructionBuilderModel:
     def __init__(self):
-        self.instructions = []
+        self.instructions = InstructionStore()
+        # bumped whenever an instruction other than the last one may have
+        # changed, so views can cache everything before the selected one
+        self.revision = 0
+        # bumped on every message, views redraw when it changes
+        self.version = 0
+        # instructions UpdatePoint has moved since revision last changed,
+        # in order, so views can redraw just around them
+        self.moved = []
+        # the draggable points of every instruction, keyed by
+        # (instruction index, point index)
+        self.points = PointGrid()
+        self.history = History(self.instructions)
+        # the latest simulator run, see simulate.py
+        self.simulation = None
+        self.estimator = Estimator(self.sim_params())
 
     def receive(self, m):
+        applied = None
+        if isinstance(m, message.Undo):
+            self.reindex_changed(self.history.undo(self.apply))
+        elif isinstance(m, message.Redo):
+            self.reindex_changed(self.history.redo(self.apply))
+        elif isinstance(m, message.BeginSimulation):
+            self.begin_simulation()
+        else:
+            applied = self.apply(m)
+            if applied is not None:
+                self.history.record(applied)
+
+        if isinstance(m, (message.Undo, message.Redo)) or applied is not None:
+            # its result is for a plan that no longer exists
+            if self.simulation is not None:
+                self.simulation.cancel()
+                self.simulation = None
+
+        if not isinstance(m, (message.UpdatePoint, message.Export,
+                              message.BeginSimulation)):
+            self.revision += 1
+            self.moved = []
+        self.version += 1
+
+    def apply(self, m):
+        # returns the edit to log for undo, if m changed the plan
         end = self.end_point()
 
         def add(p0, p1):
@@ -22,12 +71,16 @@ class InstructionBuilderModel:
 
         if isinstance(m, message.PopInstruction):
             if len(self.instructions) > 0:
+                self.unindex_instruction(len(self.instructions) - 1)
                 self.instructions.pop()
+                return m
 
         if isinstance(m, message.AddLine):
             dx = -0.5 if end[0] > 0 else 0.5
             dy = -0.5 if end[1] > 0 else 0.5
             self.instructions.append(Line(end, add(end, (dx, dy))))
+            self.index_instruction(len(self.instructions) - 1)
+            return m
 
         if isinstance(m, message.AddCurve):
             dx = -0.25 if end[0] > 0 else 0.25
@@ -36,51 +89,128 @@ class InstructionBuilderModel:
                                                  add(end, (dx, dy)),
                                                  add(end, (dx * 2, -dy)),
                                                  add(end, (dx * 4, 0))))
+            self.index_instruction(len(self.instructions) - 1)
+            return m
 
         if isinstance(m, message.BladeOn):
             self.instructions.append(BladeOn())
+            return m
 
         if isinstance(m, message.BladeOff):
             self.instructions.append(BladeOff())
+            return m
+
+        if isinstance(m, message.AppendPolyline):
+            ops, points = fit_polyline(m.points, m.tolerance,
+                                       m.corner_angle, start=end)
+            if len(ops) == 0:
+                return None
+            first = len(self.instructions)
+            self.instructions.append_arrays(ops, points)
+            for i in range(first, len(self.instructions)):
+                self.index_instruction(i)
+            return m
+
+        if isinstance(m, message.PlanCoverage):
+            try:
+                ops, points = plan_coverage(
+                    m.boundary, m.keep_outs, blade_radius, m.overlap,
+                    m.heading, self.sim_params()['wheel_distance'] / 2,
+                    start=end)
+            except ValueError as e:
+                print(f"can't plan coverage: {e}", file=stderr)
+                return None
+            if len(ops) == 0:
+                return None
+            first = len(self.instructions)
+            self.instructions.append_arrays(ops, points)
+            for i in range(first, len(self.instructions)):
+                self.index_instruction(i)
+            return m
 
         if isinstance(m, message.UpdatePoint):
             length = len(self.instructions)
             if length < 1:
-                return
-            selected = self.instructions[length - 1]
-            if isinstance(selected, Line):
-                if m.index == 0:
-                    selected.start = m.pos
-                if m.index == 1:
-                    selected.end = m.pos
-            if isinstance(selected, CubicBezier):
-                if m.index == 0:
-                    selected.p0 = m.pos
-                if m.index == 1:
-                    selected.p1 = m.pos
-                if m.index == 2:
-                    selected.p2 = m.pos
-                if m.index == 3:
-                    selected.p3 = m.pos
+                return None
+            target = length - 1 if m.instruction is None else m.instruction
+            self.moved += self.update_point(target, m.index, m.pos)
+            return message.UpdatePoint(m.index, m.pos, target, m.drag)
 
         if isinstance(m, message.Export):
             self.export_instructions()
 
         if isinstance(m, message.Import):
-            self.import_instructions()
+            if self.import_instructions():
+                return m
+
+        if isinstance(m, message.OptimizeOrder):
+            result = optimize_order(self.instructions)
+            if result is not None:
+                self.instructions.clear()
+                self.instructions.append_arrays(*result)
+                self.reindex()
+                return m
+
+        return None
+
+    def estimate(self):
+        # what the simulator would make of the plan, see estimate.py
+        return self.estimator.estimate(self.instructions)
+
+    def begin_simulation(self):
+        if self.simulation is not None:
+            self.simulation.cancel()
+        self.simulation = SimulationRun(self.sim_params(), self.instructions)
+
+    def update_point(self, i, index, pos):
+        # returns the instructions that changed
+        store = self.instructions
+        op = store.op(i)
+        old_end = None
+        if (op == OP_LINE and index == 1) or (op == OP_CURVE and index == 3):
+            old_end = tuple(store.points_of(i)[index].tolist())
+        store.set_point(i, index, pos)
+        self.index_instruction(i)
+
+        if old_end is None:
+            return [i]
+        # keep the path connected: the next segment starts where this ends
+        for j in range(i + 1, len(store)):
+            if store.op(j) in (OP_LINE, OP_CURVE):
+                if tuple(store.points_of(j)[0].tolist()) == old_end:
+                    store.set_point(j, 0, pos)
+                    return [i, j]
+                return [i]
+        return [i]
+
+    def index_instruction(self, i):
+        store = self.instructions
+        op = store.op(i)
+        if op == OP_LINE or op == OP_CURVE:
+            for index, point in enumerate(store.points_of(i).tolist()):
+                if index > 0:
+                    self.points.move((i, index), tuple(point))
+
+    def unindex_instruction(self, i):
+        for index in (1, 2, 3):
+            self.points.remove((i, index))
+
+    def reindex_changed(self, changed):
+        for i in changed:
+            self.unindex_instruction(i)
+            if i < len(self.instructions):
+                self.index_instruction(i)
+
+    def reindex(self):
+        self.points.clear()
+        for i in range(len(self.instructions)):
+            self.index_instruction(i)
 
     def end_point(self) -> tuple[int, int]:
-        i = len(self.instructions) - 1
-        while i >= 0:
-            inst = self.instructions[i]
-            if isinstance(inst, Line):
-                return inst.end
-            if isinstance(inst, CubicBezier):
-                return inst.p3
-            i -= 1
-        return (0, 0)
+        return self.instructions.end_point()
 
-    def sim_dict(self):
+    def sim_params(self):
+        # everything the simulator takes but the instructions
         obj = {}
         obj['wheel_distance'] = 0.70
         obj['wheel_radius'] = 0.2
@@ -88,7 +218,11 @@ class InstructionBuilderModel:
         obj['blade_radius'] = blade_radius
         obj['sim_length'] = "Indefinite"
         obj['delta_time'] = {"secs": 0, "nanos": 1000000}
-        obj['instructions'] = [to_json_value(i) for i in self.instructions]
+        return obj
+
+    def sim_dict(self):
+        obj = self.sim_params()
+        obj['instructions'] = self.instructions.json_values()
         return obj
 
     def export_instructions(self):
@@ -96,18 +230,29 @@ class InstructionBuilderModel:
         if not isinstance(result, str):
             return
         filepath = str(result)
-        obj = self.sim_dict()
+        try:
+            # before opening, which would empty the file
+            check_finite(self.instructions)
+        except PlanFormatError as e:
+            print(f"{filepath}: {e}", file=stderr)
+            return
         with open(filepath, "w") as f:
-            dump(obj, f)
+            write_plan(f, self.sim_params(), self.instructions)
 
     def import_instructions(self):
         result = askopenfilename()
         if not isinstance(result, str):
-            return
+            return False
         filepath = str(result)
-        with open(filepath, "r") as f:
-            obj = dict(load(f))
+        try:
+            with open(filepath, "r") as f:
+                _, ops, points = read_plan(f)
+        except ValueError as e:
+            print(f"{filepath}: {e}", file=stderr)
+            return False
 
-        if "instructions" in obj.keys():
-            obj_list = obj["instructions"]
-            self.instructions = [from_json_value(o) for o in obj_list]
+        # load into the same store, its snapshots keep the old plan
+        self.instructions.clear()
+        self.instructions.append_arrays(ops, points)
+        self.reindex()
+        return True
@@ -0,0 +1,343 @@
+import argparse
+import time
+from collections import deque
+from math import hypot
+
+import numpy as np
+
+from plan_io import read_plan, write_plan
+from store import InstructionStore, OP_BLADE_ON, OP_BLADE_OFF, OP_LINE
+
+# nearest endpoints tried as new neighbours of an endpoint
+NEIGHBOURS = 8
+# longest stretch of runs Or-opt moves at once
+OR_OPT_LENGTH = 3
+# smallest change in transit distance counted as an improvement
+EPSILON = 1e-9
+
+
+class BladeRuns:
+    # The cutting in a plan: every stretch of instructions between a
+    # BladeOn and the next BladeOff, with the point the robot enters it at
+    # and the point it leaves it at. Geometry driven with the blade off is
+    # transit, only kept as where the plan ends if it ends with some.
+    def __init__(self, store):
+        self.store = store
+        self.runs = []      # instruction indices of each run
+        entries = []
+        exits = []
+        blade = False
+        transit_last = False
+        for i, op in enumerate(store.ops_view().tolist()):
+            if op == OP_BLADE_ON:
+                if not blade:
+                    self.runs.append([])
+                    # a run that moves nowhere cuts where the robot is
+                    entries.append(store.end_point(i))
+                    exits.append(store.end_point(i))
+                    transit_last = False
+                blade = True
+            elif op == OP_BLADE_OFF:
+                blade = False
+            elif blade:
+                if len(self.runs[-1]) == 0:
+                    entries[-1] = tuple(store.points_of(i)[0].tolist())
+                exits[-1] = tuple(store.points_of(i)[-1].tolist())
+                self.runs[-1].append(i)
+                transit_last = False
+            else:
+                transit_last = True
+
+        self.start = (0.0, 0.0)
+        self.end = store.end_point() if transit_last else None
+        # endpoint 2 * r is where run r starts, 2 * r + 1 where it ends
+        self.points = np.zeros((2 * len(self.runs), 2))
+        self.points[0::2] = entries
+        self.points[1::2] = exits
+
+    def __len__(self):
+        return len(self.runs)
+
+    def original_order(self):
+        return np.arange(len(self.runs)) * 2
+
+    def transit(self, tour):
+        # straight line distance driven with the blade off, tour being the
+        # endpoint each run is entered at in order
+        if len(tour) == 0:
+            return 0.0
+        starts = np.vstack([[self.start], self.points[tour[:-1] ^ 1]])
+        ends = self.points[tour]
+        if self.end is not None:
+            starts = np.vstack([starts, self.points[tour[-1:] ^ 1]])
+            ends = np.vstack([ends, [self.end]])
+        return float(np.hypot(*(ends - starts).T).sum())
+
+    def rebuild(self, tour):
+        # (ops, points) of the plan running the runs in tour order, with
+        # straight transits between them
+        store = self.store
+        ops = []
+        points = []
+        position = self.start
+        for e in tour.tolist():
+            run = self.runs[e >> 1]
+            flipped = e & 1 == 1
+            entry = tuple(self.points[e].tolist())
+            if entry != position:
+                ops.append(OP_LINE)
+                points += [position, entry]
+            ops.append(OP_BLADE_ON)
+            for i in (reversed(run) if flipped else run):
+                ops.append(store.op(i))
+                run_points = store.points_of(i).tolist()
+                points += reversed(run_points) if flipped else run_points
+            ops.append(OP_BLADE_OFF)
+            position = tuple(self.points[e ^ 1].tolist())
+        if self.end is not None and self.end != position:
+            ops.append(OP_LINE)
+            points += [position, self.end]
+        return (np.array(ops, dtype=np.int8),
+                np.array(points, dtype=np.float64).reshape(-1, 2))
+
+
+def nearest_neighbours(points, k):
+    # indices of the k nearest other points of every point
+    k = min(k, len(points) - 1)
+    neighbours = np.zeros((len(points), max(k, 0)), dtype=np.int64)
+    if k <= 0:
+        return neighbours
+    squared = (points * points).sum(axis=1)
+    for first in range(0, len(points), 512):
+        rows = points[first:first + 512]
+        # |p - q|^2 = |p|^2 + |q|^2 - 2 p.q, one matrix product per chunk
+        d = squared[first:first + 512, None] + squared[None, :] \
+            - 2.0 * (rows @ points.T)
+        d[np.arange(len(rows)), np.arange(first, first + len(rows))] = np.inf
+        nearest = np.argpartition(d, k - 1, axis=1)[:, :k]
+        order = np.argsort(np.take_along_axis(d, nearest, axis=1), axis=1)
+        neighbours[first:first + len(rows)] = \
+            np.take_along_axis(nearest, order, axis=1)
+    return neighbours
+
+
+def nearest_neighbour_tour(points, start):
+    # from start, always on to the closest end of a run not cut yet
+    n = len(points) // 2
+    tour = np.zeros(n, dtype=np.int64)
+    done = np.zeros(len(points), dtype=bool)
+    x, y = start
+    for k in range(n):
+        d = (points[:, 0] - x) ** 2 + (points[:, 1] - y) ** 2
+        d[done] = np.inf
+        e = int(np.argmin(d))
+        tour[k] = e
+        done[e] = done[e ^ 1] = True
+        x, y = points[e ^ 1]
+    return tour
+
+
+class Tour:
+    # An order of the runs and which way each is driven, improved in place
+    # by 2-opt and Or-opt moves between nearby endpoints. tour[k] is the
+    # endpoint the k-th run is entered at, it leaves at tour[k] ^ 1. Edge
+    # k is the transit into the k-th run; edge 0 leaves the start and edge
+    # n goes to the end, which costs nothing if the plan has none.
+    def __init__(self, runs, tour, neighbours=NEIGHBOURS):
+        self.n = n = len(runs)
+        # numpy for moving stretches of runs, lists for looking things up
+        self.tour_array = np.array(tour, dtype=np.int64)
+        self.pos_array = np.zeros(n, dtype=np.int64)
+        self.pos_array[self.tour_array >> 1] = np.arange(n)
+        self.tour = self.tour_array.tolist()
+        self.pos = self.pos_array.tolist()
+
+        # the start and end are endpoints 2n and 2n + 1
+        self.START = 2 * n
+        self.END = 2 * n + 1
+        points = runs.points.tolist() + [list(runs.start)]
+        if runs.end is not None:
+            points.append(list(runs.end))
+        self.xs = [p[0] for p in points] + [0.0]
+        self.ys = [p[1] for p in points] + [0.0]
+        self.free_end = self.END if runs.end is None else -1
+        self.neighbours = nearest_neighbours(
+                np.array(points), neighbours).tolist()
+
+    def d(self, e, f):
+        if e == self.free_end or f == self.free_end:
+            return 0.0
+        return hypot(self.xs[e] - self.xs[f], self.ys[e] - self.ys[f])
+
+    def left(self, k):
+        # endpoint edge k leaves from
+        return self.START if k == 0 else self.tour[k - 1] ^ 1
+
+    def right(self, k):
+        # endpoint edge k arrives at
+        return self.END if k == self.n else self.tour[k]
+
+    def as_left(self, e):
+        # the edge leaving from endpoint e, if e is left by one
+        if e >= self.START:
+            return 0 if e == self.START else None
+        k = self.pos[e >> 1]
+        return k + 1 if self.tour[k] == e ^ 1 else None
+
+    def as_right(self, e):
+        # the edge arriving at endpoint e, if e is arrived at by one
+        if e >= self.START:
+            return self.n if e == self.END else None
+        k = self.pos[e >> 1]
+        return k if self.tour[k] == e else None
+
+    def set_tour(self, tour):
+        self.tour_array = tour
+        self.pos_array[tour >> 1] = np.arange(self.n)
+        self.tour = tour.tolist()
+        self.pos = self.pos_array.tolist()
+
+    def two_opt(self, e):
+        # Tries to make e the neighbour of one of its nearest endpoints by
+        # driving the runs between them backwards. Returns the endpoints
+        # whose edges changed, or None.
+        for a, as_edge in ((self.as_left(e), self.as_left),
+                           (self.as_right(e), self.as_right)):
+            if a is None:
+                continue
+            for f in self.neighbours[e]:
+                b = as_edge(f)
+                if b is None or b == a:
+                    continue
+                lo, hi = min(a, b), max(a, b)
+                # runs lo..hi-1 backwards: edge lo becomes left(lo) to
+                # left(hi) and edge hi right(lo) to right(hi)
+                ll, rl = self.left(lo), self.right(lo)
+                lh, rh = self.left(hi), self.right(hi)
+                gain = (self.d(ll, rl) + self.d(lh, rh)
+                        - self.d(ll, lh) - self.d(rl, rh))
+                if gain > EPSILON:
+                    tour = self.tour_array.copy()
+                    tour[lo:hi] = tour[lo:hi][::-1] ^ 1
+                    self.set_tour(tour)
+                    return (ll, rl, lh, rh)
+        return None
+
+    def or_opt(self, e):
+        # Tries to move a stretch of up to OR_OPT_LENGTH runs that e is an
+        # end of elsewhere. Returns the endpoints whose edges changed, or
+        # None.
+        if e >= self.START:
+            return None
+        p = self.pos[e >> 1]
+        entered = self.tour[p] == e
+        for length in range(1, OR_OPT_LENGTH + 1):
+            i = p if entered else p - length + 1
+            if 0 <= i and i + length <= self.n:
+                touched = self.move_segment(i, length)
+                if touched is not None:
+                    return touched
+        return None
+
+    def move_segment(self, i, length):
+        # moves runs i..i+length-1, either way round, into the edge next
+        # to their ends' nearest endpoints that saves the most
+        u = self.tour[i]
+        v = self.tour[i + length - 1] ^ 1
+        before, after = self.left(i), self.right(i + length)
+        removed = (self.d(before, u) + self.d(v, after)
+                   - self.d(before, after))
+
+        best, best_k, best_flip = EPSILON, None, False
+        for e in (u, v):
+            for f in self.neighbours[e]:
+                for k, flip in ((self.as_left(f), e == v),
+                                (self.as_right(f), e == u)):
+                    if k is None or i <= k <= i + length:
+                        continue
+                    lk, rk = self.left(k), self.right(k)
+                    first, last = (v, u) if flip else (u, v)
+                    added = (self.d(lk, first) + self.d(last, rk)
+                             - self.d(lk, rk))
+                    if removed - added > best:
+                        best, best_k, best_flip = removed - added, k, flip
+        if best_k is None:
+            return None
+
+        lk, rk = self.left(best_k), self.right(best_k)
+        segment = self.tour_array[i:i + length]
+        if best_flip:
+            segment = segment[::-1] ^ 1
+        rest = np.concatenate([self.tour_array[:i],
+                               self.tour_array[i + length:]])
+        k = best_k if best_k < i else best_k - length
+        self.set_tour(np.concatenate([rest[:k], segment, rest[k:]]))
+        return (before, u, v, after, lk, rk)
+
+    def improve(self):
+        # local search until no move helps, only looking again at
+        # endpoints next to the last changes
+        count = len(self.neighbours)
+        queue = deque(range(count))
+        queued = [True] * count
+        while queue:
+            e = queue.popleft()
+            queued[e] = False
+            touched = self.two_opt(e) or self.or_opt(e)
+            if touched is None:
+                continue
+            for f in touched:
+                if f < count and not queued[f]:
+                    queued[f] = True
+                    queue.append(f)
+
+
+def optimize_order(store):
+    # Reorders and turns around the blade on runs of the plan in store to
+    # shorten the driving between them. Returns (ops, points) of the new
+    # plan for append_arrays, or None if it would not be any shorter.
+    runs = BladeRuns(store)
+    if len(runs) == 0:
+        return None
+    tour = Tour(runs, nearest_neighbour_tour(runs.points, runs.start))
+    tour.improve()
+
+    original = runs.original_order()
+    order = tour.tour_array
+    if runs.transit(order) >= runs.transit(original) - EPSILON:
+        # no better order, but the transits still get straightened
+        order = original
+    ops, points = runs.rebuild(order)
+    if np.array_equal(ops, store.ops_view()) \
+            and np.array_equal(points, store.points_view()):
+        return None
+    return ops, points
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Reorder the blade on runs of a plan to drive less "
+                    "with the blade off")
+    parser.add_argument("plan", help="exported plan JSON")
+    parser.add_argument("output", help="where to write the new plan")
+    args = parser.parse_args()
+
+    with open(args.plan, "r") as f:
+        params, ops, points = read_plan(f)
+    store = InstructionStore()
+    store.append_arrays(ops, points)
+
+    started = time.perf_counter()
+    runs = BladeRuns(store)
+    before = runs.transit(runs.original_order())
+    result = optimize_order(store)
+    seconds = time.perf_counter() - started
+    if result is not None:
+        store = InstructionStore()
+        store.append_arrays(*result)
+    runs = BladeRuns(store)
+    after = runs.transit(runs.original_order())
+    print(f"{len(runs)} runs, transit {before:.2f} m -> {after:.2f} m "
+          f"in {seconds:.2f} s")
+    with open(args.output, "w") as f:
+        write_plan(f, params, store)
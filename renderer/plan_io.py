@@ -0,0 +1,299 @@
+import re
+from json import JSONDecoder, JSONDecodeError, dumps, loads
+from math import isfinite
+from numbers import Real
+
+import numpy as np
+
+from store import POINT_COUNT, OP_BLADE_ON, OP_BLADE_OFF, OP_LINE, \
+    OP_CURVE
+
+# written into every exported plan; plans without it are version 0, which
+# has the same layout
+FORMAT_VERSION = 1
+# everything the simulator takes besides the instructions
+PARAM_NAMES = ("wheel_distance", "wheel_radius", "max_motor_speed",
+               "blade_radius", "sim_length", "delta_time")
+
+POINT_NAMES = {"Line": ("start", "end"),
+               "CubicBezier": ("p0", "p1", "p2", "p3")}
+OPCODES = {"Line": OP_LINE, "CubicBezier": OP_CURVE}
+
+LINE_FORMAT = '{"Line": {"start": [%s, %s], "end": [%s, %s]}}'
+CURVE_FORMAT = ('{"CubicBezier": {"p0": [%s, %s], "p1": [%s, %s], '
+                '"p2": [%s, %s], "p3": [%s, %s]}}')
+
+WHITESPACE = " \t\n\r"
+NUMBER_CHARS = "0123456789.eE+-"
+# a comma that can only come right after a whole instruction
+INSTRUCTION_END = re.compile(r'(?:\}\s*\}|"BladeOn"|"BladeOff")\s*,')
+
+
+class PlanFormatError(ValueError):
+    def __init__(self, message, instruction=None):
+        if instruction is not None:
+            message = f"instruction {instruction}: {message}"
+        super().__init__(message)
+        self.instruction = instruction
+
+
+def check_finite(store):
+    # JSON has no NaN or infinity, raises PlanFormatError naming the first
+    # instruction with such a point
+    points = store.points_view()
+    bad = np.nonzero(~np.isfinite(points).all(axis=1))[0]
+    if len(bad) > 0:
+        owner = np.searchsorted(store.offsets_view(), bad[0], "right") - 1
+        raise PlanFormatError(
+            f"can't write point {points[bad[0]].tolist()}", int(owner))
+
+
+def write_plan(f, params, store, chunk_size=4096):
+    # Writes params and then the instructions of the store chunk by chunk,
+    # in the layout json.dump would give sim_dict. Nothing is written if
+    # check_finite fails.
+    check_finite(store)
+    f.write("{")
+    for key, value in params.items():
+        f.write(f"{dumps(key)}: {dumps(value)}, ")
+    f.write(f"\"format_version\": {FORMAT_VERSION}, \"instructions\": [")
+
+    ops = store.ops_view()
+    offsets = store.offsets_view()
+    points = store.points_view()
+    for start in range(0, len(ops), chunk_size):
+        if start > 0:
+            f.write(", ")
+        f.write(", ".join(format_instructions(
+            ops[start:start + chunk_size],
+            offsets[start:start + chunk_size], points)))
+    f.write("]}")
+
+
+def format_instructions(ops, offsets, points):
+    pieces = np.empty(len(ops), dtype=object)
+    pieces[ops == OP_BLADE_ON] = '"BladeOn"'
+    pieces[ops == OP_BLADE_OFF] = '"BladeOff"'
+    for op, template, count in ((OP_LINE, LINE_FORMAT, 2),
+                                (OP_CURVE, CURVE_FORMAT, 4)):
+        where = np.nonzero(ops == op)[0]
+        if len(where) == 0:
+            continue
+        index = offsets[where][:, None] + np.arange(count)
+        # repr matches what json.dumps writes for a float
+        coords = iter(map(repr, points[index].ravel().tolist()))
+        pieces[where] = list(map(template.__mod__,
+                                 zip(*[coords] * (2 * count))))
+    return pieces.tolist()
+
+
+class PlanReader:
+    # Pulls one JSON value at a time out of a text stream, keeping only
+    # what has not been consumed yet in memory.
+    def __init__(self, f, chunk_size=1 << 18):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = JSONDecoder()
+
+    def fill(self):
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) \
+                    and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                raise PlanFormatError("unexpected end of file")
+            self.fill()
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise PlanFormatError(
+                f"expected {char!r}, got {self.buffer[self.pos]!r}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except JSONDecodeError as e:
+                if self.eof:
+                    raise PlanFormatError(str(e)) from None
+                self.fill()
+                continue
+            # a number cut off by the end of the buffer may go on
+            if self.eof or (end < len(self.buffer)
+                            and self.buffer[end] not in NUMBER_CHARS):
+                self.pos = end
+                return value
+            self.fill()
+
+    def entries(self):
+        # keys of the object at the current position, the caller must
+        # consume each value before asking for the next key
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                raise PlanFormatError(f"expected a key, got {key!r}")
+            self.expect(":")
+            yield key
+            if self.peek() == "}":
+                self.pos += 1
+                return
+            self.expect(",")
+
+    def batches(self):
+        # values of the array at the current position, in lists. Runs of
+        # whole instructions are parsed with one loads call, anything else
+        # one value at a time.
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            batch = self.batch()
+            if batch is not None:
+                yield batch
+                continue
+            yield [self.value()]
+            if self.peek() == "]":
+                self.pos += 1
+                return
+            self.expect(",")
+
+    def batch(self):
+        # the values before the last comma in the buffer known to follow a
+        # whole instruction, or None
+        cut = None
+        start = max(self.pos, len(self.buffer) - 4096)
+        for cut in INSTRUCTION_END.finditer(self.buffer, start):
+            pass
+        if cut is None:
+            return None
+        try:
+            batch = loads("[" + self.buffer[self.pos:cut.end() - 1] + "]")
+        except JSONDecodeError:
+            # not a run of array values after all, let value() say why
+            return None
+        self.pos = cut.end()
+        return batch
+
+
+def read_point(obj, index):
+    if not (isinstance(obj, list) and len(obj) == 2
+            and all(isinstance(c, Real) and not isinstance(c, bool)
+                    and isfinite(c) for c in obj)):
+        raise PlanFormatError(f"expected a point [x, y], got {obj!r}", index)
+    return obj
+
+
+def read_instruction(obj, index, ops, coords):
+    # validates one instruction and appends it to ops and coords
+    if obj == "BladeOn":
+        ops.append(OP_BLADE_ON)
+        return
+    if obj == "BladeOff":
+        ops.append(OP_BLADE_OFF)
+        return
+    if not (isinstance(obj, dict) and len(obj) == 1):
+        raise PlanFormatError(f"unknown instruction {obj!r}", index)
+    name, fields = next(iter(obj.items()))
+    names = POINT_NAMES.get(name)
+    if names is None:
+        raise PlanFormatError(f"unknown instruction {name!r}", index)
+    if not isinstance(fields, dict):
+        raise PlanFormatError(f"{name} needs fields {names}", index)
+    for field in names:
+        if field not in fields:
+            raise PlanFormatError(f"{name} is missing {field!r}", index)
+        coords.extend(read_point(fields[field], index))
+    ops.append(OPCODES[name])
+
+
+def read_batch(objs, first, ops):
+    # Appends the opcodes of instructions first, first + 1, ... to ops and
+    # returns their points. Well formed batches take the quick path,
+    # read_instruction finds what is wrong with the rest.
+    coords = []
+    try:
+        for obj in objs:
+            if obj == "BladeOn":
+                ops.append(OP_BLADE_ON)
+            elif obj == "BladeOff":
+                ops.append(OP_BLADE_OFF)
+            else:
+                (name, fields), = obj.items()
+                for field in POINT_NAMES[name]:
+                    x, y = fields[field]
+                    coords.append(x)
+                    coords.append(y)
+                ops.append(OPCODES[name])
+        # anything but plain numbers, bools and nested lists included, is
+        # left to read_point
+        if set(map(type, coords)) <= {float, int}:
+            points = np.array(coords, dtype=np.float64).reshape(-1, 2)
+            if np.isfinite(points).all():
+                return points
+    except (AttributeError, KeyError, TypeError, ValueError):
+        pass
+
+    del ops[first:]
+    coords = []
+    for k, obj in enumerate(objs):
+        read_instruction(obj, first + k, ops, coords)
+    return np.array(coords, dtype=np.float64).reshape(-1, 2)
+
+
+def read_plan(f):
+    # Returns (params, ops, points): everything but the instructions, the
+    # opcode of every instruction and their points in order, ready for
+    # InstructionStore.append_arrays.
+    reader = PlanReader(f)
+    params = {}
+    ops = []
+    points = []
+    found = False
+    for key in reader.entries():
+        if key == "format_version":
+            version = reader.value()
+            # bool is an int too
+            if not isinstance(version, int) or isinstance(version, bool) \
+                    or version > FORMAT_VERSION:
+                raise PlanFormatError(
+                    f"unsupported format version {version!r}, "
+                    f"this editor reads up to {FORMAT_VERSION}")
+        elif key == "instructions":
+            found = True
+            for batch in reader.batches():
+                points.append(read_batch(batch, len(ops), ops))
+        else:
+            params[key] = reader.value()
+
+    if not found:
+        raise PlanFormatError("no instructions in plan")
+    missing = [name for name in PARAM_NAMES if name not in params]
+    if missing:
+        raise PlanFormatError(f"plan has no {', '.join(missing)}")
+    points = np.concatenate(points) if len(points) > 0 \
+        else np.zeros((0, 2), dtype=np.float64)
+    ops = np.array(ops, dtype=np.int8)
+    if POINT_COUNT[ops].sum() != len(points):
+        raise PlanFormatError(f"{len(ops)} instructions take "
+                              f"{POINT_COUNT[ops].sum()} points, "
+                              f"got {len(points)}")
+    return params, ops, points
@@ -0,0 +1,411 @@
+import argparse
+import time
+from math import atan2, ceil, cos, pi, radians, sin, sqrt, tan
+
+import numpy as np
+
+from store import OP_BLADE_ON, OP_BLADE_OFF, OP_LINE, OP_CURVE
+
+# scanlines whose crossings with the polygons are found at once
+CHUNK_LINES = 64
+# the most of a circle one cubic stands in for, which keeps its radius of
+# curvature within 0.1% of the circle's
+ARC_PIECE = pi / 4
+
+
+def polygon_edges(polygon):
+    # (x0, y0, x1, y1) of every edge, closing the polygon
+    p = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+    q = np.roll(p, -1, axis=0)
+    return np.column_stack([p, q])
+
+
+def crossings(edges, ys):
+    # for every y, the sorted xs where the horizontal line at y crosses
+    # the edges. An edge counts from its lower end up to but not at its
+    # upper end, so a line through a vertex crosses once, not twice.
+    result = []
+    x0, y0, x1, y1 = edges.T
+    for first in range(0, len(ys), CHUNK_LINES):
+        y = ys[first:first + CHUNK_LINES, None]
+        crossing = (y0 <= y) != (y1 <= y)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+        for row, mask in zip(x, crossing):
+            result.append(np.sort(row[mask]).tolist())
+    return result
+
+
+def inside(xs):
+    # the intervals between pairs of crossings, inside the polygon
+    return [(xs[i], xs[i + 1]) for i in range(0, len(xs) - 1, 2)]
+
+
+def intersect(a, b):
+    result = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        lo = max(a[i][0], b[j][0])
+        hi = min(a[i][1], b[j][1])
+        if lo < hi:
+            result.append((lo, hi))
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+
+def subtract(a, b):
+    # a without b, b sorted and not overlapping itself
+    result = []
+    for lo, hi in a:
+        for b_lo, b_hi in b:
+            if b_hi <= lo or b_lo >= hi:
+                continue
+            if b_lo > lo:
+                result.append((lo, b_lo))
+            lo = max(lo, b_hi)
+        if lo < hi:
+            result.append((lo, hi))
+    return result
+
+
+def union(intervals):
+    result = []
+    for lo, hi in sorted(intervals):
+        if result and lo <= result[-1][1]:
+            result[-1] = (result[-1][0], max(result[-1][1], hi))
+        else:
+            result.append((lo, hi))
+    return result
+
+
+def passes(boundary, keep_outs, ys, reach, margin, room=0.0):
+    # For every y, the stretches of the line at y the robot can drive
+    # along cutting: inside the boundary and outside every keep out over
+    # reach either side of the line, and margin back from their ends.
+    # Their ends are also room from every edge, where the polygons can be
+    # offset by that much, else room back along the line.
+    heights = np.concatenate([ys - reach, ys, ys + reach])
+    n = len(ys)
+    allowed = [inside(xs) for xs in crossings(polygon_edges(boundary),
+                                              heights)]
+    blocked = [[] for _ in range(3 * n)]
+    for keep_out in keep_outs:
+        edges = polygon_edges(keep_out)
+        for i, xs in enumerate(crossings(edges, heights)):
+            blocked[i] += inside(xs)
+
+    # where the ends may be
+    shrunk = offset_polygon(boundary, room) if room > margin else None
+    grown = [offset_polygon(k, -room) for k in keep_outs] \
+        if shrunk is not None else []
+    if shrunk is not None and all(g is not None for g in grown):
+        ends = [inside(xs) for xs in crossings(polygon_edges(shrunk), ys)]
+        for g in grown:
+            for i, xs in enumerate(crossings(polygon_edges(g), ys)):
+                ends[i] = subtract(ends[i], inside(xs))
+    else:
+        ends = None
+        margin = max(margin, room)
+
+    result = []
+    for i in range(n):
+        free = allowed[i]
+        for k in (i + n, i + 2 * n):
+            free = intersect(free, allowed[k])
+        free = subtract(free, union(blocked[i] + blocked[i + n]
+                                    + blocked[i + 2 * n]))
+        free = [(lo + margin, hi - margin) for lo, hi in free
+                if hi - lo > 2 * margin]
+        if ends is not None:
+            free = intersect(free, ends[i])
+        result.append(free)
+    return result
+
+
+def cells(lines):
+    # Splits the passes into cells that can be mowed back and forth in
+    # one go: each pass in a cell overlaps the one before it and nothing
+    # else on their lines. Returns lists of (line, (lo, hi)).
+    result = []
+    open_cells = []     # (cell, pass on the line before)
+    for k, line in enumerate(lines):
+        next_open = []
+        for interval in line:
+            touching = [c for c in open_cells if overlaps(c[1], interval)]
+            cell = None
+            if len(touching) == 1:
+                cell, previous = touching[0]
+                if sum(overlaps(previous, other) for other in line) != 1:
+                    cell = None
+            if cell is None:
+                cell = []
+                result.append(cell)
+            cell.append((k, interval))
+            next_open.append((cell, interval))
+        open_cells = next_open
+    return result
+
+
+def overlaps(a, b):
+    return a[0] < b[1] and b[0] < a[1]
+
+
+def rotate(points, angle):
+    c, s = cos(angle), sin(angle)
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return points @ np.array([[c, s], [-s, c]])
+
+
+def signed_area(polygon):
+    x, y = polygon.T
+    return (x @ np.roll(y, -1) - y @ np.roll(x, -1)) / 2.0
+
+
+def offset_polygon(polygon, distance):
+    # The polygon with its edges moved distance inwards, outwards if
+    # negative, and mitred at the corners. None if that leaves no polygon
+    # or one that crosses itself.
+    p = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+    p = p[(np.roll(p, -1, axis=0) != p).any(axis=1)]
+    if len(p) < 3 or signed_area(p) == 0:
+        return None
+    if signed_area(p) < 0:
+        # counter clockwise, so inwards is to the left of every edge
+        p = p[::-1]
+    edges = np.roll(p, -1, axis=0) - p
+    normals = edges[:, ::-1] * [-1.0, 1.0] \
+        / np.hypot(edges[:, 0], edges[:, 1])[:, None]
+    before = np.roll(normals, 1, axis=0)
+    miter = 1.0 + (before * normals).sum(axis=1)
+    if (miter < 1e-9).any():
+        # an edge doubling back on the one before
+        return None
+    q = p + distance * (before + normals) / miter[:, None]
+    if signed_area(q) <= 0 or cross(q, q):
+        return None
+    return q
+
+
+def cross(a, b):
+    # whether an edge of polygon a crosses one of polygon b. Edges only
+    # touching, like neighbours of the same polygon, do not count.
+    a0, a1 = a[:, None], np.roll(a, -1, axis=0)[:, None]
+    b0, b1 = b[None], np.roll(b, -1, axis=0)[None]
+
+    def side(p, q, r):
+        return np.sign((q[..., 0] - p[..., 0]) * (r[..., 1] - p[..., 1])
+                       - (q[..., 1] - p[..., 1]) * (r[..., 0] - p[..., 0]))
+    return bool(((side(a0, a1, b0) * side(a0, a1, b1) < 0)
+                 & (side(b0, b1, a0) * side(b0, b1, a1) < 0)).any())
+
+
+def contains(polygon, point):
+    xs = crossings(polygon_edges(polygon), np.array([point[1]]))[0]
+    return sum(x < point[0] for x in xs) % 2 == 1
+
+
+def headland(boundary, keep_outs, blade_radius, spacing, rings):
+    # Rings driven round the inside of the boundary and the outside of the
+    # keep outs, the first a blade radius from the edge and the rest
+    # spacing further out into the field, cutting what the ends of the
+    # passes leave. A ring that would take the blade into a keep out or
+    # out of the field, or that crosses itself, is left out.
+    grown = [offset_polygon(k, -blade_radius) for k in keep_outs]
+    grown = [g if g is not None else np.asarray(k, dtype=np.float64)
+             for g, k in zip(grown, keep_outs)]
+    field = offset_polygon(boundary, blade_radius)
+    result = []
+    for n in range(rings):
+        distance = blade_radius + n * spacing
+        ring = offset_polygon(boundary, distance)
+        if ring is not None and not any(cross(ring, g) for g in grown):
+            result.append(ring)
+        for k, keep_out in enumerate(keep_outs):
+            ring = offset_polygon(keep_out, -distance)
+            if ring is None or field is None or cross(ring, field) \
+                    or not contains(field, ring[0]):
+                continue
+            if not any(cross(ring, g) for j, g in enumerate(grown)
+                       if j != k):
+                result.append(ring)
+    return result
+
+
+def arc(center, radius, start, sweep):
+    # cubics along the circle from angle start through sweep radians,
+    # clockwise if negative, each standing in for at most ARC_PIECE
+    if sweep == 0:
+        return []
+    pieces = max(1, ceil(abs(sweep) / ARC_PIECE - 1e-9))
+    angles = start + sweep * np.arange(pieces + 1) / pieces
+    ends = np.asarray(center) + radius * np.column_stack(
+        [np.cos(angles), np.sin(angles)])
+    tangents = np.column_stack([-np.sin(angles), np.cos(angles)])
+    k = 4.0 / 3.0 * tan(sweep / pieces / 4.0) * radius
+    return [[ends[i], ends[i] + k * tangents[i],
+             ends[i + 1] - k * tangents[i + 1], ends[i + 1]]
+            for i in range(pieces)]
+
+
+def turn_around(spacing, radius):
+    # Cubics from the origin heading along x, round to (0, spacing)
+    # heading back, nowhere tighter than radius, to within the 0.1% of
+    # ARC_PIECE. A half circle if that is wide enough, else a bulb: a
+    # little way round away from the next pass, most of a circle towards
+    # it and a little way back. Returns them and the room they need: how
+    # far any of their control points, and so the curves, get from either
+    # end.
+    if radius <= spacing / 2.0:
+        r = spacing / 2.0
+        curves = arc((0.0, r), r, -pi / 2, pi)
+    else:
+        r = radius
+        h = sqrt(4.0 * r * r - (spacing / 2.0 + r) ** 2)
+        phi = atan2(spacing / 2.0 + r, h)
+        curves = arc((0.0, -r), r, pi / 2, phi - pi / 2) \
+            + arc((h, spacing / 2.0), r, phi - pi, 2 * pi - 2 * phi) \
+            + arc((0.0, spacing + r), r, -phi, phi - pi / 2)
+    curves = np.array(curves)
+    # joined exactly, they were worked out from different centers
+    curves[1:, 0] = curves[:-1, 3]
+    curves[0, 0] = (0.0, 0.0)
+    curves[-1, 3] = (0.0, spacing)
+    points = curves.reshape(-1, 2)
+    # the same from both ends, the turn is symmetric
+    return curves, float(np.hypot(points[:, 0], points[:, 1]).max())
+
+
+def plan_coverage(boundary, keep_outs=(), blade_radius=0.25, overlap=0.1,
+                  heading=0.0, turn_radius=0.0, start=(0.0, 0.0)):
+    # Back and forth passes covering the boundary polygon but not the
+    # keep out polygons, heading degrees from the x axis and overlapping
+    # by that fraction of the blade's width. Passes are cut with the
+    # blade on; between them the robot turns around with it off, see
+    # turn_around, nowhere tighter than turn_radius. Passes end far
+    # enough from the edges for the turns to stay in the field, and
+    # headland rings round the edges, cut first, mow what that leaves.
+    # Coverage still has gaps: in corners sharper than the rings can
+    # follow, where a ring is left out, and along edges the passes cannot
+    # get close to. Each ring and cell of passes is reached by a straight
+    # Line from the end of the one before, the first from start. Returns
+    # (ops, points) for InstructionStore.append_arrays.
+    spacing = 2.0 * blade_radius * (1.0 - overlap)
+    if spacing <= 0:
+        raise ValueError("overlap leaves no distance between passes")
+    angle = radians(heading)
+    boundary = rotate(boundary, -angle)
+    keep_outs = [rotate(k, -angle) for k in keep_outs]
+    turn, room = turn_around(spacing, turn_radius)
+
+    low, high = boundary[:, 1].min(), boundary[:, 1].max()
+    ys = np.arange(low + blade_radius, high - blade_radius + 1e-9, spacing)
+    lines = passes(boundary, keep_outs, ys, blade_radius, blade_radius,
+                   room)
+
+    ops = []
+    points = []
+    position = tuple(rotate(start, -angle)[0].tolist())
+
+    # enough rings to cut up to the ends of the passes, the blade's
+    # round ends leave scallops between them
+    rings = headland(boundary, keep_outs, blade_radius, spacing,
+                     1 + max(0, ceil((room - 2.0 * blade_radius)
+                                     / spacing - 1e-9)))
+    while rings:
+        # round the nearest ring from its nearest corner
+        distances = [((ring - position) ** 2).sum(axis=1) for ring in rings]
+        r = min(range(len(rings)), key=lambda i: distances[i].min())
+        ring = rings.pop(r)
+        ring = [tuple(p) for p in np.roll(ring, -int(np.argmin(
+            distances[r])), axis=0).tolist()]
+        if ring[0] != position:
+            ops.append(OP_LINE)
+            points += [position, ring[0]]
+        ops.append(OP_BLADE_ON)
+        for p0, p1 in zip(ring, ring[1:] + ring[:1]):
+            ops.append(OP_LINE)
+            points += [p0, p1]
+        ops.append(OP_BLADE_OFF)
+        position = ring[0]
+
+    remaining = cells(lines)
+    while remaining:
+        # on to the nearest corner of a cell not cut yet
+        best = None
+        for c, cell in enumerate(remaining):
+            for order in (cell, cell[::-1]):
+                k, (lo, hi) = order[0]
+                for x, forward in ((lo, True), (hi, False)):
+                    d = (x - position[0]) ** 2 + (ys[k] - position[1]) ** 2
+                    if best is None or d < best[0]:
+                        best = (d, c, order, forward)
+        _, c, order, forward = best
+        del remaining[c]
+
+        for n, (k, (lo, hi)) in enumerate(order):
+            y = float(ys[k])
+            entry, leave = ((lo, y), (hi, y)) if forward \
+                else ((hi, y), (lo, y))
+            if n == 0:
+                if entry != position:
+                    ops.append(OP_LINE)
+                    points += [position, entry]
+            else:
+                # round from past whichever of the two ends further out,
+                # the last pass having gone the other way
+                out = -1.0 if forward else 1.0
+                edge = min(position[0], entry[0]) if forward \
+                    else max(position[0], entry[0])
+                up = 1.0 if y > position[1] else -1.0
+                if position[0] != edge:
+                    ops.append(OP_LINE)
+                    points += [position, (edge, position[1])]
+                curves = turn * [out, up] + [edge, position[1]]
+                curves[0, 0] = (edge, position[1])
+                curves[-1, 3] = (edge, y)
+                ops += [OP_CURVE] * len(curves)
+                points += [tuple(p) for p in curves.reshape(-1, 2).tolist()]
+                if entry[0] != edge:
+                    ops.append(OP_LINE)
+                    points += [(edge, y), entry]
+            ops += [OP_BLADE_ON, OP_LINE, OP_BLADE_OFF]
+            points += [entry, leave]
+            position = leave
+            forward = not forward
+
+    points = rotate(points, angle) if len(points) > 0 \
+        else np.zeros((0, 2))
+    return np.array(ops, dtype=np.int8), points
+
+
+if __name__ == "__main__":
+    # model imports this module
+    from fitting import load_polylines
+    from model import InstructionBuilderModel
+    from plan_io import write_plan
+    import message
+
+    parser = argparse.ArgumentParser(
+        description="Plan back and forth passes mowing a field")
+    parser.add_argument("polygons",
+                        help="JSON or x,y points of the boundary, or a "
+                             "JSON list of it and the keep out polygons")
+    parser.add_argument("output", help="where to write the plan")
+    parser.add_argument("--overlap", type=float, default=0.1,
+                        help="fraction of the blade's width")
+    parser.add_argument("--heading", type=float, default=0.0,
+                        help="degrees from the x axis")
+    args = parser.parse_args()
+
+    polygons = load_polylines(args.polygons)
+    model = InstructionBuilderModel()
+    started = time.perf_counter()
+    model.receive(message.PlanCoverage(polygons[0], polygons[1:],
+                                       args.overlap, args.heading))
+    seconds = time.perf_counter() - started
+    print(f"{len(model.instructions)} instructions in {seconds:.2f} s")
+    with open(args.output, "w") as f:
+        write_plan(f, model.sim_params(), model.instructions)
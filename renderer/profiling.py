@@ -0,0 +1,133 @@
+import csv
+import os
+from collections import deque
+from time import perf_counter
+
+import numpy as np
+import pygame as pg
+
+from textcache import text_cache
+
+# frames the percentiles are over
+WINDOW = 120
+
+
+class Scope:
+    # with profiler.scope(name): adds the time spent inside to name's
+    # total for the frame. Not reentrant for the same name.
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        frame = self.profiler.frame
+        frame[self.name] = frame.get(self.name, 0.0) \
+            + perf_counter() - self.start
+        return False
+
+
+class NoScope:
+    # what scope hands out while nothing is being measured
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_SCOPE = NoScope()
+
+
+class Profiler:
+    # Time spent per frame in named phases of drawing, the last WINDOW
+    # frames of each kept for the overlay's percentiles and every frame
+    # optionally written to a CSV file. While neither is on, scopes do
+    # nothing and end_frame returns straight away.
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.overlay = False
+        self.enabled = False    # overlay on or CSV open
+        self.frame = {}         # phase -> seconds so far this frame
+        self.history = {}       # phase -> seconds of the last frames
+        self.frames = 0
+        self.scopes = {}
+        self.csv_file = None
+        self.csv = None
+
+    def scope(self, name):
+        if not self.enabled:
+            return NO_SCOPE
+        scope = self.scopes.get(name)
+        if scope is None:
+            scope = self.scopes[name] = Scope(self, name)
+        return scope
+
+    def end_frame(self):
+        if not self.enabled or len(self.frame) == 0:
+            return
+        for name, seconds in self.frame.items():
+            history = self.history.get(name)
+            if history is None:
+                history = self.history[name] = deque(maxlen=self.window)
+            history.append(seconds)
+            if self.csv is not None:
+                self.csv.writerow([self.frames, name,
+                                   f"{seconds * 1000:.4f}"])
+        self.frame = {}
+        self.frames += 1
+
+    def toggle_overlay(self):
+        self.overlay = not self.overlay
+        if not self.overlay:
+            self.history.clear()
+        self.enabled = self.overlay or self.csv is not None
+
+    def open_csv(self, path):
+        # one row per phase and frame: frame, phase, milliseconds
+        self.close_csv()
+        self.csv_file = open(path, "w", newline="")
+        self.csv = csv.writer(self.csv_file)
+        self.csv.writerow(["frame", "phase", "ms"])
+        self.enabled = True
+
+    def open_csv_from_environment(self):
+        # $ISP_PROFILE_CSV, if set, is where to write the timings
+        path = os.environ.get("ISP_PROFILE_CSV")
+        if path:
+            self.open_csv(path)
+
+    def close_csv(self):
+        if self.csv_file is not None:
+            self.csv_file.close()
+        self.csv_file = None
+        self.csv = None
+        self.enabled = self.overlay
+
+    def lines(self):
+        # p50 and p95 of every phase in milliseconds, slowest first
+        rows = []
+        for name, history in self.history.items():
+            p50, p95 = np.percentile(np.array(history) * 1000, [50, 95])
+            rows.append((p95, f"{name}: {p50:.2f} / {p95:.2f} ms"))
+        rows.sort(reverse=True)
+        return ["p50 / p95"] + [line for _, line in rows]
+
+    def draw_overlay(self, surface, font, pos, padding=5) -> pg.Rect:
+        # the lines in a column at pos, returns the area drawn over
+        x, y = pos
+        area = pg.Rect(x, y, 0, 0)
+        for line in self.lines():
+            r = text_cache.blit(surface, font, line, (x, y), (0, 0, 0),
+                                (255, 255, 255), runs=True)
+            area.union_ip(r)
+            y += r.height + padding
+        return area
+
+
+# shared by everything drawing in one process
+profiler = Profiler()
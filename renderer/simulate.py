@@ -0,0 +1,155 @@
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from array import array
+
+import numpy as np
+
+from plan_io import write_plan
+from store import InstructionStore
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SIMULATION_DIR = os.path.join(HERE, "..", "simulation")
+# how long a simulator whose trace didn't parse gets to exit on its own,
+# after which it is likely blocked writing the rest and is killed
+EXIT_WAIT = 1.0
+
+sys.path.append(os.path.join(HERE, "debug-visualizer"))
+from sim_trace import TraceReader, Duration  # noqa: E402
+
+
+def simulator_command():
+    # $ISP_SIM_BINARY, then a built binary, then building one with cargo
+    binary = os.environ.get("ISP_SIM_BINARY")
+    if binary:
+        return [binary]
+    for profile in ("release", "debug"):
+        path = os.path.join(SIMULATION_DIR, "target", profile, "isp-sim")
+        if os.path.isfile(path):
+            return [path]
+    return ["cargo", "run", "--release", "--quiet", "--manifest-path",
+            os.path.join(SIMULATION_DIR, "Cargo.toml"), "--"]
+
+
+def simulator_error(code, errors):
+    # errors is the file the simulator's stderr went to
+    errors.seek(0)
+    lines = errors.read().decode(errors="replace").split("\n")
+    lines = [line for line in lines if line.strip()]
+    return RuntimeError(f"simulator exited with {code}"
+                        + (f": {lines[-1]}" if lines else ""))
+
+
+def run_simulator(params, plan, read, started=None):
+    # Runs the simulator on plan and returns read(reader) for a TraceReader
+    # over its stdout. started(process), if given, is called as soon as the
+    # simulator runs. Raises the simulator's error if it exits with one.
+    with tempfile.TemporaryFile() as errors:
+        process = subprocess.Popen(
+                simulator_command(), stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE, stderr=errors)
+        try:
+            if started is not None:
+                started(process)
+            try:
+                # the simulator reads all of its input before it writes
+                with io.TextIOWrapper(process.stdin) as stdin:
+                    write_plan(stdin, params, plan)
+                result = read(TraceReader(process.stdout,
+                                          chunk_size=1 << 16))
+            except (OSError, ValueError):
+                # if the simulator quit, its exit code says more
+                try:
+                    code = process.wait(timeout=EXIT_WAIT)
+                except subprocess.TimeoutExpired:
+                    code = 0
+                if code != 0:
+                    raise simulator_error(code, errors)
+                raise
+            code = process.wait()
+            if code != 0:
+                raise simulator_error(code, errors)
+            return result
+        finally:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            process.stdout.close()
+
+
+class SimulationRun:
+    # Runs the simulator on a copy of the plan in a background thread. The
+    # trace is parsed off the simulator's stdout as it arrives; the columns
+    # only ever grow and `loaded` is bumped last, so the main thread can
+    # read the first `loaded` states at any time.
+    def __init__(self, params, store):
+        self.robot_x = array('d')
+        self.robot_y = array('d')
+        self.blade_on = array('b')
+        self.loaded = 0
+        self.header = None
+        self.done = False
+        self.error = None
+        self.cancelled = False
+
+        self.process = None
+        self.lock = threading.Lock()
+
+        # the store keeps changing on the main thread
+        plan = InstructionStore()
+        plan.append_arrays(store.ops_view(), store.points_view())
+        self.thread = threading.Thread(target=self.run, args=(params, plan),
+                                       daemon=True)
+        self.thread.start()
+
+    def run(self, params, plan):
+        try:
+            with self.lock:
+                if self.cancelled:
+                    return
+            run_simulator(params, plan, self.read, self.started)
+        except Exception as e:
+            if not self.cancelled:
+                self.error = e
+        finally:
+            self.done = True
+
+    def started(self, process):
+        with self.lock:
+            self.process = process
+            if self.cancelled:
+                process.kill()
+
+    def read(self, reader):
+        for _, _, state in reader.states(debug=False):
+            if self.cancelled:
+                return
+            self.robot_x.append(state['robot_x'])
+            self.robot_y.append(state['robot_y'])
+            self.blade_on.append(state['blade_on'])
+            self.loaded += 1
+        self.header = reader.header
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            if self.process is not None and self.process.poll() is None:
+                self.process.kill()
+
+    def finished(self):
+        return self.done and self.error is None and not self.cancelled
+
+    def delta_time(self):
+        return Duration(self.header["delta_time"]).seconds()
+
+    def positions(self):
+        # (loaded, 2) array of robot positions and the blade state of each.
+        # Only once done: the columns can't grow while numpy views them.
+        n = self.loaded
+        xs = np.frombuffer(self.robot_x, dtype=np.float64, count=n)
+        ys = np.frombuffer(self.robot_y, dtype=np.float64, count=n)
+        blade_on = np.frombuffer(self.blade_on, dtype=np.int8, count=n) != 0
+        return np.stack([xs, ys], axis=1), blade_on
@@ -0,0 +1,64 @@
+from math import floor
+
+
+class PointGrid:
+    # Uniform grid hash of keyed points, for nearest point lookups that do
+    # not depend on how many points there are.
+    def __init__(self, cell_size=0.5):
+        self.cell_size = cell_size
+        self.cells = {}    # (i, j) -> set of keys
+        self.points = {}   # key -> (x, y)
+
+    def cell(self, pos):
+        return (floor(pos[0] / self.cell_size),
+                floor(pos[1] / self.cell_size))
+
+    def insert(self, key, pos):
+        if key in self.points:
+            self.remove(key)
+        self.points[key] = pos
+        self.cells.setdefault(self.cell(pos), set()).add(key)
+
+    def remove(self, key):
+        pos = self.points.pop(key, None)
+        if pos is None:
+            return
+        cell = self.cell(pos)
+        keys = self.cells[cell]
+        keys.discard(key)
+        if len(keys) == 0:
+            del self.cells[cell]
+
+    def move(self, key, pos):
+        old = self.points.get(key)
+        if old is not None and self.cell(old) == self.cell(pos):
+            self.points[key] = pos
+        else:
+            self.insert(key, pos)
+
+    def clear(self):
+        self.cells.clear()
+        self.points.clear()
+
+    def nearest(self, pos, radius):
+        # closest key within radius of pos, or None
+        x, y = pos
+        i0, j0 = self.cell((x - radius, y - radius))
+        i1, j1 = self.cell((x + radius, y + radius))
+
+        best = None
+        best_dist = radius * radius
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                for key in self.cells.get((i, j), ()):
+                    px, py = self.points[key]
+                    dist = (px - x) * (px - x) + (py - y) * (py - y)
+                    # ties go to the later instruction
+                    if dist < best_dist or (dist == best_dist
+                                            and (best is None or key > best)):
+                        best = key
+                        best_dist = dist
+        return best
+
+    def __len__(self):
+        return len(self.points)
@@ -0,0 +1,334 @@
+import numpy as np
+from instruction import Line, CubicBezier, BladeOn, BladeOff
+
+OP_BLADE_ON = 0
+OP_BLADE_OFF = 1
+OP_LINE = 2
+OP_CURVE = 3
+
+# number of points each opcode stores
+POINT_COUNT = np.array([0, 0, 2, 4], dtype=np.int64)
+
+# slots per copy-on-write page of the store arrays
+PAGE = 256
+INSTRUCTION_ARRAYS = ("ops", "offsets", "blade", "ends")
+
+
+class Snapshot:
+    # The store as it was when the snapshot was taken. Only the pages
+    # written since are copied, the rest is shared with the live arrays.
+    def __init__(self, id, n, n_points):
+        self.id = id
+        self.n = n
+        self.n_points = n_points
+        self.pages = {}   # (array name, page) -> copy of the page
+
+    def limit(self, name):
+        return self.n_points if name == "points" else self.n
+
+
+def opcode(instruction):
+    if isinstance(instruction, BladeOn):
+        return OP_BLADE_ON
+    if isinstance(instruction, BladeOff):
+        return OP_BLADE_OFF
+    if isinstance(instruction, Line):
+        return OP_LINE
+    if isinstance(instruction, CubicBezier):
+        return OP_CURVE
+    raise ValueError(f"not an instruction: {instruction!r}")
+
+
+class InstructionStore:
+    # Struct of arrays holding a plan. Per instruction i:
+    #   ops[i]      opcode
+    #   offsets[i]  index of its first point in the packed point buffer
+    #   blade[i]    blade state after instruction i
+    #   ends[i]     index of the last end point at or before i, -1 if none
+    # Instructions are handed out as new Line/CubicBezier/... objects, so
+    # changes must go through set_point.
+    def __init__(self, capacity=64):
+        self.n = 0
+        self.n_points = 0
+        self.ops = np.zeros(capacity, dtype=np.int8)
+        self.offsets = np.zeros(capacity, dtype=np.int64)
+        self.blade = np.zeros(capacity, dtype=np.bool_)
+        self.ends = np.zeros(capacity, dtype=np.int64)
+        self.points = np.zeros((capacity * 2, 2), dtype=np.float64)
+
+        self.snapshots = []     # live snapshots, oldest first
+        self.generation = 0     # id of the newest snapshot taken
+        self.written = {}       # (array name, page) -> generation when
+                                # the page was last written
+
+    @classmethod
+    def from_instructions(cls, instructions):
+        store = cls()
+        for instruction in instructions:
+            store.append(instruction)
+        return store
+
+    def reserve(self, n, n_points):
+        if n > len(self.ops):
+            capacity = max(n, 2 * len(self.ops))
+            for name in INSTRUCTION_ARRAYS:
+                old = getattr(self, name)
+                new = np.zeros(capacity, dtype=old.dtype)
+                # past n too, snapshots may still need slots freed by pop
+                new[:len(old)] = old
+                setattr(self, name, new)
+        if n_points > len(self.points):
+            capacity = max(n_points, 2 * len(self.points))
+            new = np.zeros((capacity, 2), dtype=np.float64)
+            new[:len(self.points)] = self.points
+            self.points = new
+
+    def touch(self, name, start, stop):
+        # call before writing slots [start, stop) of an array: copies the
+        # pages snapshots still need into the snapshots
+        if len(self.snapshots) == 0:
+            return
+        array = getattr(self, name)
+        for page in range(start // PAGE, (stop - 1) // PAGE + 1):
+            key = (name, page)
+            written = self.written.get(key, -1)
+            if written == self.generation:
+                continue
+            self.written[key] = self.generation
+            copy = None
+            for snapshot in reversed(self.snapshots):
+                if snapshot.id <= written:
+                    break
+                if page * PAGE < snapshot.limit(name) \
+                        and key not in snapshot.pages:
+                    if copy is None:
+                        copy = array[page * PAGE:(page + 1) * PAGE].copy()
+                    snapshot.pages[key] = copy
+
+    def snapshot(self):
+        self.generation += 1
+        snapshot = Snapshot(self.generation, self.n, self.n_points)
+        self.snapshots.append(snapshot)
+        return snapshot
+
+    def release(self, snapshot):
+        self.snapshots.remove(snapshot)
+
+    def restore(self, snapshot):
+        # returns the indices of instructions that may have changed
+        changed = set()
+        changed_points = []
+        for (name, page), copy in snapshot.pages.items():
+            start = page * PAGE
+            array = getattr(self, name)[start:start + len(copy)]
+            differs = array != copy
+            if differs.ndim > 1:
+                differs = differs.any(axis=1)
+            slots = np.nonzero(differs)[0] + start
+            if len(slots) == 0:
+                continue
+            self.touch(name, start, start + len(copy))
+            array[:] = copy
+            if name == "points":
+                changed_points.append(slots)
+            else:
+                changed.update(slots.tolist())
+
+        old_n = self.n
+        self.n = snapshot.n
+        self.n_points = snapshot.n_points
+        changed.update(range(min(old_n, self.n), max(old_n, self.n)))
+
+        if len(changed_points) > 0:
+            slots = np.concatenate(changed_points)
+            slots = slots[slots < self.n_points]
+            owners = np.searchsorted(self.offsets_view(), slots, "right") - 1
+            changed.update(owners.tolist())
+        return changed
+
+    def append_op(self, op, points=()):
+        count = POINT_COUNT[op]
+        if len(points) != count:
+            raise ValueError(f"opcode {op} takes {count} points, "
+                             f"got {len(points)}")
+        i = self.n
+        offset = self.n_points
+        self.reserve(i + 1, offset + count)
+        for name in INSTRUCTION_ARRAYS:
+            self.touch(name, i, i + 1)
+        if count > 0:
+            self.touch("points", offset, offset + count)
+
+        self.ops[i] = op
+        self.offsets[i] = offset
+        if count > 0:
+            self.points[offset:offset + count] = points
+            self.ends[i] = offset + count - 1
+        else:
+            self.ends[i] = self.ends[i - 1] if i > 0 else -1
+        if op == OP_BLADE_ON:
+            self.blade[i] = True
+        elif op == OP_BLADE_OFF:
+            self.blade[i] = False
+        else:
+            self.blade[i] = self.blade[i - 1] if i > 0 else False
+
+        self.n = i + 1
+        self.n_points = offset + count
+
+    def append_arrays(self, ops, points):
+        # bulk append: ops as opcodes, points as (sum of point counts, 2)
+        ops = np.asarray(ops, dtype=np.int8)
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        counts = POINT_COUNT[ops]
+        if counts.sum() != len(points):
+            raise ValueError(f"{len(ops)} opcodes take {counts.sum()} "
+                             f"points, got {len(points)}")
+        if len(ops) == 0:
+            return
+        i, offset = self.n, self.n_points
+        n, n_points = i + len(ops), offset + len(points)
+        self.reserve(n, n_points)
+        for name in INSTRUCTION_ARRAYS:
+            self.touch(name, i, n)
+        if len(points) > 0:
+            self.touch("points", offset, n_points)
+
+        offsets = offset + np.cumsum(counts) - counts
+        # carry blade state and end point forward from the last
+        # instruction that set them
+        previous_blade = self.blade[i - 1] if i > 0 else False
+        previous_end = self.ends[i - 1] if i > 0 else -1
+        setter = np.where((ops == OP_BLADE_ON) | (ops == OP_BLADE_OFF),
+                          np.arange(len(ops)), -1)
+        setter = np.maximum.accumulate(setter)
+        blade = np.where(setter >= 0, ops[setter] == OP_BLADE_ON,
+                         previous_blade)
+        ends = np.where(counts > 0, offsets + counts - 1, -1)
+        ends = np.maximum.accumulate(ends)
+        ends = np.where(ends >= 0, ends, previous_end)
+
+        self.ops[i:n] = ops
+        self.offsets[i:n] = offsets
+        self.blade[i:n] = blade
+        self.ends[i:n] = ends
+        self.points[offset:n_points] = points
+        self.n = n
+        self.n_points = n_points
+
+    def append(self, instruction):
+        op = opcode(instruction)
+        if op == OP_LINE:
+            self.append_op(op, (instruction.start, instruction.end))
+        elif op == OP_CURVE:
+            self.append_op(op, (instruction.p0, instruction.p1,
+                                instruction.p2, instruction.p3))
+        else:
+            self.append_op(op)
+
+    def extend(self, instructions):
+        for instruction in instructions:
+            self.append(instruction)
+
+    def pop(self):
+        if self.n == 0:
+            raise IndexError("pop from empty instruction store")
+        instruction = self[self.n - 1]
+        self.n -= 1
+        self.n_points = int(self.offsets[self.n])
+        return instruction
+
+    def clear(self):
+        self.n = 0
+        self.n_points = 0
+
+    def index(self, i):
+        if i < 0:
+            i += self.n
+        if not 0 <= i < self.n:
+            raise IndexError("instruction index out of range")
+        return i
+
+    def op(self, i):
+        return int(self.ops[self.index(i)])
+
+    def points_of(self, i):
+        # view of the points of instruction i, (count, 2)
+        i = self.index(i)
+        offset = self.offsets[i]
+        return self.points[offset:offset + POINT_COUNT[self.ops[i]]]
+
+    def set_point(self, i, k, pos):
+        points = self.points_of(i)
+        if not 0 <= k < len(points):
+            return
+        offset = int(self.offsets[self.index(i)]) + k
+        self.touch("points", offset, offset + 1)
+        points[k] = pos
+
+    def end_point(self, i=None):
+        # where the robot is after instruction i, the last one by default
+        if self.n == 0:
+            return (0, 0)
+        end = self.ends[self.index(self.n - 1 if i is None else i)]
+        if end < 0:
+            return (0, 0)
+        return (float(self.points[end, 0]), float(self.points[end, 1]))
+
+    def blade_on(self, i=None):
+        # blade state after instruction i, the last one by default
+        if self.n == 0:
+            return False
+        return bool(self.blade[self.index(self.n - 1 if i is None else i)])
+
+    def ops_view(self):
+        return self.ops[:self.n]
+
+    def offsets_view(self):
+        return self.offsets[:self.n]
+
+    def blade_view(self):
+        return self.blade[:self.n]
+
+    def points_view(self):
+        return self.points[:self.n_points]
+
+    def json_values(self):
+        # the instructions as to_json_value would give them, read straight
+        # from the buffers
+        points = self.points_view().tolist()
+        values = []
+        for op, offset in zip(self.ops_view().tolist(),
+                              self.offsets_view().tolist()):
+            if op == OP_BLADE_ON:
+                values.append('BladeOn')
+            elif op == OP_BLADE_OFF:
+                values.append('BladeOff')
+            elif op == OP_LINE:
+                values.append({'Line': {'start': points[offset],
+                                        'end': points[offset + 1]}})
+            else:
+                values.append({'CubicBezier': {'p0': points[offset],
+                                               'p1': points[offset + 1],
+                                               'p2': points[offset + 2],
+                                               'p3': points[offset + 3]}})
+        return values
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        i = self.index(i)
+        op = self.ops[i]
+        if op == OP_BLADE_ON:
+            return BladeOn()
+        if op == OP_BLADE_OFF:
+            return BladeOff()
+        points = [tuple(p) for p in self.points_of(i).tolist()]
+        if op == OP_LINE:
+            return Line(*points)
+        return CubicBezier(*points)
+
+    def __iter__(self):
+        for i in range(self.n):
+            yield self[i]
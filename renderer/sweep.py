@@ -0,0 +1,163 @@
+import argparse
+import csv
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from math import sqrt
+
+from fastsim import duration_seconds, seconds_duration, param_grid
+from plan_io import read_plan
+from simulate import run_simulator, Duration
+from store import InstructionStore
+
+METRICS = ["steps", "time", "distance", "blade_distance", "x", "y",
+           "theta", "blade_on"]
+
+# the plan every run of a worker process simulates, set by load_plan
+plan = None
+
+
+def load_plan(ops, points):
+    global plan
+    plan = InstructionStore()
+    plan.append_arrays(ops, points)
+
+
+def parse_sim_length(text):
+    # "Indefinite", a number of steps, or seconds ending in "s"
+    if text.lower() == "indefinite":
+        return "Indefinite"
+    if text.endswith("s"):
+        return {"Timed": seconds_duration(float(text[:-1]))}
+    return {"Steps": int(text)}
+
+
+def format_sim_length(length):
+    if length == "Indefinite":
+        return length
+    if "Timed" in length:
+        return f"{duration_seconds(length['Timed'])}s"
+    return str(length["Steps"])
+
+
+def summarize(states):
+    # Reduces the states of a trace one at a time, so a run never holds
+    # its trace. A step's distance counts as cut if the blade was on at
+    # the end of it, as in fastsim.
+    summary = dict.fromkeys(METRICS, 0)
+    steps = -1
+    x = y = None
+    for _, _, state in states:
+        steps += 1
+        if x is not None:
+            dx = state["robot_x"] - x
+            dy = state["robot_y"] - y
+            moved = sqrt(dx * dx + dy * dy)
+            summary["distance"] += moved
+            if state["blade_on"]:
+                summary["blade_distance"] += moved
+        x = state["robot_x"]
+        y = state["robot_y"]
+        summary["theta"] = state["robot_theta"]
+        summary["blade_on"] = state["blade_on"]
+    if steps < 0:
+        raise ValueError("the simulator wrote no states")
+    summary["steps"] = steps
+    summary["x"] = x
+    summary["y"] = y
+    return summary
+
+
+def run(params):
+    # Runs the simulator once on the worker's plan. Returns the summary of
+    # the trace or the error that stopped it.
+    def read(reader):
+        return summarize(reader.states(debug=False)), reader.header
+
+    try:
+        summary, header = run_simulator(params, plan, read)
+        dt = Duration(header["delta_time"]).seconds()
+        summary["time"] = summary["steps"] * dt
+        return summary, None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def sweep(ops, points, grid, names, f, workers=None):
+    # Simulates the plan for every parameter dict in grid on a pool of
+    # worker processes and writes a CSV row to f as each run finishes, so
+    # the table is complete up to the runs still going. The parameters in
+    # names get a column each. Returns the number of failed runs.
+    out = csv.writer(f)
+    out.writerow(["run"] + names + METRICS + ["error"])
+    f.flush()
+    failed = 0
+    with ProcessPoolExecutor(workers, initializer=load_plan,
+                             initargs=(ops, points)) as pool:
+        futures = {pool.submit(run, params): (i, params)
+                   for i, params in enumerate(grid)}
+        for future in as_completed(futures):
+            i, params = futures[future]
+            summary, error = future.result()
+            row = [i]
+            for name in names:
+                value = params[name]
+                if name == "delta_time":
+                    value = duration_seconds(value)
+                elif name == "sim_length":
+                    value = format_sim_length(value)
+                row.append(value)
+            if summary is None:
+                failed += 1
+                row += [""] * len(METRICS) + [error]
+            else:
+                row += [summary[name] for name in METRICS] + [""]
+            out.writerow(row)
+            f.flush()
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the simulator on a plan for every combination of "
+                    "parameters and tabulate the results as CSV")
+    parser.add_argument("plan", help="exported plan JSON")
+    parser.add_argument("--wheel-distance", type=float, nargs="+")
+    parser.add_argument("--wheel-radius", type=float, nargs="+")
+    parser.add_argument("--max-motor-speed", type=float, nargs="+")
+    parser.add_argument("--blade-radius", type=float, nargs="+")
+    parser.add_argument("--delta-time", type=float, nargs="+",
+                        help="seconds")
+    parser.add_argument("--sim-length", type=parse_sim_length, nargs="+",
+                        help="Indefinite, a number of steps or seconds "
+                             "ending in s")
+    parser.add_argument("--output", default=None,
+                        help="CSV file, defaults to stdout")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    with open(args.plan, "r") as f:
+        base, ops, points = read_plan(f)
+    axes = {name: values for name, values in
+            (("wheel_distance", args.wheel_distance),
+             ("wheel_radius", args.wheel_radius),
+             ("max_motor_speed", args.max_motor_speed),
+             ("blade_radius", args.blade_radius),
+             ("delta_time", args.delta_time),
+             ("sim_length", args.sim_length))
+            if values is not None}
+    grid = param_grid(base, **axes)
+
+    f = sys.stdout if args.output is None \
+        else open(args.output, "w", newline="")
+    try:
+        failed = sweep(ops, points, grid, list(axes), f, args.workers)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    if failed > 0:
+        sys.exit(f"{failed} of {len(grid)} runs failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import re
+from collections import OrderedDict
+
+import pygame as pg
+
+# digits on their own, everything between them as one run
+RUNS = re.compile(r"\d|\D+")
+
+
+class TextCache:
+    # Rendered text surfaces keyed by (font, text, color, background), the
+    # least recently used dropped past max_entries. Text that changes
+    # every frame, like a readout of a number, can be drawn from cached
+    # runs instead: the digits and the text between them are rendered
+    # once each, so drawing new text is only blits. Once the same text is
+    # drawn twice, the runs are put together into one cached surface.
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self.surfaces = OrderedDict()
+        self.seen = OrderedDict()   # texts drawn once from runs
+
+    def render(self, font, text, color, background=None) -> pg.Surface:
+        # cached font.render(text, True, color, background), don't draw on
+        # the surface
+        key = (font, text, color, background)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            return surface
+        surface = font.render(text, True, color, background)
+        if pg.display.get_surface() is not None:
+            # in the display's pixel format they blit several times faster
+            surface = surface.convert() if background is not None \
+                else surface.convert_alpha()
+        self.add(key, surface)
+        return surface
+
+    def add(self, key, surface):
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.max_entries:
+            self.surfaces.popitem(last=False)
+
+    def blit(self, target, font, text, pos, color, background=None,
+             runs=False) -> pg.Rect:
+        # draws text at pos and returns the area drawn over. With runs,
+        # the text is put together from cached runs, which can be a pixel
+        # or two narrower than rendering it whole.
+        if not runs:
+            return target.blit(self.render(font, text, color, background),
+                               pos)
+        key = (font, text, color, background, "runs")
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            return target.blit(surface, pos)
+
+        if key not in self.seen:
+            self.seen[key] = True
+            if len(self.seen) > self.max_entries:
+                self.seen.popitem(last=False)
+            return self.blit_runs(target, font, text, pos, color,
+                                  background)
+
+        del self.seen[key]
+        width = self.blit_runs(None, font, text, (0, 0), color,
+                               background).width
+        surface = pg.Surface((width, font.get_height()),
+                             pg.SRCALPHA if background is None else 0)
+        if pg.display.get_surface() is not None:
+            surface = surface.convert() if background is not None \
+                else surface.convert_alpha()
+        surface.fill((0, 0, 0, 0))
+        # the runs don't overlap, copy their pixels as they are
+        self.blit_runs(surface, font, text, (0, 0), color, background,
+                       pg.BLEND_RGBA_MAX)
+        self.add(key, surface)
+        return target.blit(surface, pos)
+
+    def blit_runs(self, target, font, text, pos, color, background,
+                  special_flags=0):
+        # with no target, only measures the text
+        x, y = pos
+        blits = []
+        for run in RUNS.findall(text):
+            surface = self.render(font, run, color, background)
+            blits.append((surface, (x, y), None, special_flags))
+            x += surface.get_width()
+        if target is not None:
+            target.blits(blits, doreturn=False)
+        return pg.Rect(pos[0], y, x - pos[0], font.get_height())
+
+    def clear(self):
+        self.surfaces.clear()
+        self.seen.clear()
+
+
+# shared by everything drawing text in one process
+text_cache = TextCache()